@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class EtlConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'etl'
+
+    def ready(self):
+        from .sqlite import configure_connection
+
+        connection_created.connect(configure_connection)
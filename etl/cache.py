@@ -0,0 +1,135 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack
+
+import pandas as pd
+from django.conf import settings
+
+from .logic import PARSER_VERSION
+
+# Written last, holding the number of batch files of the entry.
+COMPLETE_MARKER = "complete"
+
+
+def store_upload(file):
+    """
+    The `store_upload` function writes an uploaded file under `settings.UPLOAD_FILES`, hashing it while
+    it is streamed to disk. Files are named after their SHA-256 digest, so a resent statement reuses
+    the stored copy instead of being saved again under a new name.
+
+    :param file: Django `UploadedFile` from `request.FILES`.
+    :return: A tuple of the stored file name and its hex digest.
+    """
+    os.makedirs(settings.UPLOAD_FILES, exist_ok=True)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(
+        dir=settings.UPLOAD_FILES, suffix=".part", delete=False
+    ) as tmp:
+        for chunk in file.chunks():
+            digest.update(chunk)
+            tmp.write(chunk)
+
+    filename = f"{digest.hexdigest()}.pdf"
+    path = os.path.join(settings.UPLOAD_FILES, filename)
+    if os.path.exists(path):
+        os.remove(tmp.name)
+    else:
+        os.replace(tmp.name, path)
+    return filename, digest.hexdigest()
+
+
+def entry_path(digest):
+    # Entries of an older parser are never hit again and age out of the cache.
+    return os.path.join(settings.ETL_CACHE_DIR, f"v{PARSER_VERSION}-{digest}")
+
+
+def cached_batches(digest):
+    """
+    The `cached_batches` function looks up the parsed rows of a statement by content hash. A hit marks
+    the entry as recently used and opens every batch file before returning, so an `evict` from another
+    job cannot remove them partway through an ingest; an entry evicted before it was opened is a miss.
+
+    :param digest: SHA-256 hex digest of the statement PDF.
+    :return: A generator of the cached DataFrame batches, or None on a miss.
+    """
+    path = entry_path(digest)
+    stack = ExitStack()
+    try:
+        with open(os.path.join(path, COMPLETE_MARKER)) as marker:
+            count = int(marker.read())
+        os.utime(path)
+        files = [
+            stack.enter_context(open(os.path.join(path, name), "rb"))
+            for name in sorted(os.listdir(path))
+            if name.endswith(".pkl")
+        ]
+    except (FileNotFoundError, ValueError):
+        stack.close()
+        return None
+    if len(files) != count:
+        # Partly removed by an eviction.
+        stack.close()
+        return None
+    return read_batches(stack, files)
+
+
+def read_batches(stack, files):
+    with stack:
+        for file in files:
+            yield pd.read_pickle(file)
+
+
+def cache_batches(digest, batches):
+    """
+    The `cache_batches` function passes parsed batches through while writing each one to a cache entry
+    for `digest`. The entry only becomes visible once every batch was consumed, and the cache is then
+    trimmed to `settings.ETL_CACHE_MAX_BYTES`.
+
+    :param digest: SHA-256 hex digest of the statement PDF.
+    :param batches: Iterable of parsed DataFrame batches.
+    :return: A generator yielding the same batches.
+    """
+    os.makedirs(settings.ETL_CACHE_DIR, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=settings.ETL_CACHE_DIR, suffix=".part")
+    try:
+        count = 0
+        for data in batches:
+            data.to_pickle(os.path.join(tmp, f"{count:06d}.pkl"))
+            count += 1
+            yield data
+
+        with open(os.path.join(tmp, COMPLETE_MARKER), "w") as marker:
+            marker.write(str(count))
+        try:
+            os.rename(tmp, entry_path(digest))
+        except OSError:
+            # Another job cached the same statement first.
+            pass
+        evict()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def entry_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path))
+
+
+def evict():
+    """
+    The `evict` function removes least recently used cache entries until the cache fits in
+    `settings.ETL_CACHE_MAX_BYTES`.
+    """
+    entries = [
+        entry
+        for entry in os.scandir(settings.ETL_CACHE_DIR)
+        if entry.is_dir() and not entry.name.endswith(".part")
+    ]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+
+    total = 0
+    for entry in entries:
+        total += entry_size(entry.path)
+        if total > settings.ETL_CACHE_MAX_BYTES:
+            shutil.rmtree(entry.path, ignore_errors=True)
@@ -0,0 +1,277 @@
+import importlib.util
+import io
+import logging
+import math
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+import tabula
+from django.conf import settings
+from django.db import connection
+from pypdf import PdfReader, PdfWriter
+
+logger = logging.getLogger(__name__)
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def blank_pdf():
+    """
+    The `blank_pdf` function builds a one-page empty PDF used to warm up tabula.
+
+    :return: The PDF document as bytes.
+    """
+    writer = PdfWriter()
+    writer.add_blank_page(width=612, height=792)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def warm_up():
+    """
+    The `warm_up` function initializes an extraction worker: it starts tabula's embedded JVM through
+    jpype and runs one extraction so the tabula and PDFBox classes are loaded before real work arrives.
+    """
+    # Without jpype tabula silently falls back to one JVM per call, which defeats the worker.
+    import jpype  # noqa: F401
+
+    tabula.read_pdf(io.BytesIO(blank_pdf()), pages=1)
+
+
+def read_in_worker(pdf_path, pages, options=None):
+    """
+    The `read_in_worker` function runs tabula over the given pages inside a warm worker process.
+    """
+    return tabula.read_pdf(
+        pdf_path, pages=pages, multiple_tables=True, **(options or {})
+    )
+
+
+class ExtractionService:
+    """
+    Pool of long-lived worker processes, each keeping a warm JVM with tabula loaded, so extraction
+    requests do not pay the JVM start-up and jar loading cost.
+    """
+
+    def __init__(self, workers, max_tasks_per_child=None):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_up,
+            max_tasks_per_child=max_tasks_per_child,
+        )
+
+    def start(self):
+        """
+        The `start` method spawns and warms every worker up front, instead of on the first requests.
+        """
+        for future in [self.executor.submit(int) for _ in range(self.workers)]:
+            future.result()
+
+    def read_tables(self, pdf_path, pages="all", options=None):
+        """
+        The `read_tables` method runs tabula over the given pages on a warm worker.
+
+        :param pdf_path: Absolute path of the PDF file.
+        :param pages: Pages to read, in tabula's page syntax.
+        :param options: Extra `tabula.read_pdf` keyword arguments.
+        :return: The list of tables found, in page order.
+        """
+        return self.executor.submit(read_in_worker, pdf_path, pages, options).result()
+
+    def map(self, pdf_path, ranges, options=None):
+        """
+        The `map` method reads several page ranges of a PDF across the warm workers.
+
+        :param pdf_path: Absolute path of the PDF file.
+        :param ranges: Page ranges in tabula's page syntax.
+        :param options: Extra `tabula.read_pdf` keyword arguments.
+        :return: One list of tables per range, in the order of `ranges`.
+        """
+        return list(
+            self.executor.map(
+                read_in_worker,
+                [pdf_path] * len(ranges),
+                ranges,
+                [options] * len(ranges),
+            )
+        )
+
+    def shutdown(self):
+        """
+        The `shutdown` method stops the workers without waiting and cancels the queued reads.
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_extraction_service():
+    """
+    The `get_extraction_service` function returns the process-wide warm extraction service, creating
+    it on first use. It is disabled when `settings.ETL_WARM_EXTRACTORS` is 0 or jpype is not
+    installed, in which case callers use the one-shot tabula path.
+
+    :return: The shared `ExtractionService`, or None.
+    """
+    global _service
+    if settings.ETL_WARM_EXTRACTORS < 1:
+        return None
+    with _service_lock:
+        if _service is None:
+            if importlib.util.find_spec("jpype") is None:
+                logger.warning("jpype is not installed, using one-shot extraction")
+                return None
+            _service = ExtractionService(
+                settings.ETL_WARM_EXTRACTORS, settings.ETL_WARM_EXTRACTOR_MAX_TASKS
+            )
+    return _service
+
+
+def discard_extraction_service(service):
+    """
+    The `discard_extraction_service` function drops a broken service, so the next request starts a
+    fresh pool.
+
+    :param service: The `ExtractionService` that failed.
+    """
+    global _service
+    with _service_lock:
+        if _service is service:
+            _service = None
+    service.shutdown()
+
+
+def count_pages(pdf_path):
+    """
+    The `count_pages` function returns the number of pages in a PDF document.
+
+    :param pdf_path: Absolute path of the PDF file.
+    :return: The page count.
+    """
+    return len(PdfReader(pdf_path).pages)
+
+
+def page_ranges(page_count, chunks):
+    """
+    The `page_ranges` function splits `page_count` pages into at most `chunks` contiguous ranges in
+    tabula's `"start-end"` page syntax, in page order.
+
+    :param page_count: Number of pages in the document.
+    :param chunks: Maximum number of ranges to produce.
+    :return: A list of page range strings, e.g. `["1-50", "51-100"]`.
+    """
+    size = max(1, math.ceil(page_count / max(1, chunks)))
+    return [
+        f"{start}-{min(start + size - 1, page_count)}"
+        for start in range(1, page_count + 1, size)
+    ]
+
+
+def read_tables_once(pdf_path, pages="all", options=None):
+    """
+    The `read_tables_once` function runs tabula over the given pages of a PDF in a fresh Java process.
+
+    :param pdf_path: Absolute path of the PDF file.
+    :param pages: Pages to read, in tabula's page syntax.
+    :param options: Extra `tabula.read_pdf` keyword arguments (table detection when omitted).
+    :return: The list of tables found, in page order.
+    """
+    return tabula.read_pdf(
+        pdf_path,
+        pages=pages,
+        multiple_tables=True,
+        force_subprocess=True,
+        **(options or {}),
+    )
+
+
+def read_tables(pdf_path, pages="all", options=None):
+    """
+    The `read_tables` function runs tabula over the given pages of a PDF, on the warm extraction
+    service when it is enabled and with a one-shot Java process otherwise.
+
+    :param pdf_path: Absolute path of the PDF file.
+    :param pages: Pages to read, in tabula's page syntax.
+    :param options: Extra `tabula.read_pdf` keyword arguments (table detection when omitted).
+    :return: The list of tables found, in page order.
+    """
+    service = get_extraction_service()
+    if service is not None:
+        try:
+            return service.read_tables(pdf_path, pages, options)
+        except BrokenProcessPool:
+            logger.warning("Extraction service failed, using one-shot extraction")
+            discard_extraction_service(service)
+    return read_tables_once(pdf_path, pages, options)
+
+
+def read_tables_parallel(pdf_path, workers, options=None, page_count=None):
+    """
+    The `read_tables_parallel` function splits the document into page ranges and reads them across a
+    process pool (the warm extraction service when enabled). Tables are merged back in page order, so
+    the result matches `read_tables(pdf_path, options=options)`.
+
+    :param pdf_path: Absolute path of the PDF file.
+    :param workers: Number of worker processes.
+    :param options: Extra `tabula.read_pdf` keyword arguments (table detection when omitted).
+    :param page_count: The document's page count when the caller already knows it.
+    :return: The list of tables found, in page order.
+    """
+    if page_count is None:
+        page_count = count_pages(pdf_path)
+    service = get_extraction_service()
+    if service is not None:
+        workers = min(workers, service.workers)
+    workers = min(workers, page_count // settings.ETL_MIN_PAGES_PER_WORKER)
+    if workers < 2:
+        return read_tables(pdf_path, options=options)
+
+    ranges = page_ranges(page_count, workers)
+    if service is not None:
+        try:
+            chunks = service.map(pdf_path, ranges, options)
+            return [table for chunk in chunks for table in chunk]
+        except BrokenProcessPool:
+            logger.warning("Extraction service failed, using one-shot extraction")
+            discard_extraction_service(service)
+
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        chunks = executor.map(
+            read_tables_once,
+            [pdf_path] * len(ranges),
+            ranges,
+            [options] * len(ranges),
+        )
+        return [table for chunk in chunks for table in chunk]
+
+
+def setup_worker():
+    """
+    The `setup_worker` function sets up Django in a fresh `ingest_statements` worker process.
+    """
+    django.setup()
+
+
+def extract_file(path):
+    """
+    The `extract_file` function extracts one statement in a worker process of `ingest_statements`, so
+    both the tabula calls and the row cleaning of several files run in parallel. It lives here, away
+    from the models, so the worker can unpickle it before `setup_worker` has set up Django.
+
+    :param path: Absolute path of the PDF file.
+    :return: A tuple of the extracted DataFrame and the file's page count.
+    """
+    # Imported here as `logic` loads the models.
+    from .logic import extract_data_from_pdf
+
+    try:
+        return extract_data_from_pdf(str(path)), count_pages(str(path))
+    finally:
+        connection.close()
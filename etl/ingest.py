@@ -0,0 +1,326 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+
+from .cache import cache_batches, cached_batches
+from .logic import COLUMNS, extract_data_from_pdf, stream_data_from_pdf
+from .metrics import stage, track_upload
+from .models import Broker, DailyRollup, DataVersion, IngestJob, InvoiceData
+from .snapshot import update_snapshot
+from .sqlite import retry_busy
+
+# Keeps `Xref IN (...)` lookups below SQLite's bound-parameter limit.
+QUERY_CHUNK_SIZE = 900
+UPDATE_FIELDS = [column for column in COLUMNS + ["Tier"] if column != "Xref"]
+
+
+def stored_keys(xrefs):
+    """
+    The `stored_keys` function returns the settlement date and broker of the given Xrefs that are
+    already stored, querying in chunks that stay below SQLite's bound-parameter limit.
+
+    :param xrefs: Sequence of Xref values.
+    :return: A dictionary mapping each stored Xref to its `(Settlement Date, Broker)`.
+    """
+    found = {}
+    for start in range(0, len(xrefs), QUERY_CHUNK_SIZE):
+        rows = InvoiceData.objects.filter(
+            Xref__in=xrefs[start : start + QUERY_CHUNK_SIZE]
+        ).values_list("Xref", "Settlement Date", "Broker")
+        found.update((xref, (date, broker)) for xref, date, broker in rows)
+    return found
+
+
+def rollup_rows(queryset):
+    """
+    The `rollup_rows` function aggregates `InvoiceData` rows into `DailyRollup` rows.
+
+    :param queryset: The `InvoiceData` rows to aggregate.
+    :return: A generator of unsaved `DailyRollup` instances, one per date, broker and tier.
+    """
+    rows = queryset.values("Settlement Date", "Broker", "Tier").annotate(
+        total=Sum("Total Loan Amount"),
+        count=Count("Xref"),
+        highest=Max("Total Loan Amount"),
+    )
+    for row in rows:
+        yield DailyRollup(
+            settlement_date=row["Settlement Date"],
+            broker=row["Broker"],
+            tier=row["Tier"],
+            total_loan_amount=row["total"],
+            loan_count=row["count"],
+            highest_loan_amount=row["highest"],
+        )
+
+
+def key_filter(keys, date_field, broker_field):
+    """
+    The `key_filter` function matches the rows of the given settlement dates and brokers, one
+    `broker = … AND date IN (…)` term per broker so each is served by the broker/date indexes.
+
+    :param keys: `(settlement date, broker)` pairs.
+    :param date_field: Name of the settlement date field of the filtered model.
+    :param broker_field: Name of the broker field of the filtered model.
+    :return: A `Q` object.
+    """
+    dates = {}
+    for date, broker in keys:
+        dates.setdefault(broker, []).append(date)
+    condition = Q(pk__in=[])
+    for broker, broker_dates in dates.items():
+        condition |= Q(**{broker_field: broker, f"{date_field}__in": broker_dates})
+    return condition
+
+
+def update_brokers(brokers):
+    """
+    The `update_brokers` function adds `brokers` to the `Broker` table, or removes them, according
+    to whether they still have `DailyRollup` rows.
+
+    :param brokers: Brokers touched by the change.
+    """
+    brokers = sorted(brokers)
+    for start in range(0, len(brokers), QUERY_CHUNK_SIZE):
+        chunk = brokers[start : start + QUERY_CHUNK_SIZE]
+        present = set(
+            DailyRollup.objects.filter(broker__in=chunk)
+            .values_list("broker", flat=True)
+            .distinct()
+        )
+        Broker.objects.bulk_create(
+            (Broker(name=name) for name in present), ignore_conflicts=True
+        )
+        Broker.objects.filter(name__in=set(chunk) - present).delete()
+
+
+def refresh_rollup(keys):
+    """
+    The `refresh_rollup` function recomputes the `DailyRollup` rows of exactly the given settlement
+    dates and brokers from the stored `InvoiceData`, and adds or removes those brokers in the `Broker`
+    table. It is used for rows that were updated in place, whose old totals cannot be subtracted.
+
+    :param keys: `(settlement date, broker)` pairs touched by the change.
+    """
+    keys = sorted(set(keys))
+    # Two bound parameters per key at most: the broker and the date.
+    for start in range(0, len(keys), QUERY_CHUNK_SIZE // 2):
+        chunk = keys[start : start + QUERY_CHUNK_SIZE // 2]
+        DailyRollup.objects.filter(
+            key_filter(chunk, "settlement_date", "broker")
+        ).delete()
+        DailyRollup.objects.bulk_create(
+            rollup_rows(
+                InvoiceData.objects.filter(
+                    key_filter(chunk, "Settlement Date", "Broker")
+                )
+            )
+        )
+    update_brokers({broker for _, broker in keys})
+
+
+def add_to_rollup(data):
+    """
+    The `add_to_rollup` function adds newly inserted rows to the `DailyRollup` totals of their date,
+    broker and tier with one upsert per key (`INSERT … ON CONFLICT DO UPDATE`), without reading the
+    stored `InvoiceData`, so each ingest batch costs the size of the batch rather than of the dates
+    it spans.
+
+    :param data: DataFrame of the rows inserted into `InvoiceData`.
+    """
+    if data.empty:
+        return
+    deltas = data.groupby([data["Settlement Date"].dt.date, "Broker", "Tier"])[
+        "Total Loan Amount"
+    ].agg(["sum", "size", "max"])
+    table = connection.ops.quote_name(DailyRollup._meta.db_table)
+    total, count, highest = (
+        connection.ops.quote_name(DailyRollup._meta.get_field(name).column)
+        for name in ["total_loan_amount", "loan_count", "highest_loan_amount"]
+    )
+    key = ", ".join(
+        connection.ops.quote_name(DailyRollup._meta.get_field(name).column)
+        for name in ["settlement_date", "broker", "tier"]
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {table} ({key}, {total}, {count}, {highest}) "
+            f"VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT ({key}) DO UPDATE SET "
+            f"{total} = {table}.{total} + excluded.{total}, "
+            f"{count} = {table}.{count} + excluded.{count}, "
+            f"{highest} = CASE WHEN excluded.{highest} > {table}.{highest} "
+            f"THEN excluded.{highest} ELSE {table}.{highest} END",
+            [
+                (
+                    connection.ops.adapt_datefield_value(date),
+                    broker,
+                    tier,
+                    float(row_total),
+                    int(row_count),
+                    float(row_highest),
+                )
+                for (date, broker, tier), (row_total, row_count, row_highest) in zip(
+                    deltas.index, deltas.itertuples(index=False)
+                )
+            ],
+        )
+    Broker.objects.bulk_create(
+        (Broker(name=name) for name in set(data["Broker"])), ignore_conflicts=True
+    )
+
+
+def data_version():
+    """
+    The `data_version` function returns the current `DataVersion` counter.
+
+    :return: The version as an integer, 0 before the first change.
+    """
+    return (
+        DataVersion.objects.filter(pk=1).values_list("version", flat=True).first() or 0
+    )
+
+
+def bump_data_version():
+    """
+    The `bump_data_version` function increments the `DataVersion` counter and records the time of the
+    change. It is called inside the transaction that changes `InvoiceData`, so the new version becomes
+    visible together with the data.
+    """
+    now = timezone.now()
+    if not DataVersion.objects.filter(pk=1).update(
+        version=F("version") + 1, updated_at=now
+    ):
+        DataVersion.objects.create(pk=1, version=1, updated_at=now)
+
+
+@retry_busy
+def save_rows(data, on_conflict=IngestJob.CONFLICT_ERROR):
+    """
+    The `save_rows` function bulk inserts the rows of an extracted statement DataFrame into the
+    `InvoiceData` model inside a single transaction, resolving rows whose Xref is already stored (or
+    repeated within `data`) according to `on_conflict`:
+
+    - `"error"`: plain insert, a duplicate Xref fails the whole batch.
+    - `"update"`: upsert, the last occurrence of each Xref wins.
+    - `"ignore"`: insert-or-ignore, stored rows and the first occurrence of each Xref win.
+
+    Repeated Xrefs within `data` are counted once as inserted or updated, and their other occurrences
+    as skipped.
+
+    Inserted rows are added to the `DailyRollup` totals and the dates and brokers of updated rows
+    recomputed, see `add_to_rollup` and `refresh_rollup`; the data version is bumped in the same
+    transaction.
+    In the high-concurrency SQLite mode a transaction that finds the database locked is run again,
+    see `sqlite.retry_busy`.
+    With `settings.ANALYTICS_SNAPSHOT` the inserted rows are appended to the columnar snapshot once the
+    transaction commits, see `snapshot.update_snapshot`.
+
+    :param data: DataFrame returned by `extract_data_from_pdf`, or one batch of
+    `stream_data_from_pdf`.
+    :param on_conflict: One of the `IngestJob.CONFLICT_*` policies.
+    :return: A dictionary with the `rows`, `inserted`, `updated` and `skipped` counts.
+    """
+    counts = {"rows": len(data), "inserted": len(data), "updated": 0, "skipped": 0}
+    options = {}
+    new_rows = inserted = data
+    # Keys whose rollup is recomputed from the stored rows instead of incremented.
+    stale = set()
+    with transaction.atomic():
+        if on_conflict != IngestJob.CONFLICT_ERROR:
+            keep = "last" if on_conflict == IngestJob.CONFLICT_UPDATE else "first"
+            data = data.drop_duplicates("Xref", keep=keep)
+            existing = stored_keys(data["Xref"].tolist())
+            new_rows = data[~data["Xref"].isin(list(existing))]
+            counts["inserted"] = len(new_rows)
+            if on_conflict == IngestJob.CONFLICT_UPDATE:
+                # Updated rows may move away from their stored date and broker.
+                updated = data[data["Xref"].isin(list(existing))]
+                stale.update(existing.values())
+                stale.update(zip(updated["Settlement Date"].dt.date, updated["Broker"]))
+                counts["updated"] = len(existing)
+                counts["skipped"] = counts["rows"] - len(data)
+                inserted = None if existing else data
+                options = {
+                    "update_conflicts": True,
+                    "unique_fields": ["Xref"],
+                    "update_fields": UPDATE_FIELDS,
+                }
+            else:
+                counts["skipped"] = counts["rows"] - counts["inserted"]
+                inserted = new_rows
+                options = {"ignore_conflicts": True}
+
+        InvoiceData.objects.bulk_create(
+            (InvoiceData(**vals) for vals in data.to_dict(orient="records")), **options
+        )
+        with stage("rollup"):
+            refresh_rollup(stale)
+            if stale:
+                new_rows = new_rows[
+                    [
+                        key not in stale
+                        for key in zip(
+                            new_rows["Settlement Date"].dt.date, new_rows["Broker"]
+                        )
+                    ]
+                ]
+            add_to_rollup(new_rows)
+            bump_data_version()
+        if settings.ANALYTICS_SNAPSHOT:
+            transaction.on_commit(
+                partial(update_snapshot, inserted, data_version()), robust=True
+            )
+    return counts
+
+
+def ingest_file(
+    filename, timings=None, on_conflict=IngestJob.CONFLICT_ERROR, content_hash=None
+):
+    """
+    The `ingest_file` function extracts the statement stored under `settings.UPLOAD_FILES` and inserts
+    its rows, recording the duration of each stage, the page and row counts and the peak memory with
+    `metrics.track_upload`. With `settings.ETL_STREAMING` the rows are
+    extracted and committed in batches of `settings.ETL_BATCH_SIZE`, bounding peak memory. When the
+    statement's `content_hash` was parsed before, the cached rows are used and tabula is skipped.
+
+    :param filename: Name of the uploaded PDF relative to `settings.UPLOAD_FILES`.
+    :param timings: Optional dictionary receiving per-stage durations in seconds.
+    :param on_conflict: How rows with an already stored Xref are handled, see `save_rows`.
+    :param content_hash: Optional SHA-256 digest of the PDF, enabling the parsed statement cache.
+    :return: A dictionary with the `rows`, `inserted`, `updated` and `skipped` totals and whether the
+    statement came from the cache (`cache_hit`).
+    """
+    with track_upload(filename, timings) as upload:
+        use_cache = content_hash and settings.ETL_CACHE_MAX_BYTES > 0
+        batches = cached_batches(content_hash) if use_cache else None
+        cache_hit = batches is not None
+
+        if not cache_hit:
+            if settings.ETL_STREAMING:
+                batches = stream_data_from_pdf(
+                    filename, settings.ETL_BATCH_SIZE, settings.ETL_PAGES_PER_READ
+                )
+            else:
+                with stage("extract"):
+                    batches = [
+                        extract_data_from_pdf(filename, settings.ETL_EXTRACT_WORKERS)
+                    ]
+            if use_cache:
+                batches = cache_batches(content_hash, batches)
+
+        totals = {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0}
+        totals.update(cache_hit=cache_hit)
+        batches = iter(batches)
+        while True:
+            with stage("extract"):
+                data = next(batches, None)
+            if data is None:
+                upload.counts.update(totals)
+                return totals
+            with stage("insert"):
+                counts = save_rows(data, on_conflict)
+            for key, value in counts.items():
+                totals[key] += value
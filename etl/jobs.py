@@ -0,0 +1,114 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+
+from .ingest import ingest_file
+from .models import IngestJob
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    The `get_executor` function lazily creates the process-wide worker pool that runs ingestion jobs.
+    Extraction shells out to the JVM, so threads are enough to keep several uploads in flight.
+
+    :return: The shared `ThreadPoolExecutor`.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ETL_WORKERS, thread_name_prefix="etl-ingest"
+            )
+    return _executor
+
+
+def submit_job(
+    filename, timings=None, on_conflict=IngestJob.CONFLICT_ERROR, content_hash=""
+):
+    """
+    The `submit_job` function records a queued `IngestJob` for an uploaded file and schedules it on the
+    worker pool once the surrounding transaction commits.
+
+    :param filename: Name of the uploaded PDF relative to `settings.UPLOAD_FILES`.
+    :param timings: Optional stage durations already measured by the caller (e.g. the file save).
+    :param on_conflict: How rows with an already stored Xref are handled, see `ingest.save_rows`.
+    :param content_hash: SHA-256 digest of the file, used to reuse previously parsed statements.
+    :return: The created `IngestJob`.
+    """
+    job = IngestJob.objects.create(
+        filename=filename,
+        timings=timings or {},
+        on_conflict=on_conflict,
+        content_hash=content_hash,
+    )
+    transaction.on_commit(lambda: get_executor().submit(run_job, job.pk))
+    return job
+
+
+def run_job(job_id):
+    """
+    The `run_job` function executes an ingestion job on a worker thread and stores its outcome, row
+    counts and per-stage timings on the `IngestJob` row.
+
+    :param job_id: Primary key of the `IngestJob` to run.
+    """
+    close_old_connections()
+    try:
+        # Only a queued job is claimed, so a job submitted twice (see `recover_jobs`) runs once.
+        if not IngestJob.objects.filter(pk=job_id, status=IngestJob.QUEUED).update(
+            status=IngestJob.RUNNING, started_at=timezone.now()
+        ):
+            return
+        job = IngestJob.objects.get(pk=job_id)
+
+        try:
+            counts = ingest_file(
+                job.filename, job.timings, job.on_conflict, job.content_hash
+            )
+            for key, value in counts.items():
+                setattr(job, key, value)
+            job.status = IngestJob.DONE
+        except Exception as e:
+            logger.exception("Ingestion job %s failed", job_id)
+            job.status = IngestJob.FAILED
+            job.error = str(e)
+
+        job.finished_at = timezone.now()
+        job.save()
+    finally:
+        connections.close_all()
+
+
+def recover_jobs():
+    """
+    The `recover_jobs` function picks up the jobs of a previous server process, which lived only in its
+    worker pool: running jobs died with it and are marked failed, queued jobs are submitted again. It
+    is meant to run once at start-up, before the server accepts uploads.
+
+    :return: A tuple of the requeued and the failed `IngestJob` ids.
+    """
+    running = list(
+        IngestJob.objects.filter(status=IngestJob.RUNNING).values_list("pk", flat=True)
+    )
+    IngestJob.objects.filter(pk__in=running, status=IngestJob.RUNNING).update(
+        status=IngestJob.FAILED,
+        error="Interrupted by a server restart",
+        finished_at=timezone.now(),
+    )
+    queued = list(
+        IngestJob.objects.filter(status=IngestJob.QUEUED)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    for job_id in queued:
+        get_executor().submit(run_job, job_id)
+    return queued, running
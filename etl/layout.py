@@ -0,0 +1,218 @@
+import logging
+import re
+from collections import defaultdict
+
+import pandas as pd
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from pypdf import PdfReader
+
+from .extractor import read_tables, read_tables_parallel
+from .models import LayoutTemplate
+
+logger = logging.getLogger(__name__)
+
+RE_IDS = re.compile(r"^\d+ \d+$")
+RE_DATE = re.compile(r"^\d{2}/\d{2}/\d{4}$")
+
+
+def frame_table(table):
+    """
+    The `frame_table` function normalizes one tabula table into raw statement rows. Tabula consumes the
+    first statement row as the header, so it is put back as data and the columns renumbered.
+
+    :param table: DataFrame returned by tabula for one detected table.
+    :return: The table with empty columns dropped and positional column labels.
+    """
+    table = table.dropna(axis=1, how="all")
+    table = pd.concat([table.columns.to_frame().T, table], ignore_index=True)
+
+    table.columns = range(len(table.columns))
+    return table
+
+
+def layout_fingerprint(pdf_path):
+    """
+    The `layout_fingerprint` function identifies the statement format of a PDF from its page geometry
+    and the software that produced it.
+
+    :param pdf_path: Absolute path of the PDF file.
+    :return: A string key for the `LayoutTemplate` registry.
+    """
+    reader = PdfReader(pdf_path)
+    page = reader.pages[0]
+    metadata = reader.metadata or {}
+    return "|".join(
+        [
+            f"{float(page.mediabox.width):.0f}x{float(page.mediabox.height):.0f}",
+            str(page.rotation),
+            str(metadata.get("/Producer", "")),
+            str(metadata.get("/Creator", "")),
+        ]
+    )[:255]
+
+
+def infer_layout(tables, page_height):
+    """
+    The `infer_layout` function derives a fixed table area and column boundaries from the cells tabula
+    detected. Each boundary sits halfway between the widest text of a column and the start of the next
+    one; the area runs from the top of the detected tables to the bottom of the page so longer pages
+    are not cut off.
+
+    :param tables: Tables from `tabula.read_pdf(..., output_format="json")`.
+    :param page_height: Page height in PDF points.
+    :return: A tuple of the `[top, left, bottom, right]` area and the column boundaries, or None when
+    the detected tables do not share a column layout.
+    """
+    lefts = defaultdict(list)
+    rights = defaultdict(list)
+    for table in tables:
+        for row in table["data"]:
+            for i, cell in enumerate(row):
+                if cell["text"].strip():
+                    lefts[i].append(cell["left"])
+                    rights[i].append(cell["left"] + cell["width"])
+    if not tables or sorted(lefts) != list(range(len(lefts))):
+        return None
+
+    columns = []
+    for i in range(1, len(lefts)):
+        if max(rights[i - 1]) >= min(lefts[i]):
+            return None
+        columns.append(round((max(rights[i - 1]) + min(lefts[i])) / 2, 2))
+
+    area = [
+        max(0, min(table["top"] for table in tables) - 1),
+        max(0, min(table["left"] for table in tables) - 1),
+        page_height,
+        max(table["right"] for table in tables) + 1,
+    ]
+    return area, columns
+
+
+def template_options(template):
+    """
+    The `template_options` function builds the tabula arguments of the fixed-column extraction path:
+    no table detection, a fixed area and column boundaries, and no header row.
+
+    :param template: A usable `LayoutTemplate`.
+    :return: Keyword arguments for `tabula.read_pdf`.
+    """
+    return {
+        "area": template.area,
+        "columns": template.columns,
+        "guess": False,
+        "stream": True,
+        "pandas_options": {"header": None},
+    }
+
+
+def fixed_rows(tables):
+    """
+    The `fixed_rows` function checks the output of the fixed-column path. Blank lines are dropped and
+    every remaining line must look like a statement row; anything else (a footer, a shifted column)
+    means the template does not fit these pages.
+
+    :param tables: Tables read with `template_options`.
+    :return: The raw statement row frames, or None when the template does not fit.
+    """
+    rows = []
+    for table in tables:
+        table = table.dropna(axis=0, how="all").reset_index(drop=True)
+        if table.empty:
+            continue
+        ids = table[0].astype(str).str.match(RE_IDS)
+        dates = table[1].astype(str).str.match(RE_DATE)
+        if not (ids & dates).all():
+            return None
+        rows.append(table)
+    return rows
+
+
+def learn_template(pdf_path, fingerprint):
+    """
+    The `learn_template` function runs table detection on the first pages of a statement, infers a
+    fixed layout from it and keeps the template only if the fixed-column path reproduces the detected
+    rows exactly. Formats that cannot be captured are stored as unusable, so they are learned once.
+
+    :param pdf_path: Absolute path of the PDF file.
+    :param fingerprint: The statement's `layout_fingerprint`.
+    :return: The stored `LayoutTemplate`.
+    """
+    # Imported here as `logic` builds on this module.
+    from .logic import clean_rows
+
+    reader = PdfReader(pdf_path)
+    pages = f"1-{min(len(reader.pages), settings.ETL_LAYOUT_SAMPLE_PAGES)}"
+    page_height = float(reader.pages[0].mediabox.height)
+
+    layout = infer_layout(
+        read_tables(pdf_path, pages, {"output_format": "json"}), page_height
+    )
+    template = LayoutTemplate(fingerprint=fingerprint, usable=False)
+    if layout is not None:
+        template.area, template.columns = layout
+        fixed = fixed_rows(read_tables(pdf_path, pages, template_options(template)))
+        detected = [frame_table(table) for table in read_tables(pdf_path, pages)]
+        try:
+            template.usable = bool(fixed) and clean_rows(
+                pd.concat(fixed, ignore_index=True)
+            ).equals(clean_rows(pd.concat(detected, ignore_index=True)))
+        except (ValueError, TypeError, KeyError):
+            template.usable = False
+
+    logger.info("Learned layout %s (usable=%s)", fingerprint, template.usable)
+    try:
+        template.save()
+    except IntegrityError:
+        # Another job learned the same format concurrently.
+        template = LayoutTemplate.objects.get(fingerprint=fingerprint)
+    return template
+
+
+def find_template(pdf_path):
+    """
+    The `find_template` function returns the layout template registered for the statement format of a
+    PDF, learning it on first sight.
+
+    :param pdf_path: Absolute path of the PDF file.
+    :return: The `LayoutTemplate`, or None when the format has no usable template.
+    """
+    fingerprint = layout_fingerprint(pdf_path)
+    template = LayoutTemplate.objects.filter(fingerprint=fingerprint).first()
+    if template is None:
+        template = learn_template(pdf_path, fingerprint)
+    return template if template.usable else None
+
+
+def read_rows(pdf_path, pages="all", workers=1, page_count=None):
+    """
+    The `read_rows` function reads raw statement rows from a PDF. With `settings.ETL_LAYOUT_TEMPLATES`
+    statements of a known format go through the fixed-column path, skipping tabula's table detection;
+    when the template does not fit the pages, they fall back to detection.
+
+    :param pdf_path: Absolute path of the PDF file.
+    :param pages: Pages to read, in tabula's page syntax.
+    :param workers: Worker processes used to read `"all"` pages in parallel page ranges.
+    :param page_count: The document's page count when the caller already knows it.
+    :return: A list of raw statement row frames with positional columns, in page order.
+    """
+
+    def read(options=None):
+        if workers > 1 and pages == "all":
+            return read_tables_parallel(pdf_path, workers, options, page_count)
+        return read_tables(pdf_path, pages, options)
+
+    template = find_template(pdf_path) if settings.ETL_LAYOUT_TEMPLATES else None
+    if template is not None:
+        rows = fixed_rows(read(template_options(template)))
+        if rows is not None:
+            LayoutTemplate.objects.filter(pk=template.pk).update(hits=F("hits") + 1)
+            return rows
+        LayoutTemplate.objects.filter(pk=template.pk).update(misses=F("misses") + 1)
+        logger.info(
+            "Layout %s does not fit %s, detecting tables", template.pk, pdf_path
+        )
+
+    return [frame_table(table) for table in read()]
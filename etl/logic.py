@@ -1,77 +1,178 @@
+import math
 import os
 import re
 
 import pandas as pd
-import tabula
 from django.conf import settings
 
+from .extractor import count_pages, page_ranges
+from .layout import read_rows
+from .metrics import record, stage
+
 RE_NAME = re.compile(r"[A-Z]{2,}")
 
 
-def get_something(row_data):
-    borrower_name = " ".join(RE_NAME.findall(row_data[4]))
-    if not borrower_name:
-        borrower_name = " ".join(RE_NAME.findall(row_data[3]))
-        if borrower_name:
-            row_data[3] = re.sub(borrower_name, "", row_data[3]).strip()
-    else:
-        row_data[4] = re.sub(borrower_name, "", row_data[4]).strip()
+COLUMNS = [
+    "Settlement Date",
+    "Broker",
+    "Sub Broker",
+    "Description",
+    "Total Loan Amount",
+    "Comission Rate",
+    "Upfront",
+    "Upfront Incl GST",
+    "App ID",
+    "Xref",
+    "Borrower Name",
+]
+AMOUNT_COLUMNS = ["Total Loan Amount", "Comission Rate", "Upfront", "Upfront Incl GST"]
+TIER_BINS = [-math.inf, 50_000, 1_00_000, math.inf]
+TIER_LABELS = ["Tier 3", "Tier 2", "Tier 1"]
 
-    row_data = pd.concat(
-        [row_data, pd.Series(borrower_name)], axis=0, ignore_index=True
-    )
-    return row_data
+# Version of the parsed statement format, part of the parsed statement cache key: bump it whenever
+# `clean_rows`, `layout.frame_table` or the layout templates change the rows extracted from a PDF.
+PARSER_VERSION = 1
 
 
-def extract_data_from_pdf(pdf_file_path):
-    print(pdf_file_path)
-    # Extract tables from PDF
-    tables = tabula.read_pdf(
-        os.path.join(settings.UPLOAD_FILES, pdf_file_path),
-        pages="all",
-        multiple_tables=True,
-    )
+def strip_names(values, names):
+    """
+    The `strip_names` function removes each row's borrower name from the matching text value.
 
-    df = pd.DataFrame()
-    for table in tables:
-        table = table.dropna(axis=1, how="all")
-        table = pd.concat([table.columns.to_frame().T, table], ignore_index=True)
-
-        table.columns = range(len(table.columns))
-        df = pd.concat([df, table], ignore_index=True, axis=0)
-
-    df[[df.shape[1] + 1, df.shape[1] + 2]] = df[0].str.split(" ", expand=True)
-    df.drop(columns=[0], axis=1, inplace=True)
-
-    df = df.apply(get_something, axis=1)
-    df.reset_index(drop=True, inplace=True)
-    df.columns = [
-        "Settlement Date",
-        "Broker",
-        "Sub Broker",
-        "Description",
-        "Total Loan Amount",
-        "Comission Rate",
-        "Upfront",
-        "Upfront Incl GST",
-        "App ID",
-        "Xref",
-        "Borrower Name",
+    :param values: Series of text values.
+    :param names: Series of borrower names aligned with `values`; empty names leave the value as is.
+    :return: A list with the names removed and the remaining text stripped.
+    """
+    return [
+        value.replace(name, "").strip() if name else value
+        for value, name in zip(values, names)
     ]
-    df["Total Loan Amount"] = df["Total Loan Amount"].apply(
-        lambda x: float(str(x).replace(",", ""))
-    )
-    df["Comission Rate"] = df["Comission Rate"].apply(
-        lambda x: float(str(x).replace(",", ""))
-    )
-    df["Upfront"] = df["Upfront"].apply(lambda x: float(str(x).replace(",", "")))
-    df["Upfront Incl GST"] = df["Upfront Incl GST"].apply(
-        lambda x: float(str(x).replace(",", ""))
-    )
-
-    df[["App ID", "Xref"]] = df[["App ID", "Xref"]].astype(int)
-    df["Settlement Date"] = pd.to_datetime(df["Settlement Date"], format="%d/%m/%Y")
-    df["Tier"] = df["Total Loan Amount"].apply(
-        lambda x: "Tier 1" if x > 1_00_000 else "Tier 2" if x > 50_000 else "Tier 3"
-    )
-    return df
+
+
+def parse_amounts(values):
+    """
+    The `parse_amounts` function converts formatted amounts such as `"1,234.50"` to floats.
+
+    :param values: Series of amounts as parsed by tabula (strings or numbers).
+    :return: A float64 Series.
+    """
+    return values.astype(str).str.replace(",", "", regex=False).astype(float)
+
+
+def clean_rows(df):
+    """
+    The `clean_rows` function turns the concatenated raw statement tables into `InvoiceData` rows. The
+    borrower name is the upper-case words of the description, or of the sub broker when the description
+    has none, and is removed from the column it was found in. Every step is column-wise; the text
+    cleaning and the type conversion are measured as the "clean" and "convert" stages.
+
+    :param df: Raw statement rows with positional columns, the first holding `"<App ID> <Xref>"`.
+    :return: A DataFrame with the `COLUMNS` fields plus the loan `Tier`.
+    """
+    with stage("clean"):
+        description_names = df[4].str.findall(RE_NAME).str.join(" ")
+        sub_broker_names = df[3].str.findall(RE_NAME).str.join(" ")
+        sub_broker_names = sub_broker_names.where(description_names == "", "")
+        sub_brokers = strip_names(df[3], sub_broker_names)
+        descriptions = strip_names(df[4], description_names)
+        borrower_names = description_names.where(
+            description_names != "", sub_broker_names
+        )
+
+    with stage("convert"):
+        ids = df[0].str.split(" ", expand=True)
+        data = pd.DataFrame(
+            {
+                "Settlement Date": pd.to_datetime(df[1], format="%d/%m/%Y"),
+                "Broker": df[2].astype(object),
+                "Sub Broker": sub_brokers,
+                "Description": descriptions,
+                **{
+                    column: parse_amounts(df[i])
+                    for i, column in enumerate(AMOUNT_COLUMNS, 5)
+                },
+                "App ID": ids[0].astype(int),
+                "Xref": ids[1].astype(int),
+                "Borrower Name": borrower_names,
+            },
+            columns=COLUMNS,
+        )
+        data["Tier"] = (
+            pd.cut(data["Total Loan Amount"], bins=TIER_BINS, labels=TIER_LABELS)
+            .astype(object)
+            .fillna("Tier 3")
+        )
+    return data.reset_index(drop=True)
+
+
+def iter_rows(pdf_path, pages_per_read):
+    """
+    The `iter_rows` function lazily reads a PDF `pages_per_read` pages at a time, so only one page
+    range of rows is held in memory.
+
+    :param pdf_path: Absolute path of the PDF file.
+    :param pages_per_read: Number of pages passed to each tabula call.
+    :return: A generator of raw statement row frames in page order.
+    """
+    page_count = count_pages(pdf_path)
+    record("pages", page_count)
+    for pages in page_ranges(page_count, math.ceil(page_count / pages_per_read)):
+        with stage("read"):
+            rows = read_rows(pdf_path, pages)
+        yield from rows
+
+
+def iter_batches(tables, batch_size):
+    """
+    The `iter_batches` function regroups a stream of raw row frames into cleaned `InvoiceData` rows of
+    exactly `batch_size` rows (the last batch may be shorter).
+
+    :param tables: Iterable of raw statement row frames, as returned by `read_rows`.
+    :param batch_size: Number of rows per yielded batch.
+    :return: A generator of DataFrames in the shape returned by `clean_rows`.
+    """
+    pending = []
+    pending_rows = 0
+    for table in tables:
+        pending.append(table)
+        pending_rows += len(table)
+        if pending_rows < batch_size:
+            continue
+
+        with stage("concat"):
+            raw = pd.concat(pending, ignore_index=True)
+        for start in range(0, len(raw) - batch_size + 1, batch_size):
+            yield clean_rows(raw.iloc[start : start + batch_size])
+        pending = [raw.iloc[len(raw) - len(raw) % batch_size :].copy()]
+        pending_rows = len(pending[0])
+
+    if pending_rows:
+        with stage("concat"):
+            raw = pd.concat(pending, ignore_index=True)
+        yield clean_rows(raw)
+
+
+def stream_data_from_pdf(pdf_file_path, batch_size, pages_per_read):
+    """
+    The `stream_data_from_pdf` function is the bounded-memory counterpart of `extract_data_from_pdf`:
+    pages are read in ranges and cleaned rows are yielded in fixed-size batches, so peak memory depends
+    on the batch size rather than the document size.
+
+    :param pdf_file_path: Name of the PDF relative to `settings.UPLOAD_FILES`.
+    :param batch_size: Number of rows per yielded batch.
+    :param pages_per_read: Number of pages passed to each tabula call.
+    :return: A generator of DataFrames in the shape returned by `extract_data_from_pdf`.
+    """
+    pdf_path = os.path.join(settings.UPLOAD_FILES, pdf_file_path)
+    return iter_batches(iter_rows(pdf_path, pages_per_read), batch_size)
+
+
+def extract_data_from_pdf(pdf_file_path, workers=1):
+    # Extract tables from PDF
+    pdf_path = os.path.join(settings.UPLOAD_FILES, pdf_file_path)
+    page_count = count_pages(pdf_path)
+    record("pages", page_count)
+    with stage("read"):
+        tables = read_rows(pdf_path, workers=workers, page_count=page_count)
+    with stage("concat"):
+        df = pd.concat(tables, ignore_index=True)
+    return clean_rows(df)
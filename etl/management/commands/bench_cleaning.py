@@ -0,0 +1,85 @@
+import re
+import time
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from etl.logic import COLUMNS, RE_NAME, clean_rows
+from etl.synthetic import synthetic_raw_rows
+
+
+def legacy_get_something(row_data):
+    borrower_name = " ".join(RE_NAME.findall(row_data[4]))
+    if not borrower_name:
+        borrower_name = " ".join(RE_NAME.findall(row_data[3]))
+        if borrower_name:
+            row_data[3] = re.sub(borrower_name, "", row_data[3]).strip()
+    else:
+        row_data[4] = re.sub(borrower_name, "", row_data[4]).strip()
+
+    row_data = pd.concat(
+        [row_data, pd.Series(borrower_name)], axis=0, ignore_index=True
+    )
+    return row_data
+
+
+def legacy_clean_rows(df):
+    """
+    Row-wise cleaning as `extract_data_from_pdf` did it before `clean_rows`, kept as the reference
+    for output equality and timing.
+    """
+    df = df.copy()
+    df[[df.shape[1] + 1, df.shape[1] + 2]] = df[0].str.split(" ", expand=True)
+    df.drop(columns=[0], axis=1, inplace=True)
+
+    df = df.apply(legacy_get_something, axis=1)
+    df.reset_index(drop=True, inplace=True)
+    df.columns = COLUMNS
+    for column in [
+        "Total Loan Amount",
+        "Comission Rate",
+        "Upfront",
+        "Upfront Incl GST",
+    ]:
+        df[column] = df[column].apply(lambda x: float(str(x).replace(",", "")))
+
+    df[["App ID", "Xref"]] = df[["App ID", "Xref"]].astype(int)
+    df["Settlement Date"] = pd.to_datetime(df["Settlement Date"], format="%d/%m/%Y")
+    df["Tier"] = df["Total Loan Amount"].apply(
+        lambda x: "Tier 1" if x > 1_00_000 else "Tier 2" if x > 50_000 else "Tier 3"
+    )
+    return df
+
+
+class Command(BaseCommand):
+    help = "Benchmark the vectorized statement row cleaning against the legacy row-wise path."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=200_000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        raw = synthetic_raw_rows(options["rows"])
+
+        timings = {}
+        results = {}
+        for label, func in [("legacy", legacy_clean_rows), ("vectorized", clean_rows)]:
+            best = float("inf")
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                results[label] = func(raw)
+                best = min(best, time.perf_counter() - start)
+            timings[label] = best
+
+        pd.testing.assert_frame_equal(
+            results["legacy"], results["vectorized"], check_exact=True
+        )
+        for label, seconds in timings.items():
+            self.stdout.write(
+                f"{label:>10}: {seconds:8.3f}s  {options['rows'] / seconds:12,.0f} rows/s"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Outputs identical; speed-up {timings['legacy'] / timings['vectorized']:.1f}x"
+            )
+        )
@@ -0,0 +1,61 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from etl.extractor import ExtractionService, read_tables_once
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare per-file extraction latency of one-shot tabula calls against the warm "
+        "extraction service."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("pdfs", nargs="+", help="PDF files to extract.")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument(
+            "--workers", type=int, default=max(1, settings.ETL_WARM_EXTRACTORS)
+        )
+
+    def measure(self, read, pdfs, repeat):
+        latencies = []
+        for _ in range(repeat):
+            for pdf in pdfs:
+                start = time.perf_counter()
+                read(pdf)
+                latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def report(self, label, latencies):
+        self.stdout.write(
+            f"{label:>9}: mean {statistics.mean(latencies):.3f}s  "
+            f"p50 {statistics.median(latencies):.3f}s  max {max(latencies):.3f}s  "
+            f"({len(latencies)} extractions)"
+        )
+
+    def handle(self, *args, **options):
+        pdfs, repeat = options["pdfs"], options["repeat"]
+        one_shot = self.measure(read_tables_once, pdfs, repeat)
+
+        service = ExtractionService(options["workers"])
+        try:
+            start = time.perf_counter()
+            service.start()
+            startup = time.perf_counter() - start
+            warm = self.measure(service.read_tables, pdfs, repeat)
+        except Exception as e:
+            raise CommandError(f"Warm extraction service failed to start: {e}")
+        finally:
+            service.shutdown()
+
+        self.report("one-shot", one_shot)
+        self.report("warm", warm)
+        self.stdout.write(f"Warm service start-up (paid once): {startup:.3f}s")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Per-file speed-up {statistics.mean(one_shot) / statistics.mean(warm):.1f}x"
+            )
+        )
@@ -0,0 +1,156 @@
+import hashlib
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from etl.extractor import extract_file, setup_worker
+from etl.ingest import save_rows
+from etl.models import IngestJob
+from etl.sqlite import retry_busy
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        "Ingest every PDF statement under a directory. Files already ingested (by content hash) are "
+        "skipped, so an interrupted run resumes where it left off."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument(
+            "--workers", type=int, default=4, help="Files extracted concurrently."
+        )
+        parser.add_argument(
+            "--on-conflict",
+            default=IngestJob.CONFLICT_ERROR,
+            choices=[choice for choice, _ in IngestJob.CONFLICT_CHOICES],
+        )
+
+    def discover(self, directory):
+        paths = sorted(Path(directory).rglob("*.pdf"))
+        done = set(
+            IngestJob.objects.filter(status=IngestJob.DONE).values_list(
+                "content_hash", flat=True
+            )
+        )
+        pending = []
+        for path in paths:
+            digest = file_digest(path)
+            if digest not in done:
+                pending.append((path.resolve(), digest))
+                done.add(digest)
+
+        # Jobs a crashed run left running are retried below under a new job.
+        interrupted = IngestJob.objects.filter(
+            status=IngestJob.RUNNING,
+            content_hash__in=[digest for _, digest in pending],
+        ).update(
+            status=IngestJob.FAILED,
+            error="Interrupted, retried by a later run",
+            finished_at=timezone.now(),
+        )
+        self.stdout.write(
+            f"Found {len(paths)} PDFs, {len(paths) - len(pending)} already ingested or "
+            f"duplicates, {len(pending)} to go ({interrupted} interrupted before)"
+        )
+        return pending
+
+    @retry_busy
+    def store(self, job, data, on_conflict):
+        """
+        Writes one file's rows with `save_rows` and marks its job done in the same transaction, so a
+        crash never leaves a file half ingested and the next run picks it up again. As `save_rows`
+        runs inside this transaction, a locked database is retried here, for the whole file.
+        """
+        with transaction.atomic():
+            counts = save_rows(data, on_conflict)
+            for key, value in counts.items():
+                setattr(job, key, value)
+            job.status = IngestJob.DONE
+            job.finished_at = timezone.now()
+            job.save()
+        return counts
+
+    def handle(self, *args, **options):
+        if not Path(options["directory"]).is_dir():
+            raise CommandError(f"{options['directory']} is not a directory")
+
+        pending = self.discover(options["directory"])
+        totals = {"files": 0, "failed": 0, "pages": 0, "rows": 0}
+        start = time.perf_counter()
+
+        with ProcessPoolExecutor(
+            max_workers=options["workers"],
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=setup_worker,
+        ) as executor:
+            queue = iter(pending)
+            in_flight = {}
+
+            def submit_next():
+                item = next(queue, None)
+                if item is None:
+                    return
+                path, digest = item
+                job = IngestJob.objects.create(
+                    filename=str(path),
+                    content_hash=digest,
+                    on_conflict=options["on_conflict"],
+                    status=IngestJob.RUNNING,
+                    started_at=timezone.now(),
+                )
+                in_flight[executor.submit(extract_file, path)] = job
+
+            for _ in range(options["workers"] * 2):
+                submit_next()
+
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job = in_flight.pop(future)
+                    submit_next()
+                    try:
+                        data, pages = future.result()
+                        counts = self.store(job, data, options["on_conflict"])
+                    except Exception as e:
+                        job.status = IngestJob.FAILED
+                        job.error = str(e)
+                        job.finished_at = timezone.now()
+                        job.save()
+                        totals["failed"] += 1
+                        self.stderr.write(f"{job.filename}: {e}")
+                        continue
+
+                    totals["files"] += 1
+                    totals["pages"] += pages
+                    totals["rows"] += counts["rows"]
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(
+                        f"[{totals['files'] + totals['failed']}/{len(pending)}] "
+                        f"{Path(job.filename).name}: {pages} pages, {counts['rows']} rows "
+                        f"({totals['pages'] / elapsed:.1f} pages/s, "
+                        f"{totals['rows'] / elapsed:.1f} rows/s)"
+                    )
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Ingested {totals['files']} files ({totals['failed']} failed): "
+                f"{totals['pages']} pages, {totals['rows']} rows in {elapsed:.1f}s, "
+                f"{totals['pages'] / max(elapsed, 1e-9):.1f} pages/s, "
+                f"{totals['rows'] / max(elapsed, 1e-9):.1f} rows/s"
+            )
+        )
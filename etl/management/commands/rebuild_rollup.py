@@ -0,0 +1,87 @@
+import math
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from etl.ingest import bump_data_version, rollup_rows
+from etl.models import Broker, DailyRollup, InvoiceData
+
+
+def rollup_values(rollups):
+    return {
+        (row.settlement_date, row.broker, row.tier): (
+            row.total_loan_amount,
+            row.loan_count,
+            row.highest_loan_amount,
+        )
+        for row in rollups
+    }
+
+
+def same_values(expected, actual):
+    return (
+        expected[1] == actual[1]
+        and math.isclose(expected[0], actual[0], rel_tol=1e-9, abs_tol=1e-6)
+        and math.isclose(expected[2], actual[2], rel_tol=1e-9, abs_tol=1e-6)
+    )
+
+
+def broker_names():
+    return set(InvoiceData.objects.values_list("Broker", flat=True).distinct())
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the DailyRollup and Broker tables from InvoiceData, or with --check only compare "
+        "them and fail when they disagree."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Compare the rollup and brokers against the raw table without changing them.",
+        )
+
+    def handle(self, *args, **options):
+        if options["check"]:
+            self.check_rollup()
+            return
+
+        with transaction.atomic():
+            DailyRollup.objects.all().delete()
+            rows = DailyRollup.objects.bulk_create(
+                rollup_rows(InvoiceData.objects.all()), batch_size=5_000
+            )
+            Broker.objects.all().delete()
+            brokers = Broker.objects.bulk_create(
+                (Broker(name=name) for name in broker_names()), batch_size=5_000
+            )
+            bump_data_version()
+        self.stdout.write(f"Rebuilt {len(rows)} rollup rows and {len(brokers)} brokers")
+
+    def check_rollup(self):
+        """
+        Recomputes the rollup from `InvoiceData` and lists the keys and brokers that are missing,
+        unexpected or, for keys, hold different totals. Sums are compared with a small tolerance, as
+        the rollup adds the same amounts in a different order.
+        """
+        expected = rollup_values(rollup_rows(InvoiceData.objects.all()))
+        actual = rollup_values(DailyRollup.objects.all())
+
+        problems = [f"missing {key}" for key in expected.keys() - actual.keys()]
+        problems += [f"unexpected {key}" for key in actual.keys() - expected.keys()]
+        problems += [
+            f"different {key}: expected {expected[key]}, found {actual[key]}"
+            for key in expected.keys() & actual.keys()
+            if not same_values(expected[key], actual[key])
+        ]
+        names = broker_names()
+        stored = set(Broker.objects.values_list("name", flat=True))
+        problems += [f"missing broker {name!r}" for name in names - stored]
+        problems += [f"unexpected broker {name!r}" for name in stored - names]
+        for problem in sorted(problems):
+            self.stderr.write(problem)
+        if problems:
+            raise CommandError(f"Rollup is inconsistent: {len(problems)} keys differ")
+        self.stdout.write(f"Rollup is consistent ({len(expected)} keys)")
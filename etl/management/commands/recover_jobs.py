@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from etl.jobs import get_executor, recover_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Recover the ingestion jobs of a stopped server: mark running jobs failed and run the queued "
+        "ones. Run it before starting the server."
+    )
+
+    def handle(self, *args, **options):
+        requeued, failed = recover_jobs()
+        self.stdout.write(
+            f"Marked {len(failed)} interrupted jobs failed, running {len(requeued)} queued jobs"
+        )
+        get_executor().shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS("Done"))
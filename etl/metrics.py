@@ -0,0 +1,242 @@
+import contextvars
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+COUNT_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+BYTES_BUCKETS = tuple(2**n * 1024 * 1024 for n in range(5, 15))  # 32 MiB to 16 GiB
+
+# Measurements of the upload being ingested by the current thread, see `track_upload`.
+_upload = contextvars.ContextVar("etl_upload", default=None)
+
+
+class Metric:
+    """
+    Process-wide metric with an optional single label, rendered in the Prometheus text format.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, label=None):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, label_value, extra=""):
+        pairs = []
+        if self.label is not None:
+            pairs.append(f'{self.label}="{label_value}"')
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self.lock:
+            for label_value, value in sorted(self.values.items()):
+                lines += self.samples(label_value, value)
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, label_value=None):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def samples(self, label_value, value):
+        return [f"{self.name}{self.labels(label_value)} {value}"]
+
+
+class Histogram(Metric):
+    """
+    Histogram with fixed upper bounds; each label value keeps its per-bucket counts, sum and count.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets, label=None):
+        super().__init__(name, documentation, label)
+        self.buckets = buckets
+
+    def observe(self, value, label_value=None):
+        with self.lock:
+            counts, total = self.values.get(
+                label_value, ([0] * (len(self.buckets) + 1), 0)
+            )
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[label_value] = (counts, total + value)
+
+    def samples(self, label_value, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip([*self.buckets, "+Inf"], counts):
+            cumulative += count
+            le = f'le="{bound}"'
+            lines.append(
+                f"{self.name}_bucket{self.labels(label_value, le)} {cumulative}"
+            )
+        lines.append(f"{self.name}_sum{self.labels(label_value)} {total}")
+        lines.append(f"{self.name}_count{self.labels(label_value)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram(
+    "etl_stage_duration_seconds",
+    "Duration of ETL stages; extract includes read, concat, clean and convert, insert includes "
+    "rollup.",
+    DURATION_BUCKETS,
+    label="stage",
+)
+UPLOAD_SECONDS = Histogram(
+    "etl_upload_duration_seconds",
+    "Duration of statement ingestion.",
+    DURATION_BUCKETS,
+    label="status",
+)
+UPLOAD_ROWS = Histogram(
+    "etl_upload_rows", "Rows per ingested statement.", COUNT_BUCKETS
+)
+UPLOAD_PAGES = Histogram(
+    "etl_upload_pages", "Pages per ingested statement.", COUNT_BUCKETS
+)
+UPLOAD_PEAK_RSS = Histogram(
+    "etl_upload_peak_rss_bytes",
+    "Peak resident memory of the process seen at the stage boundaries of an ingestion.",
+    BYTES_BUCKETS,
+)
+UPLOADS = Counter("etl_uploads_total", "Ingested statements.", label="status")
+ROWS = Counter("etl_rows_total", "Rows ingested.")
+PAGES = Counter("etl_pages_total", "Statement pages read.")
+
+
+def current_rss():
+    """
+    The `current_rss` function returns the resident memory of the process in bytes, or its peak so far
+    where `/proc` is not available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Upload:
+    """
+    Measurements of one ingestion: stage durations, page and row counts and the peak resident memory.
+    """
+
+    def __init__(self, filename, timings):
+        self.filename = filename
+        self.timings = timings
+        self.counts = {}
+        self.peak_rss = current_rss()
+
+    def sample_memory(self):
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+
+@contextmanager
+def stage(name, timings=None):
+    """
+    The `stage` context manager measures the wall-clock duration of an ETL stage. The duration goes to
+    the `etl_stage_duration_seconds` histogram and is added to `timings`, which defaults to the stage
+    durations of the upload being tracked by `track_upload`.
+
+    :param name: Name of the stage, e.g. "read" or "insert".
+    :param timings: Dictionary accumulating durations in seconds under the `name` key.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, name)
+        upload = _upload.get()
+        if timings is None and upload is not None:
+            timings = upload.timings
+        if timings is not None:
+            timings[name] = round(timings.get(name, 0) + elapsed, 4)
+        if upload is not None:
+            upload.sample_memory()
+
+
+def record(name, value):
+    """
+    The `record` function adds to a count, such as "pages", of the upload being tracked, if any.
+    """
+    upload = _upload.get()
+    if upload is not None:
+        upload.counts[name] = upload.counts.get(name, 0) + value
+
+
+@contextmanager
+def track_upload(filename, timings=None):
+    """
+    The `track_upload` context manager collects the measurements of one ingestion run in the current
+    thread. When it exits, the upload's duration, row and page counts and peak memory are added to the
+    histograms and one structured `etl.metrics` log line is written as JSON.
+
+    :param filename: Name of the statement being ingested.
+    :param timings: Dictionary receiving the stage durations, e.g. the `IngestJob` timings.
+    :return: The `Upload`, whose `counts` the caller may extend with its own totals.
+    """
+    upload = Upload(filename, {} if timings is None else timings)
+    token = _upload.set(upload)
+    start = time.perf_counter()
+    status = "failed"
+    try:
+        yield upload
+        status = "done"
+    finally:
+        _upload.reset(token)
+        elapsed = time.perf_counter() - start
+        upload.sample_memory()
+        UPLOADS.inc(label_value=status)
+        UPLOAD_SECONDS.observe(elapsed, status)
+        UPLOAD_PEAK_RSS.observe(upload.peak_rss)
+        if "rows" in upload.counts:
+            ROWS.inc(upload.counts["rows"])
+            UPLOAD_ROWS.observe(upload.counts["rows"])
+        if "pages" in upload.counts:
+            PAGES.inc(upload.counts["pages"])
+            UPLOAD_PAGES.observe(upload.counts["pages"])
+        logger.info(
+            json.dumps(
+                {
+                    "event": "ingest",
+                    "filename": filename,
+                    "status": status,
+                    "seconds": round(elapsed, 4),
+                    "timings": upload.timings,
+                    **upload.counts,
+                    "peak_rss_bytes": upload.peak_rss,
+                }
+            )
+        )
+
+
+def render():
+    """
+    The `render` function exposes every metric in the Prometheus text format, version 0.0.4.
+    """
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
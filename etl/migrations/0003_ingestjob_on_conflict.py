@@ -0,0 +1,41 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etl", "0002_ingestjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ingestjob",
+            name="inserted",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="ingestjob",
+            name="on_conflict",
+            field=models.CharField(
+                choices=[
+                    ("error", "Fail the batch"),
+                    ("update", "Update existing rows"),
+                    ("ignore", "Keep existing rows"),
+                ],
+                default="error",
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="ingestjob",
+            name="skipped",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="ingestjob",
+            name="updated",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etl", "0003_ingestjob_on_conflict"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ingestjob",
+            name="cache_hit",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="ingestjob",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etl", "0004_ingestjob_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LayoutTemplate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fingerprint", models.CharField(max_length=255, unique=True)),
+                ("area", models.JSONField(default=list)),
+                ("columns", models.JSONField(default=list)),
+                ("usable", models.BooleanField(default=True)),
+                ("hits", models.IntegerField(default=0)),
+                ("misses", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etl", "0005_layouttemplate"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="invoicedata",
+            index=models.Index(
+                fields=["Settlement Date", "Total Loan Amount"],
+                name="invoice_date_amount_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoicedata",
+            index=models.Index(
+                fields=["Settlement Date", "Tier"], name="invoice_date_tier_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoicedata",
+            index=models.Index(
+                fields=["Broker", "Settlement Date", "Total Loan Amount"],
+                name="invoice_broker_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoicedata",
+            index=models.Index(
+                fields=["Broker", "Total Loan Amount"], name="invoice_broker_amount_idx"
+            ),
+        ),
+    ]
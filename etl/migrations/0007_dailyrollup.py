@@ -0,0 +1,73 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:41
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def build_rollup(apps, schema_editor):
+    InvoiceData = apps.get_model("etl", "InvoiceData")
+    DailyRollup = apps.get_model("etl", "DailyRollup")
+    rows = InvoiceData.objects.values("Settlement Date", "Broker", "Tier").annotate(
+        total=Sum("Total Loan Amount"),
+        count=Count("Xref"),
+        highest=Max("Total Loan Amount"),
+    )
+    DailyRollup.objects.bulk_create(
+        (
+            DailyRollup(
+                settlement_date=row["Settlement Date"],
+                broker=row["Broker"],
+                tier=row["Tier"],
+                total_loan_amount=row["total"],
+                loan_count=row["count"],
+                highest_loan_amount=row["highest"],
+            )
+            for row in rows
+        ),
+        batch_size=5_000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etl", "0006_invoicedata_report_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("settlement_date", models.DateField()),
+                ("broker", models.CharField(max_length=100)),
+                ("tier", models.CharField(max_length=10)),
+                ("total_loan_amount", models.FloatField(default=0)),
+                ("loan_count", models.IntegerField(default=0)),
+                ("highest_loan_amount", models.FloatField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["broker", "settlement_date"],
+                        name="rollup_broker_date_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="dailyrollup",
+            constraint=models.UniqueConstraint(
+                fields=("settlement_date", "broker", "tier"), name="rollup_key"
+            ),
+        ),
+        migrations.RunPython(build_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    apps.get_model("etl", "DataVersion").objects.create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etl", "0007_dailyrollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DataVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etl", "0008_dataversion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dataversion",
+            name="updated_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
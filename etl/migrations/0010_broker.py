@@ -0,0 +1,36 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+def fill_brokers(apps, schema_editor):
+    InvoiceData = apps.get_model("etl", "InvoiceData")
+    Broker = apps.get_model("etl", "Broker")
+    names = InvoiceData.objects.values_list("Broker", flat=True).distinct()
+    Broker.objects.bulk_create((Broker(name=name) for name in names), batch_size=5_000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etl", "0009_dataversion_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Broker",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.RunPython(fill_brokers, migrations.RunPython.noop),
+    ]
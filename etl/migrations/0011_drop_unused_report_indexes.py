@@ -0,0 +1,21 @@
+# Generated by Django 5.0.3 on 2026-10-18 10:23
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("etl", "0010_broker"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="invoicedata",
+            name="invoice_date_amount_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="invoicedata",
+            name="invoice_date_tier_idx",
+        ),
+    ]
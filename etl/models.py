@@ -1,5 +1,6 @@
 from cpkmodel import CPkModel
 from django.db import models
+from django.utils import timezone
 
 
 class InvoiceData(models.Model):
@@ -26,3 +27,138 @@ class InvoiceData(models.Model):
     upfront = models.FloatField(name="Upfront")
     upfront_incl_gst = models.FloatField(name="Upfront Incl GST")
     tier = models.CharField(name="Tier", null=False, max_length=10)
+
+    class Meta:
+        # The reports read `DailyRollup`; these serve the rollup refresh of rows updated in place (a
+        # broker and its dates) and the per-broker loan statistics.
+        indexes = [
+            models.Index(
+                fields=["Broker", "Settlement Date", "Total Loan Amount"],
+                name="invoice_broker_date_idx",
+            ),
+            models.Index(
+                fields=["Broker", "Total Loan Amount"], name="invoice_broker_amount_idx"
+            ),
+        ]
+
+
+class IngestJob(models.Model):
+    """
+    Background ingestion job for an uploaded statement.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    # What to do with rows whose Xref is already stored.
+    CONFLICT_ERROR = "error"
+    CONFLICT_UPDATE = "update"
+    CONFLICT_IGNORE = "ignore"
+    CONFLICT_CHOICES = [
+        (CONFLICT_ERROR, "Fail the batch"),
+        (CONFLICT_UPDATE, "Update existing rows"),
+        (CONFLICT_IGNORE, "Keep existing rows"),
+    ]
+
+    filename = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    on_conflict = models.CharField(
+        max_length=10, choices=CONFLICT_CHOICES, default=CONFLICT_ERROR
+    )
+    rows = models.IntegerField(default=0)
+    inserted = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+    cache_hit = models.BooleanField(default=False)
+    timings = models.JSONField(default=dict)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    def as_dict(self):
+        return {
+            "id": self.pk,
+            "filename": self.filename,
+            "content_hash": self.content_hash,
+            "status": self.status,
+            "on_conflict": self.on_conflict,
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "cache_hit": self.cache_hit,
+            "timings": self.timings,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class LayoutTemplate(models.Model):
+    """
+    Fixed page layout (table area and column boundaries) learned for a statement format.
+    """
+
+    fingerprint = models.CharField(max_length=255, unique=True)
+    area = models.JSONField(default=list)
+    columns = models.JSONField(default=list)
+    usable = models.BooleanField(default=True)
+    hits = models.IntegerField(default=0)
+    misses = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class DailyRollup(models.Model):
+    """
+    `InvoiceData` totals per settlement date, broker and tier, kept up to date by every ingest batch
+    and read by the `operations` reports.
+    """
+
+    settlement_date = models.DateField()
+    broker = models.CharField(max_length=100)
+    tier = models.CharField(max_length=10)
+    total_loan_amount = models.FloatField(default=0)
+    loan_count = models.IntegerField(default=0)
+    highest_loan_amount = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["settlement_date", "broker", "tier"], name="rollup_key"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["broker", "settlement_date"], name="rollup_broker_date_idx"
+            )
+        ]
+
+
+class DataVersion(models.Model):
+    """
+    Counter bumped in every transaction that changes `InvoiceData`, so derived results (the cached
+    reports) can be keyed by the state of the data they were computed from.
+    """
+
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+
+class Broker(models.Model):
+    """
+    Distinct broker names of `InvoiceData`, maintained with the `DailyRollup` for broker pickers and
+    autocomplete.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
@@ -0,0 +1,272 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+
+from .models import DataVersion, InvoiceData
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within the process.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# InvoiceData field -> dtype of its column file. Dates are days since 1970-01-01 and the dictionary
+# encoded fields hold codes into the name lists of the snapshot metadata.
+COLUMNS = {
+    "Settlement Date": np.int32,
+    "Broker": np.int32,
+    "Sub Broker": np.int32,
+    "Tier": np.int8,
+    "Total Loan Amount": np.float64,
+    "Comission Rate": np.float64,
+    "Upfront": np.float64,
+    "Upfront Incl GST": np.float64,
+}
+DICTIONARY_FIELDS = ["Broker", "Sub Broker", "Tier"]
+EPOCH = date(1970, 1, 1).toordinal()
+BUILD_CHUNK_SIZE = 100_000
+META_FILE = "meta.json"
+
+_write_lock = threading.Lock()
+_read_lock = threading.Lock()
+_snapshot = None
+
+
+def column_file(field):
+    return field.lower().replace(" ", "_") + ".bin"
+
+
+def read_meta():
+    try:
+        with open(os.path.join(settings.ANALYTICS_SNAPSHOT_DIR, META_FILE)) as meta:
+            return json.load(meta)
+    except FileNotFoundError:
+        return None
+
+
+def write_meta(meta):
+    """
+    Replaces the metadata in one rename, so readers see either the old or the new snapshot.
+    """
+    directory = settings.ANALYTICS_SNAPSHOT_DIR
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, suffix=".part", delete=False
+    ) as tmp:
+        json.dump(meta, tmp)
+    os.replace(tmp.name, os.path.join(directory, META_FILE))
+
+
+@contextmanager
+def locked():
+    """
+    Serializes the snapshot writers of every thread and, where `fcntl` is available, every process.
+    """
+    os.makedirs(settings.ANALYTICS_SNAPSHOT_DIR, exist_ok=True)
+    with _write_lock, open(
+        os.path.join(settings.ANALYTICS_SNAPSHOT_DIR, "lock"), "w"
+    ) as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def encode(values, dictionaries):
+    """
+    The `encode` function converts rows into the snapshot column arrays, adding the names seen for the
+    first time to the end of `dictionaries`, so existing codes never change.
+
+    :param values: Dictionary mapping every `COLUMNS` field to a sequence of values; settlement dates
+    as `date` objects or numpy datetimes.
+    :param dictionaries: Dictionary mapping every `DICTIONARY_FIELDS` field to its list of names.
+    :return: A dictionary mapping every field to a numpy array of its column dtype.
+    """
+    arrays = {}
+    for field, dtype in COLUMNS.items():
+        column = values[field]
+        if field == "Settlement Date":
+            days = pd.to_datetime(pd.Series(column)).to_numpy().astype("datetime64[D]")
+            arrays[field] = days.astype(np.int64).astype(dtype)
+        elif field in DICTIONARY_FIELDS:
+            names = dictionaries[field]
+            codes = {name: code for code, name in enumerate(names)}
+            column = pd.Series(column, dtype=object)
+            for name in column.unique():
+                if name not in codes:
+                    codes[name] = len(names)
+                    names.append(name)
+            arrays[field] = column.map(codes).to_numpy(dtype=dtype)
+        else:
+            arrays[field] = np.asarray(column, dtype=dtype)
+    return arrays
+
+
+def encode_rows(rows, dictionaries):
+    return encode(dict(zip(COLUMNS, zip(*rows))), dictionaries)
+
+
+def append_arrays(generation, rows, arrays):
+    """
+    Appends column arrays after the first `rows` rows of each column file, dropping whatever an
+    interrupted append left beyond them.
+    """
+    for field, array in arrays.items():
+        path = os.path.join(generation, column_file(field))
+        with open(path, "r+b") as column:
+            column.truncate(rows * array.itemsize)
+            column.seek(0, os.SEEK_END)
+            column.write(array.tobytes())
+
+
+def write_snapshot():
+    """
+    Writes a new snapshot generation of every `InvoiceData` row, read in one transaction together
+    with the data version they belong to, then switches the metadata to it and removes older
+    generations. Readers holding the old files keep their mappings until they reload.
+
+    :return: The new metadata.
+    """
+    directory = settings.ANALYTICS_SNAPSHOT_DIR
+    generation = tempfile.mkdtemp(dir=directory, prefix="generation-")
+    for field in COLUMNS:
+        open(os.path.join(generation, column_file(field)), "wb").close()
+
+    dictionaries = {field: [] for field in DICTIONARY_FIELDS}
+    rows = 0
+    with transaction.atomic():
+        version = (
+            DataVersion.objects.filter(pk=1).values_list("version", flat=True).first()
+            or 0
+        )
+        chunk = []
+        query_results = InvoiceData.objects.values_list(*COLUMNS).iterator(
+            BUILD_CHUNK_SIZE
+        )
+        for row in query_results:
+            chunk.append(row)
+            if len(chunk) == BUILD_CHUNK_SIZE:
+                append_arrays(generation, rows, encode_rows(chunk, dictionaries))
+                rows += len(chunk)
+                chunk = []
+        if chunk:
+            append_arrays(generation, rows, encode_rows(chunk, dictionaries))
+            rows += len(chunk)
+
+    meta = {
+        "generation": os.path.basename(generation),
+        "version": version,
+        "rows": rows,
+        "dictionaries": dictionaries,
+    }
+    write_meta(meta)
+    for name in os.listdir(directory):
+        if name.startswith("generation-") and name != meta["generation"]:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return meta
+
+
+def build_snapshot():
+    """
+    The `build_snapshot` function rebuilds the columnar snapshot of `InvoiceData` under
+    `settings.ANALYTICS_SNAPSHOT_DIR`.
+
+    :return: The metadata of the new snapshot: its generation, data version, row count and
+    dictionaries.
+    """
+    with locked():
+        return write_snapshot()
+
+
+def update_snapshot(data, version):
+    """
+    The `update_snapshot` function brings the snapshot to `version` after an ingest batch committed.
+    When the snapshot holds the version just before, the inserted rows are appended; otherwise (no
+    snapshot yet, an update of stored rows, or a batch committed meanwhile without reaching the
+    snapshot) it is rebuilt. A snapshot that already reached `version` is left alone.
+
+    :param data: DataFrame of the inserted rows, or None when stored rows were changed.
+    :param version: Data version committed with the batch.
+    """
+    with locked():
+        meta = read_meta()
+        if meta is not None and meta["version"] >= version:
+            return
+        if data is None or meta is None or meta["version"] != version - 1:
+            logger.info(
+                "Rebuilding the analytics snapshot for data version %s", version
+            )
+            write_snapshot()
+            return
+        dictionaries = meta["dictionaries"]
+        arrays = encode({field: data[field] for field in COLUMNS}, dictionaries)
+        generation = os.path.join(settings.ANALYTICS_SNAPSHOT_DIR, meta["generation"])
+        append_arrays(generation, meta["rows"], arrays)
+        write_meta({**meta, "version": version, "rows": meta["rows"] + len(data)})
+
+
+class Snapshot:
+    """
+    Read-only view of a snapshot generation: one memory-mapped numpy array per `COLUMNS` field, shared
+    through the page cache by every process mapping the same files.
+    """
+
+    def __init__(self, meta):
+        self.generation = meta["generation"]
+        self.version = meta["version"]
+        self.rows = meta["rows"]
+        self.dictionaries = meta["dictionaries"]
+        self.columns = {}
+        for field, dtype in COLUMNS.items():
+            path = os.path.join(
+                settings.ANALYTICS_SNAPSHOT_DIR, self.generation, column_file(field)
+            )
+            self.columns[field] = (
+                np.memmap(path, dtype=dtype, mode="r", shape=(self.rows,))
+                if self.rows
+                else np.zeros(0, dtype=dtype)
+            )
+        self._day_range = None
+
+    def day_range(self):
+        """
+        The first and last settlement day of the snapshot, in days since 1970-01-01.
+        """
+        if self._day_range is None:
+            days = self.columns["Settlement Date"]
+            self._day_range = (
+                (int(days.min()), int(days.max())) if self.rows else (0, 0)
+            )
+        return self._day_range
+
+
+def load_snapshot(version):
+    """
+    The `load_snapshot` function returns the snapshot of the given data version, reusing the mapping
+    of the process while the snapshot does not change.
+
+    :param version: Current `DataVersion` counter.
+    :return: A `Snapshot`, or None when the snapshot is missing or holds another version.
+    """
+    global _snapshot
+    meta = read_meta()
+    if meta is None or meta["version"] != version:
+        return None
+    with _read_lock:
+        current = _snapshot
+        if current is None or (current.generation, current.version, current.rows) != (
+            meta["generation"],
+            meta["version"],
+            meta["rows"],
+        ):
+            current = _snapshot = Snapshot(meta)
+    return current
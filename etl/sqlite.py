@@ -0,0 +1,81 @@
+import logging
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+logger = logging.getLogger(__name__)
+
+
+def is_busy(error):
+    return "database is locked" in str(error) or "database is busy" in str(error)
+
+
+def backoff_delays():
+    """
+    The `backoff_delays` function yields the pauses before each retry of a statement or transaction
+    that found the database locked: `SQLITE_BUSY_BACKOFF` seconds, doubling `SQLITE_BUSY_RETRIES` times.
+    """
+    delay = settings.SQLITE_BUSY_BACKOFF
+    for _ in range(settings.SQLITE_BUSY_RETRIES):
+        yield delay
+        delay *= 2
+
+
+def retry_busy_statement(execute, sql, params, many, context):
+    """
+    Database execute wrapper retrying a statement that found the database locked, once SQLite's own
+    `busy_timeout` has run out. Statements inside a transaction are not retried: the transaction may
+    hold a snapshot that can never be upgraded, so it is left to `retry_busy` to run it again whole.
+    """
+    for delay in backoff_delays():
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as e:
+            if context["connection"].in_atomic_block or not is_busy(e):
+                raise
+            logger.warning("Database is locked, retrying in %ss", delay)
+            time.sleep(delay)
+    return execute(sql, params, many, context)
+
+
+def retry_busy(func):
+    """
+    The `retry_busy` decorator runs a function that opens its own transaction again, with backoff, when
+    the database is locked. Inside an outer transaction the error is raised instead, since only the
+    outermost transaction can be rolled back and retried.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if settings.SQLITE_CONCURRENCY and connection.vendor == "sqlite":
+            for delay in backoff_delays():
+                try:
+                    return func(*args, **kwargs)
+                except OperationalError as e:
+                    if connection.in_atomic_block or not is_busy(e):
+                        raise
+                    logger.warning(
+                        "Database is locked, retrying %s in %ss", func.__name__, delay
+                    )
+                    time.sleep(delay)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def configure_connection(sender, connection, **kwargs):
+    """
+    The `configure_connection` function receives `connection_created` and, in the high-concurrency
+    SQLite mode (`settings.SQLITE_CONCURRENCY`), applies `settings.SQLITE_PRAGMAS` to the new
+    connection (WAL, so readers are not blocked by a writer) and installs `retry_busy_statement`.
+    """
+    if connection.vendor != "sqlite" or not settings.SQLITE_CONCURRENCY:
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    # The wrapper list lives on the DatabaseWrapper and outlives reconnects.
+    if retry_busy_statement not in connection.execute_wrappers:
+        connection.execute_wrappers.append(retry_busy_statement)
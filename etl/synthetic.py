@@ -0,0 +1,158 @@
+import random
+from datetime import date, timedelta
+
+import pandas as pd
+
+from .logic import TIER_BINS, TIER_LABELS
+from .models import InvoiceData
+
+NAMES = ["JOHN SMITH", "MARY JONES", "ALI KHAN", "LEE", "ANNA MARIE COLE"]
+BROKERS = ["Acme Finance", "Bolt Lending", "Crux Capital", "Delta Home Loans"]
+
+# Landscape A4 in PDF points, and the left edge of each statement column.
+PAGE_SIZE = (842, 595)
+COLUMN_X = [30, 130, 210, 300, 410, 560, 640, 700, 760]
+FONT_SIZE = 7
+LINE_HEIGHT = 14
+
+
+def statement_row(rng, xref):
+    """
+    The `statement_row` function builds the nine text cells of one statement row, as tabula reads them:
+    "<App ID> <Xref>", settlement date, broker, sub broker, description and the four amounts. The
+    borrower name is in the description or in the sub broker, like in real statements.
+
+    :param rng: `random.Random` instance.
+    :param xref: Xref of the row; the App ID is derived from it.
+    :return: A list of nine strings.
+    """
+    amount = rng.uniform(5_000, 500_000)
+    name = rng.choice(NAMES)
+    in_description = rng.random() < 0.5
+    return [
+        f"{600000 + xref} {xref}",
+        f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024",
+        rng.choice(BROKERS),
+        "Sub Broker" if in_description else f"Sub {name} Pty",
+        f"Refinance {name} loan" if in_description else "Purchase",
+        f"{amount:,.2f}",
+        "0.65",
+        f"{amount * 0.0065:,.2f}",
+        f"{amount * 0.0065 * 1.1:,.2f}",
+    ]
+
+
+def synthetic_raw_rows(rows, seed=0):
+    """
+    The `synthetic_raw_rows` function builds raw statement rows shaped like the concatenated tabula
+    tables `clean_rows` receives.
+
+    :param rows: Number of rows to generate.
+    :param seed: Random seed, so runs are comparable.
+    :return: A DataFrame with positional columns 0-8.
+    """
+    rng = random.Random(seed)
+    return pd.DataFrame([statement_row(rng, 100000 + i) for i in range(rows)])
+
+
+def pdf_text(value):
+    return value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def statement_pdf(path, pages, rows_per_page, seed=0, first_xref=100000):
+    """
+    The `statement_pdf` function writes a synthetic broker statement: `pages` landscape pages of
+    `rows_per_page` rows in the column layout `extract_data_from_pdf` expects. The PDF is written
+    directly, with the standard Helvetica font, so no PDF library is needed.
+
+    :param path: File to write.
+    :param pages: Number of pages.
+    :param rows_per_page: Rows per page; at most 40 fit on a page.
+    :param seed: Random seed, so runs are comparable.
+    :param first_xref: Xref of the first row; the following rows count up from it.
+    :return: The number of rows written.
+    """
+    rng = random.Random(seed)
+    width, height = PAGE_SIZE
+    # Objects 1-3 are the catalog, the page tree and the font; each page adds a page and a content
+    # stream object.
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    xref = first_xref
+    for _ in range(pages):
+        lines = [f"BT /F1 {FONT_SIZE} Tf"]
+        y = height - 35
+        for _ in range(rows_per_page):
+            for x, cell in zip(COLUMN_X, statement_row(rng, xref)):
+                lines.append(f"1 0 0 1 {x} {y} Tm ({pdf_text(cell)}) Tj")
+            xref += 1
+            y -= LINE_HEIGHT
+        lines.append("ET")
+        content = "\n".join(lines).encode("latin-1")
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content)
+        )
+        objects.append(
+            (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+                f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+            ).encode()
+        )
+        page_ids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = (
+        f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] "
+        f"/Count {len(page_ids)} >>"
+    ).encode()
+
+    with open(path, "wb") as pdf:
+        pdf.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(pdf.tell())
+            pdf.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        start = pdf.tell()
+        pdf.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            pdf.write(b"%010d 00000 n \n" % offset)
+        pdf.write(
+            b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (len(objects) + 1, start)
+        )
+    return pages * rows_per_page
+
+
+def invoice_rows(count, seed=0, first_xref=1, brokers=50, days=365):
+    """
+    The `invoice_rows` function generates `InvoiceData` rows directly, for datasets far larger than
+    is practical to extract from PDFs.
+
+    :param count: Number of rows.
+    :param seed: Random seed, so runs are comparable.
+    :param first_xref: Xref of the first row; the following rows count up from it.
+    :param brokers: Number of distinct brokers.
+    :param days: Number of distinct settlement dates, starting on 2024-01-01.
+    :return: A generator of unsaved `InvoiceData` instances.
+    """
+    rng = random.Random(seed)
+    start = date(2024, 1, 1)
+    tiers = list(zip(TIER_BINS[1:], TIER_LABELS))
+    for xref in range(first_xref, first_xref + count):
+        amount = round(rng.uniform(5_000, 500_000), 2)
+        name = rng.choice(NAMES)
+        yield InvoiceData(
+            **{
+                "App ID": 600000 + xref,
+                "Xref": xref,
+                "Settlement Date": start + timedelta(days=rng.randrange(days)),
+                "Broker": f"Broker {rng.randrange(brokers):03d}",
+                "Sub Broker": f"Sub {rng.randrange(brokers * 4):04d}",
+                "Borrower Name": name,
+                "Description": f"Refinance {name} loan",
+                "Total Loan Amount": amount,
+                "Comission Rate": 0.65,
+                "Upfront": round(amount * 0.0065, 2),
+                "Upfront Incl GST": round(amount * 0.0065 * 1.1, 2),
+                "Tier": next(label for bound, label in tiers if amount <= bound),
+            }
+        )
@@ -1,3 +1,923 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from pypdf import PdfReader
+
+from . import extractor
+from .cache import cache_batches, cached_batches
+from .extractor import page_ranges, read_tables
+from .ingest import data_version, save_rows
+from .jobs import recover_jobs
+from .layout import fixed_rows, infer_layout, read_rows
+from .logic import (
+    COLUMNS,
+    clean_rows,
+    extract_data_from_pdf,
+    iter_batches,
+    stream_data_from_pdf,
+)
+from .management.commands.bench_cleaning import legacy_clean_rows
+from .metrics import record, render, stage, track_upload
+from .models import Broker, DailyRollup, IngestJob, InvoiceData, LayoutTemplate
+from .snapshot import load_snapshot, read_meta
+from .sqlite import retry_busy, retry_busy_statement
+from .synthetic import invoice_rows, statement_pdf, synthetic_raw_rows
+
+
+def statement_rows(*rows):
+    """
+    Build a `clean_rows`-shaped DataFrame from `(Xref, date, broker, amount, tier)` tuples.
+    """
+    return pd.DataFrame(
+        [
+            {
+                "Settlement Date": pd.Timestamp(date),
+                "Broker": broker,
+                "Sub Broker": "",
+                "Description": "",
+                "Total Loan Amount": amount,
+                "Comission Rate": 0.5,
+                "Upfront": 1.0,
+                "Upfront Incl GST": 1.1,
+                "App ID": xref,
+                "Xref": xref,
+                "Borrower Name": "",
+                "Tier": tier,
+            }
+            for xref, date, broker, amount, tier in rows
+        ],
+        columns=COLUMNS + ["Tier"],
+    )
+
+
+class InlineExecutor:
+    """
+    Stands in for the job worker pool, running each job on the test thread and its transaction.
+    """
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@mock.patch("etl.jobs.connections", mock.Mock())
+@mock.patch("etl.jobs.close_old_connections", mock.Mock())
+@mock.patch("etl.jobs.get_executor", mock.Mock(return_value=InlineExecutor()))
+class IngestJobTests(TestCase):
+    def setUp(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        settings = override_settings(
+            UPLOAD_FILES=os.path.join(workdir, "uploads"),
+            ETL_CACHE_DIR=os.path.join(workdir, "cache"),
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.workdir = workdir
+
+    def upload(self, content):
+        with self.assertLogs("etl"), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("upload"),
+                {"file": SimpleUploadedFile("statement.pdf", content)},
+            )
+        self.assertEqual(response.status_code, 202)
+        body = response.json()
+        self.assertEqual(body["job_url"], reverse("job_status", args=[body["job_id"]]))
+        return self.client.get(body["job_url"]).json()["details"]
+
+    @skipUnless(shutil.which("java"), "tabula needs Java")
+    def test_upload_runs_job(self):
+        path = os.path.join(self.workdir, "statement.pdf")
+        statement_pdf(path, 2, 5)
+        with open(path, "rb") as pdf:
+            job = self.upload(pdf.read())
+
+        self.assertEqual(job["status"], IngestJob.DONE)
+        self.assertEqual((job["rows"], job["inserted"]), (10, 10))
+        self.assertTrue({"save", "extract", "insert"} <= set(job["timings"]))
+        self.assertIsNotNone(job["finished_at"])
+        self.assertEqual(InvoiceData.objects.count(), 10)
+
+    def test_failed_job(self):
+        job = self.upload(b"not a pdf")
+
+        self.assertEqual(job["status"], IngestJob.FAILED)
+        self.assertTrue(job["error"])
+        self.assertIn("save", job["timings"])
+        self.assertEqual(InvoiceData.objects.count(), 0)
+
+    def test_job_status_not_found(self):
+        self.assertEqual(
+            self.client.get(reverse("job_status", args=[404])).status_code, 404
+        )
+
+    @mock.patch("etl.jobs.ingest_file", return_value={"rows": 3, "inserted": 3})
+    def test_recover_jobs(self, ingest_file):
+        running = IngestJob.objects.create(filename="a.pdf", status=IngestJob.RUNNING)
+        queued = IngestJob.objects.create(filename="b.pdf")
+        done = IngestJob.objects.create(filename="c.pdf", status=IngestJob.DONE)
+
+        self.assertEqual(recover_jobs(), ([queued.pk], [running.pk]))
+        ingest_file.assert_called_once_with("b.pdf", {}, IngestJob.CONFLICT_ERROR, "")
+        statuses = dict(IngestJob.objects.values_list("pk", "status"))
+        self.assertEqual(
+            statuses,
+            {
+                running.pk: IngestJob.FAILED,
+                queued.pk: IngestJob.DONE,
+                done.pk: IngestJob.DONE,
+            },
+        )
+        self.assertEqual(IngestJob.objects.get(pk=queued.pk).rows, 3)
+
+        # A job claimed by another worker in the meantime is not run again.
+        self.assertEqual(recover_jobs(), ([], []))
+        ingest_file.assert_called_once()
+
+
+class StatementCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        settings = override_settings(ETL_CACHE_DIR=self.workdir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.batches = [
+            clean_rows(synthetic_raw_rows(20, seed=seed)) for seed in (1, 2)
+        ]
+
+    def cache(self, digest):
+        return list(cache_batches(digest, iter(self.batches)))
+
+    def test_miss_then_hit(self):
+        self.assertIsNone(cached_batches("a" * 64))
+        self.assertEqual(len(self.cache("a" * 64)), 2)
+
+        cached = list(cached_batches("a" * 64))
+        self.assertEqual(len(cached), 2)
+        for batch, expected in zip(cached, self.batches):
+            pd.testing.assert_frame_equal(batch, expected)
+
+    def test_parser_version_is_part_of_the_key(self):
+        self.cache("a" * 64)
+        with mock.patch("etl.cache.PARSER_VERSION", 2):
+            self.assertIsNone(cached_batches("a" * 64))
+        self.assertIsNotNone(cached_batches("a" * 64))
+
+    def test_partial_entries_are_removed(self):
+        # The consumer stops after the first batch.
+        batches = cache_batches("a" * 64, iter(self.batches))
+        next(batches)
+        batches.close()
+
+        # The parser fails after the first batch.
+        def failing():
+            yield self.batches[0]
+            raise ValueError("bad page")
+
+        with self.assertRaises(ValueError):
+            list(cache_batches("b" * 64, failing()))
+
+        self.assertIsNone(cached_batches("a" * 64))
+        self.assertIsNone(cached_batches("b" * 64))
+        self.assertEqual(os.listdir(self.workdir), [])
+
+    def test_eviction_during_ingest(self):
+        self.cache("a" * 64)
+        entry = os.path.join(self.workdir, os.listdir(self.workdir)[0])
+
+        # Evicted by another job after the lookup: the opened batches are still read.
+        batches = cached_batches("a" * 64)
+        shutil.rmtree(entry)
+        self.assertEqual(len(list(batches)), 2)
+
+        # Partly evicted before the lookup: a miss, so the statement is extracted again.
+        self.cache("a" * 64)
+        os.remove(os.path.join(entry, "000001.pkl"))
+        self.assertIsNone(cached_batches("a" * 64))
+
+    def test_least_recently_used_eviction(self):
+        self.cache("a" * 64)
+        entry = os.path.join(self.workdir, os.listdir(self.workdir)[0])
+        size = sum(item.stat().st_size for item in os.scandir(entry))
+
+        with override_settings(ETL_CACHE_MAX_BYTES=int(size * 2.5)):
+            self.cache("b" * 64)
+            for age, name in enumerate(sorted(os.listdir(self.workdir))):
+                # "a" was used first, "b" after it.
+                os.utime(os.path.join(self.workdir, name), (1000 + age, 1000 + age))
+            self.assertIsNotNone(cached_batches("a" * 64))  # Now "b" is the oldest.
+            self.cache("c" * 64)
+
+            self.assertIsNotNone(cached_batches("a" * 64))
+            self.assertIsNone(cached_batches("b" * 64))
+            self.assertIsNotNone(cached_batches("c" * 64))
+
+
+class CleanRowsTests(SimpleTestCase):
+    def test_matches_legacy_cleaning(self):
+        edge_rows = pd.DataFrame(
+            [
+                ["1 7", "02/01/2024", "A", "Sub", "Loan JO DOE", "1,234,567.5"]
+                + ["0.5", "1,000", "1.1"],
+                ["2 8", "03/01/2024", "B", "Sub MARY ANN JONES Pty", "Purchase"]
+                + ["50,000", "0.5", "1", "1.1"],
+                ["3 9", "03/01/2024", "B", "", "", "100000.00", "0.5", "1", "1.1"],
+                ["4 10", "03/01/2024", "B C", "SUB X", "loan", "100000.01"]
+                + ["0.5", "1", "1.1"],
+            ]
+        )
+        raw = pd.concat([synthetic_raw_rows(200, seed=5), edge_rows], ignore_index=True)
+
+        data = clean_rows(raw)
+        pd.testing.assert_frame_equal(data, legacy_clean_rows(raw), check_exact=True)
+        self.assertEqual(
+            data["Borrower Name"].tail(4).tolist(),
+            ["JO DOE", "MARY ANN JONES", "", "SUB"],
+        )
+        self.assertEqual(data["Total Loan Amount"].iloc[-4], 1_234_567.5)
+
+    def test_blank_xref(self):
+        raw = pd.DataFrame(
+            [["5 ", "03/01/2024", "B", "x", "y", "1", "0.5", "1", "1.1"]]
+        )
+        for clean in (clean_rows, legacy_clean_rows):
+            with self.assertRaises(ValueError):
+                clean(raw)
+
+
+class ExtractionTests(SimpleTestCase):
+    def statement(self, pages, rows_per_page):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        path = os.path.join(workdir, "statement.pdf")
+        statement_pdf(path, pages, rows_per_page)
+        return path
+
+    def test_page_ranges(self):
+        self.assertEqual(page_ranges(10, 3), ["1-4", "5-8", "9-10"])
+        self.assertEqual(page_ranges(100, 2), ["1-50", "51-100"])
+        self.assertEqual(page_ranges(2, 5), ["1-1", "2-2"])
+        self.assertEqual(page_ranges(7, 1), ["1-7"])
+        self.assertEqual(page_ranges(7, 0), ["1-7"])
+        self.assertEqual(page_ranges(0, 4), [])
+
+    def test_iter_batches(self):
+        raw = synthetic_raw_rows(23)
+        tables = [raw.iloc[start : start + 4] for start in range(0, 23, 4)]
+
+        batches = list(iter_batches(tables, 5))
+        self.assertEqual([len(batch) for batch in batches], [5, 5, 5, 5, 3])
+        pd.testing.assert_frame_equal(
+            pd.concat(batches, ignore_index=True), clean_rows(raw)
+        )
+        self.assertEqual([len(batch) for batch in iter_batches(tables, 23)], [23])
+        self.assertEqual(list(iter_batches([], 5)), [])
+
+    @override_settings(ETL_WARM_EXTRACTORS=2)
+    @mock.patch("etl.extractor.read_tables_once", return_value=["one-shot"])
+    @mock.patch("etl.extractor.importlib.util.find_spec", mock.Mock())
+    @mock.patch("etl.extractor.ExtractionService")
+    def test_dead_service_is_replaced(self, service_class, read_tables_once):
+        self.addCleanup(setattr, extractor, "_service", None)
+        dead, fresh = mock.Mock(), mock.Mock()
+        dead.read_tables.side_effect = BrokenProcessPool
+        fresh.read_tables.return_value = ["warm"]
+        service_class.side_effect = [dead, fresh]
+
+        with self.assertLogs("etl.extractor", "WARNING"):
+            self.assertEqual(read_tables("s.pdf", "1-2"), ["one-shot"])
+        read_tables_once.assert_called_once_with("s.pdf", "1-2", None)
+        dead.shutdown.assert_called_once()
+
+        self.assertEqual(read_tables("s.pdf", "1-2"), ["warm"])
+        self.assertEqual(service_class.call_count, 2)
+        read_tables_once.assert_called_once()
+
+    @skipUnless(shutil.which("java"), "tabula needs Java")
+    @override_settings(ETL_LAYOUT_TEMPLATES=False, ETL_WARM_EXTRACTORS=0)
+    def test_stream_matches_extract(self):
+        path = self.statement(3, 4)
+        batches = list(stream_data_from_pdf(path, 5, 2))
+        self.assertEqual([len(batch) for batch in batches], [5, 5, 2])
+        pd.testing.assert_frame_equal(
+            pd.concat(batches, ignore_index=True), extract_data_from_pdf(path)
+        )
+
+    @skipUnless(shutil.which("java"), "tabula needs Java")
+    @override_settings(ETL_MIN_PAGES_PER_WORKER=1, ETL_WARM_EXTRACTORS=0)
+    def test_parallel_matches_serial(self):
+        path = self.statement(4, 5)
+        serial = extract_data_from_pdf(path)
+        self.assertEqual(len(serial), 20)
+        pd.testing.assert_frame_equal(extract_data_from_pdf(path, workers=2), serial)
+
+
+class SaveRowsTests(TestCase):
+    def setUp(self):
+        save_rows(
+            statement_rows(
+                (1, "2024-01-02", "Acme", 10_000.0, "Tier 3"),
+                (2, "2024-01-02", "Acme", 20_000.0, "Tier 3"),
+            )
+        )
+
+    def amounts(self):
+        return dict(InvoiceData.objects.values_list("Xref", "Total Loan Amount"))
+
+    def test_conflict_policies(self):
+        batch = statement_rows(
+            (2, "2024-01-02", "Acme", 21_000.0, "Tier 3"),
+            (3, "2024-01-03", "Bolt", 30_000.0, "Tier 3"),
+        )
+        self.assertEqual(
+            save_rows(batch, IngestJob.CONFLICT_IGNORE),
+            {"rows": 2, "inserted": 1, "updated": 0, "skipped": 1},
+        )
+        self.assertEqual(self.amounts(), {1: 10_000.0, 2: 20_000.0, 3: 30_000.0})
+
+        batch = statement_rows(
+            (3, "2024-01-03", "Bolt", 31_000.0, "Tier 3"),
+            (4, "2024-01-03", "Bolt", 40_000.0, "Tier 3"),
+        )
+        self.assertEqual(
+            save_rows(batch, IngestJob.CONFLICT_UPDATE),
+            {"rows": 2, "inserted": 1, "updated": 1, "skipped": 0},
+        )
+        self.assertEqual(
+            self.amounts(), {1: 10_000.0, 2: 20_000.0, 3: 31_000.0, 4: 40_000.0}
+        )
+
+        batch = statement_rows((5, "2024-01-04", "Crux", 50_000.0, "Tier 3"))
+        self.assertEqual(
+            save_rows(batch),
+            {"rows": 1, "inserted": 1, "updated": 0, "skipped": 0},
+        )
+
+    def test_duplicates_within_batch(self):
+        batch = statement_rows(
+            (1, "2024-01-02", "Acme", 11_000.0, "Tier 3"),
+            (6, "2024-01-05", "Bolt", 60_000.0, "Tier 2"),
+            (6, "2024-01-05", "Bolt", 61_000.0, "Tier 2"),
+        )
+        self.assertEqual(
+            save_rows(batch, IngestJob.CONFLICT_IGNORE),
+            {"rows": 3, "inserted": 1, "updated": 0, "skipped": 2},
+        )
+        self.assertEqual(self.amounts()[6], 60_000.0)
+
+        InvoiceData.objects.filter(Xref=6).delete()
+        self.assertEqual(
+            save_rows(batch, IngestJob.CONFLICT_UPDATE),
+            {"rows": 3, "inserted": 1, "updated": 1, "skipped": 1},
+        )
+        self.assertEqual(self.amounts(), {1: 11_000.0, 2: 20_000.0, 6: 61_000.0})
+
+    def test_error_rolls_back_batch(self):
+        version = data_version()
+        rollup = list(DailyRollup.objects.values_list("loan_count", flat=True))
+        for batch in [
+            statement_rows(
+                (3, "2024-01-03", "Bolt", 30_000.0, "Tier 3"),
+                (1, "2024-01-02", "Acme", 11_000.0, "Tier 3"),
+            ),
+            statement_rows(
+                (3, "2024-01-03", "Bolt", 30_000.0, "Tier 3"),
+                (3, "2024-01-03", "Bolt", 31_000.0, "Tier 3"),
+            ),
+        ]:
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                save_rows(batch, IngestJob.CONFLICT_ERROR)
+
+        self.assertEqual(self.amounts(), {1: 10_000.0, 2: 20_000.0})
+        self.assertEqual(data_version(), version)
+        self.assertEqual(
+            list(DailyRollup.objects.values_list("loan_count", flat=True)), rollup
+        )
+        self.assertFalse(Broker.objects.filter(name="Bolt").exists())
+
+
+def json_table(top, rows):
+    """
+    Build a table in tabula's JSON output from rows of `(left, width, text)` cells, one line per row.
+    """
+    return {
+        "top": top,
+        "left": min(left for row in rows for left, _, _ in row),
+        "right": max(left + width for row in rows for left, width, _ in row),
+        "data": [
+            [{"left": left, "width": width, "text": text} for left, width, text in row]
+            for row in rows
+        ],
+    }
+
+
+class LayoutTests(TestCase):
+    def test_infer_layout(self):
+        tables = [
+            json_table(
+                30, [[(30, 50, "1 7"), (130, 36, "02/01/2024"), (210, 40, "A")]]
+            ),
+            json_table(
+                40, [[(30, 60, "12 17"), (130, 36, "03/01/2024"), (210, 80, "Bolt")]]
+            ),
+        ]
+        self.assertEqual(
+            infer_layout(tables, 595), ([29, 29, 595, 291], [110.0, 188.0])
+        )
+
+        # Overlapping columns and a missing column have no fixed layout.
+        overlapping = json_table(50, [[(30, 120, "1 7"), (130, 36, "02/01/2024")]])
+        self.assertIsNone(infer_layout(tables + [overlapping], 595))
+        gap = json_table(50, [[(30, 50, "1 7"), (130, 36, " "), (210, 40, "A")]])
+        self.assertIsNone(infer_layout([gap], 595))
+        self.assertIsNone(infer_layout([], 595))
+
+    def test_fixed_rows(self):
+        table = pd.DataFrame(
+            [["1 7", "02/01/2024", "A"], [None, None, None], ["2 8", "03/01/2024", "B"]]
+        )
+        rows = fixed_rows([table, pd.DataFrame([[None, None, None]])])
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][0].tolist(), ["1 7", "2 8"])
+
+        footer = pd.DataFrame([["1 7", "02/01/2024", "A"], ["Page 1 of 2", None, None]])
+        self.assertIsNone(fixed_rows([table, footer]))
+
+    @override_settings(ETL_LAYOUT_TEMPLATES=True)
+    @mock.patch("etl.layout.layout_fingerprint", mock.Mock(return_value="format"))
+    @mock.patch("etl.layout.read_tables")
+    def test_template_miss_detects_tables(self, read_tables):
+        template = LayoutTemplate.objects.create(
+            fingerprint="format", area=[0, 0, 595, 842], columns=[100.0, 200.0]
+        )
+        shifted = pd.DataFrame([["1", "7 02/01/2024", "A"]])
+        detected = pd.DataFrame(
+            [["2 8", "03/01/2024", "B"]], columns=["1 7", "02/01/2024", "A"]
+        )
+        read_tables.side_effect = lambda path, pages, options=None: (
+            [shifted] if options else [detected]
+        )
+
+        with self.assertLogs("etl.layout", "INFO"):
+            rows = read_rows("s.pdf")
+        self.assertEqual(rows[0][0].tolist(), ["1 7", "2 8"])
+        self.assertEqual(read_tables.call_count, 2)
+        template.refresh_from_db()
+        self.assertEqual((template.hits, template.misses), (0, 1))
+
+    @skipUnless(shutil.which("java"), "tabula needs Java")
+    @override_settings(ETL_WARM_EXTRACTORS=0, ETL_LAYOUT_SAMPLE_PAGES=2)
+    def test_template_matches_detection(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        path = os.path.join(workdir, "statement.pdf")
+        statement_pdf(path, 3, 6)
+
+        with override_settings(ETL_LAYOUT_TEMPLATES=True), self.assertLogs(
+            "etl.layout"
+        ):
+            fixed = read_rows(path)
+        template = LayoutTemplate.objects.get()
+        self.assertTrue(template.usable)
+        self.assertEqual((template.hits, template.misses), (1, 0))
+
+        detected = read_rows(path)
+        pd.testing.assert_frame_equal(
+            clean_rows(pd.concat(fixed, ignore_index=True)),
+            clean_rows(pd.concat(detected, ignore_index=True)),
+        )
+
+
+@mock.patch(
+    "etl.management.commands.ingest_statements.ProcessPoolExecutor",
+    lambda max_workers, **kwargs: ThreadPoolExecutor(max_workers),
+)
+class IngestStatementsTests(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.statements = {
+            "a.pdf": statement_rows((1, "2024-01-02", "Acme", 10_000.0, "Tier 3")),
+            "b.pdf": statement_rows((2, "2024-01-03", "Bolt", 20_000.0, "Tier 3")),
+        }
+        for name in ["a.pdf", "b.pdf", "copy-of-a.pdf"]:
+            with open(os.path.join(self.directory, name), "wb") as pdf:
+                pdf.write(name.removeprefix("copy-of-").encode())
+
+        patcher = mock.patch(
+            "etl.management.commands.ingest_statements.extract_file",
+            side_effect=lambda path: (self.statements[path.name], 1),
+        )
+        self.extract_file = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ingest(self):
+        out = StringIO()
+        call_command("ingest_statements", self.directory, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_resume(self):
+        crashed = IngestJob.objects.create(
+            filename="b.pdf",
+            content_hash=hashlib.sha256(b"b.pdf").hexdigest(),
+            status=IngestJob.RUNNING,
+        )
+
+        output = self.ingest()
+        self.assertIn("Found 3 PDFs, 1 already ingested or duplicates, 2 to go", output)
+        self.assertEqual(self.extract_file.call_count, 2)
+        self.assertEqual(
+            sorted(InvoiceData.objects.values_list("Xref", flat=True)), [1, 2]
+        )
+        crashed.refresh_from_db()
+        self.assertEqual(crashed.status, IngestJob.FAILED)
+        self.assertEqual(IngestJob.objects.filter(status=IngestJob.DONE).count(), 2)
+
+        # A second run finds every content hash done.
+        self.assertIn("3 already ingested or duplicates, 0 to go", self.ingest())
+        self.assertEqual(self.extract_file.call_count, 2)
+
+    @override_settings(SQLITE_CONCURRENCY=True, SQLITE_BUSY_BACKOFF=0)
+    def test_store_retries_locked_database(self):
+        counts = {"rows": 1, "inserted": 1, "updated": 0, "skipped": 0}
+        with mock.patch(
+            "etl.management.commands.ingest_statements.save_rows",
+            side_effect=[OperationalError("database is locked"), counts, counts],
+        ) as locked_save_rows, self.assertLogs("etl.sqlite", "WARNING"):
+            self.ingest()
+
+        self.assertEqual(locked_save_rows.call_count, 3)
+        self.assertEqual(IngestJob.objects.filter(status=IngestJob.DONE).count(), 2)
+
+
+class DailyRollupTests(TestCase):
+    def rollup(self):
+        return {
+            (str(row.settlement_date), row.broker, row.tier): (
+                row.total_loan_amount,
+                row.loan_count,
+                row.highest_loan_amount,
+            )
+            for row in DailyRollup.objects.all()
+        }
+
+    def test_save_rows_maintains_rollup(self):
+        save_rows(
+            statement_rows(
+                (1, "2024-01-02", "Acme", 10_000.0, "Tier 3"),
+                (2, "2024-01-02", "Acme", 30_000.0, "Tier 3"),
+                (3, "2024-01-03", "Bolt", 200_000.0, "Tier 1"),
+            )
+        )
+        self.assertEqual(
+            self.rollup(),
+            {
+                ("2024-01-02", "Acme", "Tier 3"): (40_000.0, 2, 30_000.0),
+                ("2024-01-03", "Bolt", "Tier 1"): (200_000.0, 1, 200_000.0),
+            },
+        )
+
+        # Xref 3 moves to another broker and date, Xref 1 is ignored as a duplicate.
+        save_rows(
+            statement_rows(
+                (3, "2024-01-05", "Acme", 70_000.0, "Tier 2"),
+            ),
+            IngestJob.CONFLICT_UPDATE,
+        )
+        save_rows(
+            statement_rows((1, "2024-01-02", "Acme", 99.0, "Tier 3")),
+            IngestJob.CONFLICT_IGNORE,
+        )
+        self.assertEqual(
+            self.rollup(),
+            {
+                ("2024-01-02", "Acme", "Tier 3"): (40_000.0, 2, 30_000.0),
+                ("2024-01-05", "Acme", "Tier 2"): (70_000.0, 1, 70_000.0),
+            },
+        )
+        self.assertEqual(list(Broker.objects.values_list("name", flat=True)), ["Acme"])
+        call_command("rebuild_rollup", check=True, stdout=StringIO())
+
+    def test_inserts_do_not_read_stored_rows(self):
+        save_rows(statement_rows((1, "2024-01-02", "Acme", 10_000.0, "Tier 3")))
+        with CaptureQueriesContext(connection) as queries:
+            save_rows(
+                statement_rows(
+                    (2, "2024-01-02", "Acme", 30_000.0, "Tier 3"),
+                    (3, "2024-03-30", "Acme", 5_000.0, "Tier 3"),
+                )
+            )
+        self.assertFalse([q for q in queries if 'FROM "etl_invoicedata"' in q["sql"]])
+        self.assertEqual(
+            self.rollup(),
+            {
+                ("2024-01-02", "Acme", "Tier 3"): (40_000.0, 2, 30_000.0),
+                ("2024-03-30", "Acme", "Tier 3"): (5_000.0, 1, 5_000.0),
+            },
+        )
+
+    def test_update_recomputes_touched_keys(self):
+        save_rows(
+            statement_rows(
+                (1, "2024-01-02", "Acme", 10_000.0, "Tier 3"),
+                (2, "2024-01-02", "Acme", 30_000.0, "Tier 3"),
+                (3, "2024-01-03", "Acme", 20_000.0, "Tier 3"),
+            )
+        )
+        # Xref 4 is new on the key Xref 1 is updated on, and must be counted once.
+        with CaptureQueriesContext(connection) as queries:
+            save_rows(
+                statement_rows(
+                    (1, "2024-01-02", "Acme", 15_000.0, "Tier 3"),
+                    (4, "2024-01-02", "Acme", 1_000.0, "Tier 3"),
+                ),
+                IngestJob.CONFLICT_UPDATE,
+            )
+        self.assertEqual(
+            self.rollup(),
+            {
+                ("2024-01-02", "Acme", "Tier 3"): (46_000.0, 3, 30_000.0),
+                ("2024-01-03", "Acme", "Tier 3"): (20_000.0, 1, 20_000.0),
+            },
+        )
+        call_command("rebuild_rollup", check=True, stdout=StringIO())
+
+        refresh = [
+            q["sql"]
+            for q in queries
+            if 'FROM "etl_invoicedata"' in q["sql"] and "GROUP BY" in q["sql"]
+        ]
+        self.assertEqual(len(refresh), 1)
+        self.assertNotIn("2024-01-03", refresh[0])
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {refresh[0]}")
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("invoice_broker_date_idx", plan)
+
+    def test_check_and_rebuild(self):
+        save_rows(statement_rows((1, "2024-01-02", "Acme", 10_000.0, "Tier 3")))
+        InvoiceData.objects.filter(Xref=1).update(**{"Total Loan Amount": 20_000.0})
+
+        with self.assertRaises(CommandError):
+            call_command(
+                "rebuild_rollup", check=True, stdout=StringIO(), stderr=StringIO()
+            )
+
+        call_command("rebuild_rollup", stdout=StringIO())
+        call_command("rebuild_rollup", check=True, stdout=StringIO())
+        self.assertEqual(
+            self.rollup(), {("2024-01-02", "Acme", "Tier 3"): (20_000.0, 1, 20_000.0)}
+        )
+
+
+class MetricsTests(TestCase):
+    def test_upload_measurements(self):
+        raw = pd.DataFrame(
+            [
+                [
+                    "1 7",
+                    "02/01/2024",
+                    "A",
+                    "Sub",
+                    "Loan JO DOE",
+                    "1,000.5",
+                    "0.5",
+                    "1",
+                    "1.1",
+                ]
+            ]
+        )
+        timings = {"save": 0.5}
+        with self.assertLogs("etl.metrics", "INFO") as logs:
+            with track_upload("s.pdf", timings) as upload:
+                record("pages", 2)
+                with stage("extract"):
+                    data = clean_rows(raw)
+                upload.counts["rows"] = len(data)
+
+        self.assertEqual(data["Borrower Name"].tolist(), ["JO DOE"])
+        self.assertEqual(set(timings), {"save", "extract", "clean", "convert"})
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line["status"], "done")
+        self.assertEqual(line["timings"], timings)
+        self.assertEqual((line["pages"], line["rows"]), (2, 1))
+        self.assertGreater(line["peak_rss_bytes"], 0)
+
+        with self.assertLogs("etl.metrics", "INFO") as logs:
+            with self.assertRaises(ValueError):
+                with track_upload("s.pdf"):
+                    raise ValueError
+        self.assertEqual(json.loads(logs.records[0].getMessage())["status"], "failed")
+
+        body = render()
+        self.assertIn(
+            'etl_stage_duration_seconds_bucket{stage="clean",le="+Inf"}', body
+        )
+        self.assertIn('etl_uploads_total{status="failed"}', body)
+
+    def test_upload_page(self):
+        # "index" also names the operations page, so the path is spelled out.
+        response = self.client.get("/etl/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "index.html")
+
+    def test_metrics_endpoint(self):
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            response["Content-Type"].startswith("text/plain; version=0.0.4")
+        )
+        self.assertIn(
+            "# TYPE etl_stage_duration_seconds histogram", response.content.decode()
+        )
+
+
+class SyntheticDataTests(TestCase):
+    def test_statement_pdf(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "statement.pdf")
+            self.assertEqual(statement_pdf(path, 3, 4, first_xref=500), 12)
+            reader = PdfReader(path)
+            self.assertEqual(len(reader.pages), 3)
+            text = reader.pages[2].extract_text()
+        self.assertIn("600508 508", text)
+        self.assertIn("600511 511", text)
+
+    def test_raw_rows_clean(self):
+        data = clean_rows(synthetic_raw_rows(50, seed=3))
+        self.assertEqual(data["Xref"].tolist(), list(range(100000, 100050)))
+        self.assertTrue(data["Borrower Name"].str.len().gt(0).all())
+
+    def test_invoice_rows(self):
+        InvoiceData.objects.bulk_create(invoice_rows(200, brokers=3, days=10))
+        call_command("rebuild_rollup", stdout=StringIO())
+        call_command("rebuild_rollup", check=True, stdout=StringIO())
+        self.assertEqual(InvoiceData.objects.count(), 200)
+        self.assertEqual(Broker.objects.count(), 3)
+        for row in InvoiceData.objects.all():
+            amount = row.__dict__["Total Loan Amount"]
+            expected = (
+                "Tier 1"
+                if amount > 100_000
+                else "Tier 2" if amount > 50_000 else "Tier 3"
+            )
+            self.assertEqual(row.__dict__["Tier"], expected)
+
+
+class SQLiteConcurrencyTests(SimpleTestCase):
+    def connect(self, path):
+        wrapper = DatabaseWrapper(
+            {**connection.settings_dict, "NAME": path, "OPTIONS": {"timeout": 0.2}}
+        )
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def read_during_write(self, workdir):
+        """
+        Counts the rows of a table from one connection while another holds an exclusive transaction
+        with an uncommitted insert.
+        """
+        path = os.path.join(workdir, "db.sqlite3")
+        writer, reader = self.connect(path), self.connect(path)
+        with writer.cursor() as cursor:
+            cursor.execute("CREATE TABLE loan (amount REAL)")
+            cursor.execute("INSERT INTO loan VALUES (1.0)")
+            cursor.execute("BEGIN EXCLUSIVE")
+            cursor.execute("INSERT INTO loan VALUES (2.0)")
+            try:
+                with reader.cursor() as read:
+                    read.execute("PRAGMA journal_mode")
+                    journal_mode = read.fetchone()[0]
+                    read.execute("SELECT COUNT(*) FROM loan")
+                    return journal_mode, read.fetchone()[0], reader
+            finally:
+                cursor.execute("ROLLBACK")
+
+    @override_settings(SQLITE_CONCURRENCY=False)
+    def test_writer_blocks_readers_by_default(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            with self.assertRaisesMessage(OperationalError, "database is locked"):
+                self.read_during_write(workdir)
+
+    @override_settings(SQLITE_CONCURRENCY=True, SQLITE_BUSY_RETRIES=1)
+    def test_readers_not_blocked_in_wal_mode(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            journal_mode, count, reader = self.read_during_write(workdir)
+            self.assertEqual(journal_mode, "wal")
+            self.assertEqual(count, 1)
+            self.assertIn(retry_busy_statement, reader.execute_wrappers)
+            with reader.cursor() as cursor:
+                cursor.execute("PRAGMA synchronous")
+                self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    @override_settings(SQLITE_CONCURRENCY=True)
+    def test_reconnect_installs_one_wrapper(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            reader = self.connect(os.path.join(workdir, "db.sqlite3"))
+            for _ in range(3):
+                with reader.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                reader.close()
+            self.assertEqual(reader.execute_wrappers.count(retry_busy_statement), 1)
+
+    @override_settings(SQLITE_CONCURRENCY=True, SQLITE_BUSY_BACKOFF=0)
+    def test_retry_busy(self):
+        attempts = []
+
+        @retry_busy
+        def write(fail_times, message="database is locked"):
+            attempts.append(1)
+            if len(attempts) <= fail_times:
+                raise OperationalError(message)
+            return "done"
+
+        with self.assertLogs("etl.sqlite", "WARNING"):
+            self.assertEqual(write(2), "done")
+        self.assertEqual(len(attempts), 3)
+
+        attempts.clear()
+        with self.assertLogs("etl.sqlite", "WARNING") as logs:
+            with self.assertRaises(OperationalError):
+                write(10)
+        self.assertEqual(len(attempts), 6)
+        self.assertEqual(len(logs.records), 5)
+
+        attempts.clear()
+        with self.assertNoLogs("etl.sqlite", "WARNING"):
+            with self.assertRaisesMessage(OperationalError, "no such table"):
+                write(1, "no such table: loan")
+        self.assertEqual(len(attempts), 1)
+
+
+class SnapshotTests(TestCase):
+    def test_ingest_appends_to_snapshot(self):
+        with tempfile.TemporaryDirectory() as workdir, override_settings(
+            ANALYTICS_SNAPSHOT=True, ANALYTICS_SNAPSHOT_DIR=workdir
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                save_rows(
+                    statement_rows(
+                        (1, "2024-01-02", "Bolt", 10_000.0, "Tier 3"),
+                        (2, "2024-01-03", "Acme", 200_000.0, "Tier 1"),
+                    )
+                )
+            first = read_meta()
+            self.assertEqual((first["rows"], first["version"]), (2, data_version()))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                save_rows(
+                    statement_rows(
+                        (2, "2024-01-03", "Acme", 1.0, "Tier 3"),
+                        (3, "2024-01-04", "Crux", 70_000.0, "Tier 2"),
+                    ),
+                    IngestJob.CONFLICT_IGNORE,
+                )
+            meta = read_meta()
+            self.assertEqual(meta["generation"], first["generation"])
+            self.assertEqual(meta["rows"], 3)
+            self.assertEqual(meta["dictionaries"]["Broker"], ["Bolt", "Acme", "Crux"])
+            snapshot = load_snapshot(data_version())
+            self.assertEqual(
+                snapshot.columns["Total Loan Amount"].tolist(),
+                [10_000.0, 200_000.0, 70_000.0],
+            )
+            self.assertEqual(
+                snapshot.columns["Settlement Date"].tolist(), [19724, 19725, 19726]
+            )
+
+            # Updating stored rows rebuilds the snapshot from the table.
+            with self.captureOnCommitCallbacks(execute=True):
+                save_rows(
+                    statement_rows((1, "2024-01-02", "Bolt", 20_000.0, "Tier 3")),
+                    IngestJob.CONFLICT_UPDATE,
+                )
+            meta = read_meta()
+            self.assertNotEqual(meta["generation"], first["generation"])
+            self.assertEqual((meta["rows"], meta["version"]), (3, data_version()))
+            self.assertEqual(
+                sorted(load_snapshot(data_version()).columns["Total Loan Amount"]),
+                [20_000.0, 70_000.0, 200_000.0],
+            )
+            self.assertIsNone(load_snapshot(data_version() - 1))
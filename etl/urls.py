@@ -6,4 +6,6 @@ from . import views
 urlpatterns = [
     path("", views.index, name="index"),
     path("upload/", views.upload_file, name="upload"),
+    path("jobs/<int:job_id>/", views.job_status, name="job_status"),
+    path("metrics/", views.metrics, name="metrics"),
 ]
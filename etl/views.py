@@ -1,10 +1,12 @@
-from django.conf import settings
-from django.core.files.storage import FileSystemStorage
-from django.http import HttpResponseBadRequest, JsonResponse
-from django.shortcuts import render
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
 
-from .logic import extract_data_from_pdf
-from .models import InvoiceData
+from .cache import store_upload
+from .jobs import submit_job
+from .metrics import render as render_metrics
+from .metrics import stage
+from .models import IngestJob
 
 
 def index(request):
@@ -29,31 +31,77 @@ def index(request):
 
 def upload_file(request):
     """
-    The `upload_file` function handles file uploads, saves the file to a specified location, extracts
-    data from a PDF file, and bulk creates records in the `InvoiceData` model.
+    The `upload_file` function handles file uploads, saves the file under its content hash and queues
+    an ingestion job that extracts the PDF data and bulk creates records in the `InvoiceData` model on
+    the background worker pool. The optional `on_conflict` form field ("error", "update" or "ignore")
+    selects how rows whose Xref is already stored are handled.
 
     :param request: The `request` parameter in the `upload_file` function is typically an HttpRequest
     object that represents the HTTP request made by the client. It contains information about the
     request, such as the method used (GET, POST, etc.), any data sent in the request (such as form data
     or files),
-    :return: A JsonResponse with the status "Pass" and details "File Upload Successfully!" is being
-    returned if the request method is "POST" and the file is successfully uploaded and processed. If the
-    request method is not "POST", an HttpResponseBadRequest with the message "Method Not Allowed" is
-    being returned.
+    :return: A JsonResponse with HTTP status 202, the status "Pass", the queued job id and the URL
+    where the job status can be polled is returned if the request method is "POST" and the file is
+    successfully saved. If the request method is not "POST", an HttpResponseBadRequest with the message
+    "Method Not Allowed" is being returned.
     """
     if request.method == "POST":
         file = request.FILES.get("file")
         if not file:
-            HttpResponseBadRequest("Please Upload a valid file first")
+            return HttpResponseBadRequest("Please Upload a valid file first")
 
-        fss = FileSystemStorage(location=settings.UPLOAD_FILES)
-        filename = fss.save(file.name, file)
+        on_conflict = request.POST.get("on_conflict", IngestJob.CONFLICT_ERROR)
+        if on_conflict not in dict(IngestJob.CONFLICT_CHOICES):
+            return HttpResponseBadRequest(
+                "on_conflict must be one of: error, update, ignore"
+            )
 
-        data = extract_data_from_pdf(filename)
-        InvoiceData.objects.bulk_create(
-            InvoiceData(**vals) for vals in data.to_dict(orient="records")
+        timings = {}
+        with stage("save", timings):
+            filename, content_hash = store_upload(file)
+
+        job = submit_job(filename, timings, on_conflict, content_hash)
+
+        return JsonResponse(
+            {
+                "status": "Pass",
+                "details": f"File Upload Successfully! Processing as job {job.pk}.",
+                "job_id": job.pk,
+                "job_url": reverse("job_status", args=[job.pk]),
+            },
+            status=202,
         )
+    else:
+        return HttpResponseBadRequest("Method Not Allowed")
 
-        return JsonResponse({"status": "Pass", "details": "File Upload Successfully!"})
+
+def job_status(request, job_id):
+    """
+    The `job_status` function reports the state of an ingestion job queued by `upload_file`.
+
+    :param request: The HttpRequest object for the status poll.
+    :param job_id: Primary key of the `IngestJob` to report on.
+    :return: A JsonResponse with the status "Pass" and the job state, row count and per-stage timings,
+    or a 404 response if the job does not exist. Non-GET requests get an HttpResponseBadRequest.
+    """
+    if request.method == "GET":
+        job = get_object_or_404(IngestJob, pk=job_id)
+        return JsonResponse({"status": "Pass", "details": job.as_dict()})
     else:
-        HttpResponseBadRequest("Method Not Allowed")
+        return HttpResponseBadRequest("Method Not Allowed")
+
+
+def metrics(request):
+    """
+    The `metrics` function exposes the ETL stage and upload histograms of this process for Prometheus.
+
+    :param request: The HttpRequest of the scrape; only GET is allowed.
+    :return: An HttpResponse in the Prometheus text format, or an HttpResponseBadRequest for other
+    request methods.
+    """
+    if request.method == "GET":
+        return HttpResponse(
+            render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+    else:
+        return HttpResponseBadRequest("Method Not Allowed")
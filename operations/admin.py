@@ -1,3 +1,30 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import QueryProfile
+
+
+@admin.register(QueryProfile)
+class QueryProfileAdmin(admin.ModelAdmin):
+    list_display = [
+        "created_at",
+        "method",
+        "path",
+        "status_code",
+        "query_count",
+        "total_ms",
+        "slowest_ms",
+        "has_repeated_queries",
+    ]
+    list_filter = ["method", "status_code"]
+    search_fields = ["path", "slowest_sql"]
+    date_hierarchy = "created_at"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(boolean=True, description="N+1")
+    def has_repeated_queries(self, obj):
+        return bool(obj.repeated_queries)
@@ -0,0 +1,182 @@
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Avg, Count, F, Max, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+from etl.models import DailyRollup, InvoiceData
+
+from .columnar import snapshot_aggregation
+from .params import list_param
+
+# Upper bound on the aggregations answered by one `aggregate` request.
+MAX_QUERIES = 20
+
+# Dimension -> (InvoiceData expression, DailyRollup expression or None when the rollup lacks it).
+DIMENSIONS = {
+    "Settlement Date": (F("Settlement Date"), F("settlement_date")),
+    "Month": (TruncMonth("Settlement Date"), TruncMonth("settlement_date")),
+    "Broker": (F("Broker"), F("broker")),
+    "Sub Broker": (F("Sub Broker"), None),
+    "Tier": (F("Tier"), F("tier")),
+}
+
+# Amount columns that can be summed, maximized or averaged.
+AMOUNT_FIELDS = ["Total Loan Amount", "Comission Rate", "Upfront", "Upfront Incl GST"]
+FUNCTIONS = {"sum": Sum, "max": Max, "avg": Avg}
+
+# Metric -> DailyRollup aggregate computing the same value from the daily totals.
+ROLLUP_METRICS = {
+    "count": Coalesce(Sum("loan_count"), 0),
+    "sum:Total Loan Amount": Sum("total_loan_amount"),
+    "max:Total Loan Amount": Max("highest_loan_amount"),
+    "avg:Total Loan Amount": Sum("total_loan_amount") / Sum("loan_count"),
+}
+
+# Filter parameter -> (InvoiceData field, DailyRollup field or None when the rollup lacks it).
+FILTERS = {
+    "broker": ("Broker", "broker"),
+    "sub_broker": ("Sub Broker", None),
+    "tier": ("Tier", "tier"),
+}
+DATE_FILTERS = {"start_date": "gte", "end_date": "lte"}
+
+
+def metric_expression(metric):
+    if metric == "count":
+        return Count("Xref")
+    function, _, field = metric.partition(":")
+    if function not in FUNCTIONS or field not in AMOUNT_FIELDS:
+        raise ValueError(
+            f"Unknown metric {metric!r}: use count or one of "
+            f"{', '.join(FUNCTIONS)} followed by ':' and one of {', '.join(AMOUNT_FIELDS)}"
+        )
+    return FUNCTIONS[function](field)
+
+
+def parse_spec(spec):
+    """
+    The `parse_spec` function validates an aggregation spec.
+
+    :param spec: Aggregation spec, see `compile_query`.
+    :return: A tuple of the `group_by` and `metrics` lists without repeats, the filters mapping each
+    filter parameter to its names and the dates mapping "gte" and "lte" to the date bounds.
+    :raises ValueError: When the spec is invalid.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("An aggregation must be an object")
+    unknown = set(spec) - {"group_by", "metrics", *FILTERS, *DATE_FILTERS}
+    if unknown:
+        raise ValueError(
+            f"Unknown aggregation parameters: {', '.join(sorted(unknown))}"
+        )
+
+    group_by = list_param(spec, "group_by")
+    metrics = list_param(spec, "metrics")
+    if group_by is None or not set(group_by) <= set(DIMENSIONS):
+        raise ValueError(f"group_by must be a list of: {', '.join(DIMENSIONS)}")
+    if not metrics:
+        raise ValueError("metrics must be a non-empty list")
+    group_by, metrics = list(dict.fromkeys(group_by)), list(dict.fromkeys(metrics))
+    for metric in metrics:
+        metric_expression(metric)
+
+    filters = {}
+    for param in FILTERS:
+        values = list_param(spec, param)
+        if values is None:
+            raise ValueError(f"{param} must be a name or a list of names")
+        if values:
+            filters[param] = values
+    dates = {}
+    for param, lookup in DATE_FILTERS.items():
+        if spec.get(param) is not None:
+            try:
+                dates[lookup] = datetime.strptime(spec[param], "%Y-%m-%d").date()
+            except (TypeError, ValueError):
+                raise ValueError(f"{param} must be a date in YYYY-MM-DD format")
+    return group_by, metrics, filters, dates
+
+
+def compile_query(spec):
+    """
+    The `compile_query` function turns an aggregation spec into one grouped ORM query. Queries that
+    only need the settlement date, month, broker and tier and the loan amount's sum, count, max or
+    average are answered from `DailyRollup`; anything else reads `InvoiceData`. Every value from the
+    spec is passed to the database as a query parameter.
+
+    :param spec: Dictionary with a `group_by` list of `DIMENSIONS`, a non-empty `metrics` list (either
+    "count" or "<sum|max|avg>:<amount field>") and optional filters: `broker`, `sub_broker` and `tier`
+    (a name or a list of names) and `start_date` / `end_date` ("YYYY-MM-DD", both included).
+    :return: A tuple of the filtered queryset, the dimension and the metric expressions keyed by their
+    aliases, and the `(output name, alias)` pairs of the result columns, dimensions first.
+    :raises ValueError: When the spec is invalid.
+    """
+    group_by, metrics, filters, dates = parse_spec(spec)
+    use_rollup = (
+        all(DIMENSIONS[name][1] is not None for name in group_by)
+        and all(metric in ROLLUP_METRICS for metric in metrics)
+        and all(FILTERS[param][1] is not None for param in filters)
+    )
+    index = 1 if use_rollup else 0
+    query_results = (
+        DailyRollup.objects.all() if use_rollup else InvoiceData.objects.all()
+    )
+    date_field = "settlement_date" if use_rollup else "Settlement Date"
+
+    for param, values in filters.items():
+        query_results = query_results.filter(**{f"{FILTERS[param][index]}__in": values})
+    for lookup, day in dates.items():
+        query_results = query_results.filter(**{f"{date_field}__{lookup}": day})
+
+    # Aliases keep the output names, which contain spaces, out of the SQL.
+    dimensions = {f"d{i}": DIMENSIONS[name][index] for i, name in enumerate(group_by)}
+    aggregates = {
+        f"m{i}": ROLLUP_METRICS[metric] if use_rollup else metric_expression(metric)
+        for i, metric in enumerate(metrics)
+    }
+    columns = list(zip(group_by, dimensions)) + list(zip(metrics, aggregates))
+    return query_results, dimensions, aggregates, columns
+
+
+def format_row(row, columns):
+    result = {}
+    for name, alias in columns:
+        value = row[alias]
+        if name == "Month" and value is not None:
+            value = f"{value:%Y-%m}"
+        elif isinstance(value, float):
+            value = round(value, 4)
+        result[name] = value
+    return result
+
+
+async def run_aggregation(spec, version=None):
+    """
+    The `run_aggregation` function runs an aggregation spec. With `settings.ANALYTICS_SNAPSHOT` it is
+    answered from the columnar snapshot when the snapshot holds the current data version, see
+    `columnar.snapshot_aggregation`; otherwise it is compiled with `compile_query` and run as SQL.
+
+    :param spec: Aggregation spec, see `compile_query`.
+    :param version: Current `DataVersion` counter; the snapshot is only used when it is given.
+    :return: A list of result rows ordered by the dimensions; a single row without dimensions.
+    :raises ValueError: When the spec is invalid.
+    """
+    if settings.ANALYTICS_SNAPSHOT and version is not None:
+        group_by, metrics, filters, dates = parse_spec(spec)
+        fields = {FILTERS[param][0]: values for param, values in filters.items()}
+        result_list = await sync_to_async(snapshot_aggregation, thread_sensitive=False)(
+            version, group_by, metrics, fields, dates
+        )
+        if result_list is not None:
+            names = list(zip(group_by + metrics, group_by + metrics))
+            return [format_row(row, names) for row in result_list]
+
+    query_results, dimensions, aggregates, columns = compile_query(spec)
+    if not dimensions:
+        return [format_row(await query_results.aaggregate(**aggregates), columns)]
+    query_results = (
+        query_results.values(**dimensions).annotate(**aggregates).order_by(*dimensions)
+    )
+    return [format_row(row, columns) async for row in query_results]
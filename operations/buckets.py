@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+
+def day_bucket(day):
+    return day.isoformat(), day, day
+
+
+def week_bucket(day):
+    year, week, weekday = day.isocalendar()
+    start = day - timedelta(days=weekday - 1)
+    return f"{year}-W{week:02d}", start, start + timedelta(days=6)
+
+
+def month_bucket(day):
+    start = day.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return f"{day:%Y-%m}", start, end
+
+
+# Report period name -> function returning the (label, first day, last day) of a date's bucket.
+PERIODS = {"Daily": day_bucket, "Weekly": week_bucket, "Month": month_bucket}
+
+
+def bucket_totals(daily, periods=tuple(PERIODS)):
+    """
+    The `bucket_totals` function rolls daily totals up into calendar-aligned buckets: the day itself,
+    the ISO week (Monday to Sunday) and the calendar month. Every bucket is computed in one pass over
+    the daily rows, for any number of brokers.
+
+    :param daily: Iterable of `(broker, settlement date, total)` tuples.
+    :param periods: Names from `PERIODS` to compute.
+    :return: A list of `(broker, period, label, first day, last day, total)` tuples ordered by broker,
+    period (in `PERIODS` order) and first day.
+    """
+    order = {period: i for i, period in enumerate(PERIODS)}
+    totals = {}
+    for broker, day, total in daily:
+        for period in periods:
+            label, start, end = PERIODS[period](day)
+            key = (broker, period, label, start, end)
+            totals[key] = totals.get(key, 0) + total
+
+    return sorted(
+        (key + (total,) for key, total in totals.items()),
+        key=lambda row: (row[0], order[row[1]], row[3]),
+    )
@@ -0,0 +1,209 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from etl.ingest import data_version
+from etl.models import DataVersion
+
+from .params import canonical_params, request_params
+
+HITS_KEY = "report:hits"
+MISSES_KEY = "report:misses"
+
+
+def report_cache():
+    return caches[settings.REPORT_CACHE]
+
+
+def data_state_query():
+    return DataVersion.objects.filter(pk=1).values_list("version", "updated_at")
+
+
+def data_state(request):
+    """
+    The `data_state` function returns the `DataVersion` counter and its last change time, read once
+    per request and shared by the conditional GET handling and the result cache.
+
+    :param request: The HttpRequest of the report.
+    :return: A tuple of the version and the time of the last ingest (None before the first one).
+    """
+    if not hasattr(request, "_data_state"):
+        request._data_state = data_state_query().first() or (0, None)
+    return request._data_state
+
+
+async def adata_state(request):
+    """
+    The `adata_state` function is the asynchronous counterpart of `data_state`. Async views call it
+    first, so the synchronous helpers below find the state already loaded and never query the database
+    from the event loop.
+    """
+    if not hasattr(request, "_data_state"):
+        request._data_state = await data_state_query().afirst() or (0, None)
+    return request._data_state
+
+
+def params_digest(request):
+    params = request_params(request)
+    if params is None:
+        return None
+    return hashlib.sha256(canonical_params(params).encode()).hexdigest()
+
+
+def report_key(request, view):
+    """
+    The `report_key` function builds the result cache key of a report request.
+
+    :param request: The HttpRequest of the report, with its data state loaded.
+    :param view: The report view.
+    :return: The cache key, or None when the request must not be cached.
+    """
+    if request.method not in ("GET", "POST"):
+        return None
+    digest = params_digest(request)
+    if digest is None:
+        return None
+    return f"report:{view.__name__}:{data_state(request)[0]}:{digest}"
+
+
+def count(key):
+    cache = report_cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between `add` and `incr`.
+        cache.set(key, 1, timeout=None)
+
+
+def lookup(request, view):
+    """
+    The `lookup` function finds the cached response of a report request and counts the hit or miss.
+
+    :param request: The HttpRequest of the report.
+    :param view: The report view.
+    :return: A tuple of the cache key (None when the request must not be cached) and the cached
+    response content (None on a miss).
+    """
+    key = report_key(request, view)
+    if key is None:
+        return None, None
+    content = report_cache().get(key)
+    count(HITS_KEY if content is not None else MISSES_KEY)
+    return key, content
+
+
+def cached_report(view):
+    """
+    The `cached_report` decorator serves a report view's JSON response from the `REPORT_CACHE` cache.
+    Responses are keyed by the view, the normalized request parameters and the current data version,
+    so an ingest makes every earlier entry unreachable instead of requiring explicit invalidation.
+    Only successful GET and POST responses are cached; anything else goes straight to the view. Both
+    synchronous and asynchronous views are supported.
+
+    :param view: A report view returning a `JsonResponse`.
+    :return: The wrapped view.
+    """
+    if iscoroutinefunction(view):
+
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            # One trip to a worker thread for the version, the cache lookup and the counters.
+            key, content = await sync_to_async(lookup)(request, view)
+            if key is None:
+                return await view(request, *args, **kwargs)
+            if content is not None:
+                return HttpResponse(content, content_type="application/json")
+
+            response = await view(request, *args, **kwargs)
+            if response.status_code == 200:
+                await sync_to_async(report_cache().set)(key, response.content)
+            return response
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key, content = lookup(request, view)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if content is not None:
+            return HttpResponse(content, content_type="application/json")
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            report_cache().set(key, response.content)
+        return response
+
+    return wrapper
+
+
+def report_etag(request, *args, **kwargs):
+    digest = params_digest(request)
+    if digest is None:
+        return None
+    return f"{data_state(request)[0]}-{digest[:16]}"
+
+
+def report_last_modified(request, *args, **kwargs):
+    return data_state(request)[1]
+
+
+def revalidate(request, response):
+    if request.method == "GET" and response.status_code in (200, 304):
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def conditional_report(view):
+    """
+    The `conditional_report` decorator adds an ETag and a Last-Modified header, both derived from the
+    last ingest, to GET responses of a report and answers matching If-None-Match / If-Modified-Since
+    requests with 304 Not Modified before the view (or the result cache) runs. Responses are marked
+    `no-cache`, so HTTP caches may store them but revalidate on every use. Both synchronous and
+    asynchronous views are supported.
+
+    :param view: A report view.
+    :return: The wrapped view.
+    """
+    conditional_view = condition(
+        etag_func=report_etag, last_modified_func=report_last_modified
+    )(view)
+
+    if iscoroutinefunction(view):
+
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            await adata_state(request)
+            return revalidate(request, await conditional_view(request, *args, **kwargs))
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return revalidate(request, conditional_view(request, *args, **kwargs))
+
+    return wrapper
+
+
+def cache_stats():
+    """
+    The `cache_stats` function reports the hit and miss counters of the report cache.
+
+    :return: A dictionary with the `hits`, `misses`, `hit_rate` and current `data_version`.
+    """
+    cache = report_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+        "data_version": data_version(),
+    }
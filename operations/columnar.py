@@ -0,0 +1,165 @@
+from datetime import date
+
+import numpy as np
+
+from etl.snapshot import EPOCH, load_snapshot
+
+# Largest number of possible groups (the product of the dimensions' value ranges) counted in a dense
+# array; larger key spaces are compacted with a sort first.
+DENSE_GROUPS_MAX = 1 << 24
+
+
+def group_keys(snapshot, columns, dimension):
+    """
+    Numbers the values of a dimension from 0.
+
+    :return: A tuple of the key of every row, the number of possible keys, the sort rank of each key
+    and a function turning a key back into its value.
+    """
+    if dimension in ("Settlement Date", "Month"):
+        first, last = snapshot.day_range()
+        days = columns["Settlement Date"] - first
+        if dimension == "Settlement Date":
+            count = last - first + 1
+            return (
+                days,
+                count,
+                np.arange(count),
+                lambda key: date.fromordinal(EPOCH + first + key),
+            )
+        # The month of every day of the range, looked up instead of computed per row.
+        calendar = np.arange(first, last + 1).astype("datetime64[D]")
+        months = calendar.astype("datetime64[M]").astype(np.int64)
+        start = int(months[0])
+        count = int(months[-1]) - start + 1
+        return (
+            (months - start)[days],
+            count,
+            np.arange(count),
+            lambda key: date(1970 + (start + key) // 12, (start + key) % 12 + 1, 1),
+        )
+    names = snapshot.dictionaries[dimension]
+    ranks = np.empty(len(names), dtype=np.int64)
+    ranks[sorted(range(len(names)), key=names.__getitem__)] = np.arange(len(names))
+    return columns[dimension], len(names), ranks, names.__getitem__
+
+
+def reduce_groups(groups, count, columns, metrics):
+    """
+    Computes every metric per group with `np.bincount` (and `np.maximum.at` for maxima).
+
+    :return: A tuple of the row count of each group and a dictionary mapping each metric to its array
+    of per-group values.
+    """
+    counts = np.bincount(groups, minlength=count)
+    sums = {}
+    results = {}
+    for metric in metrics:
+        if metric == "count":
+            results[metric] = counts
+            continue
+        function, _, field = metric.partition(":")
+        if function == "max":
+            results[metric] = np.full(count, -np.inf)
+            np.maximum.at(results[metric], groups, columns[field])
+            continue
+        if field not in sums:
+            sums[field] = np.bincount(groups, weights=columns[field], minlength=count)
+        results[metric] = (
+            sums[field] if function == "sum" else sums[field] / np.maximum(counts, 1)
+        )
+    return counts, results
+
+
+def snapshot_aggregation(version, group_by, metrics, filters, dates):
+    """
+    The `snapshot_aggregation` function answers an aggregation from the memory-mapped columnar
+    snapshot with vectorized numpy group-bys instead of SQL. Rows are filtered with boolean masks and
+    each row's group is one integer combining its dimension keys, so counts, sums and averages are
+    single `np.bincount` passes over the columns.
+
+    :param version: Current `DataVersion` counter; only a snapshot of that version is used.
+    :param group_by: Dimension names, see `aggregate.DIMENSIONS`.
+    :param metrics: Metric names, see `aggregate.compile_query`.
+    :param filters: Dictionary mapping `InvoiceData` fields to the names they must match.
+    :param dates: Dictionary with the optional "gte" and "lte" settlement date bounds.
+    :return: A list of result rows keyed by dimension and metric names, ordered by the dimensions, or
+    None when no snapshot of `version` is available or the groups cannot be numbered in 64 bits.
+    """
+    snapshot = load_snapshot(version)
+    if snapshot is None:
+        return None
+
+    mask = None
+    for field, names in filters.items():
+        codes = [
+            code
+            for code, name in enumerate(snapshot.dictionaries[field])
+            if name in names
+        ]
+        selected = np.isin(snapshot.columns[field], codes)
+        mask = selected if mask is None else mask & selected
+    for lookup, day in dates.items():
+        days = snapshot.columns["Settlement Date"]
+        bound = day.toordinal() - EPOCH
+        selected = days >= bound if lookup == "gte" else days <= bound
+        mask = selected if mask is None else mask & selected
+    needed = {"Settlement Date" if name == "Month" else name for name in group_by}
+    needed |= {metric.partition(":")[2] for metric in metrics} - {""}
+    columns = {
+        field: (
+            snapshot.columns[field] if mask is None else snapshot.columns[field][mask]
+        )
+        for field in needed
+    }
+    rows = snapshot.rows if mask is None else int(np.count_nonzero(mask))
+
+    if not group_by:
+        if rows == 0:
+            return [{metric: 0 if metric == "count" else None for metric in metrics}]
+        return [
+            {
+                metric: int(value[0]) if metric == "count" else float(value[0])
+                for metric, value in reduce_groups(
+                    np.zeros(rows, dtype=np.int64), 1, columns, metrics
+                )[1].items()
+            }
+        ]
+    if rows == 0:
+        return []
+
+    dimensions = [group_keys(snapshot, columns, name) for name in group_by]
+    sizes = [count for _, count, _, _ in dimensions]
+    if np.prod(sizes, dtype=float) >= 2**62:
+        return None
+    combined = dimensions[0][0].astype(np.int64)
+    for key, count, _, _ in dimensions[1:]:
+        combined = combined * count + key
+
+    if np.prod(sizes) <= DENSE_GROUPS_MAX:
+        # Every possible key is a group; the empty ones are dropped.
+        counts, results = reduce_groups(combined, int(np.prod(sizes)), columns, metrics)
+        groups = labels = np.flatnonzero(counts)
+    else:
+        labels, inverse = np.unique(combined, return_inverse=True)
+        _, results = reduce_groups(inverse, len(labels), columns, metrics)
+        groups = np.arange(len(labels))
+
+    # Only the groups are sorted, by the rank of their values (names sort like strings).
+    label_keys = np.unravel_index(labels, sizes)
+    order = np.lexsort(
+        [ranks[keys] for keys, (_, _, ranks, _) in zip(label_keys, dimensions)][::-1]
+    )
+    result_list = []
+    for position in order:
+        row = {
+            name: decode(int(keys[position]))
+            for name, keys, (_, _, _, decode) in zip(group_by, label_keys, dimensions)
+        }
+        group = groups[position]
+        for metric, values in results.items():
+            row[metric] = (
+                int(values[group]) if metric == "count" else float(values[group])
+            )
+        result_list.append(row)
+    return result_list
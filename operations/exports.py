@@ -0,0 +1,168 @@
+import csv
+from itertools import groupby, islice
+from operator import itemgetter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Sum
+
+from etl.models import DailyRollup, InvoiceData
+
+from .buckets import PERIODS, bucket_totals
+from .params import list_param
+
+
+class Echo:
+    """
+    File-like object handing each line written by `csv.writer` back to the caller.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(header, rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(header, row))) + "\n"
+
+
+async def async_lines(lines, batch_size):
+    """
+    The `async_lines` function adapts a line generator for ASGI responses, which would otherwise read a
+    synchronous iterator to the end before sending anything. Batches of lines are produced on the
+    thread that owns the request's database connection.
+
+    :param lines: Generator returned by one of the `FORMATS` functions.
+    :param batch_size: Number of lines joined into each chunk.
+    :return: An asynchronous generator of text chunks.
+    """
+
+    def next_batch():
+        return "".join(islice(lines, batch_size))
+
+    while chunk := await sync_to_async(next_batch)():
+        yield chunk
+
+
+# Export format -> (line generator, content type).
+FORMATS = {
+    "csv": (csv_lines, "text/csv"),
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+}
+
+
+def keyset_rows(queryset, key, fields, after=None):
+    """
+    The `keyset_rows` function iterates over a queryset in chunks of `settings.EXPORT_CHUNK_SIZE`
+    rows ordered by `key`. Each chunk is a separate `key > last key` query, so neither the database
+    nor the process holds more than one chunk, however large the table.
+
+    :param queryset: Rows to export.
+    :param key: Name of a unique field to paginate on.
+    :param fields: Field names of each exported row; must include `key`.
+    :param after: Only rows with a key greater than this value are returned.
+    :return: A generator of value tuples in `fields` order.
+    """
+    position = fields.index(key)
+    while True:
+        chunk = queryset.order_by(key)
+        if after is not None:
+            chunk = chunk.filter(**{f"{key}__gt": after})
+        chunk = list(chunk.values_list(*fields)[: settings.EXPORT_CHUNK_SIZE])
+        yield from chunk
+        if len(chunk) < settings.EXPORT_CHUNK_SIZE:
+            return
+        after = chunk[-1][position]
+
+
+def export_invoices(params):
+    fields = [field.name for field in InvoiceData._meta.fields]
+    after = params.get("after")
+    if after is not None:
+        try:
+            after = int(after)
+        except (TypeError, ValueError):
+            raise ValueError("after must be a single Xref")
+    return fields, keyset_rows(InvoiceData.objects.all(), "Xref", fields, after)
+
+
+def export_total_loan_amount(params):
+    rows = (
+        DailyRollup.objects.values_list("settlement_date")
+        .annotate(total=Sum("total_loan_amount"))
+        .order_by("settlement_date")
+    )
+    return ["Settlement Date", "Total Loan Amount"], rows.iterator(
+        settings.EXPORT_CHUNK_SIZE
+    )
+
+
+def export_number_of_loans(params):
+    rows = (
+        DailyRollup.objects.values_list("settlement_date", "tier")
+        .annotate(num_loans=Sum("loan_count"))
+        .order_by("settlement_date", "tier")
+    )
+    return ["Settlement Date", "Tier", "Number of Loans"], rows.iterator(
+        settings.EXPORT_CHUNK_SIZE
+    )
+
+
+def export_highest_loan_amount(params):
+    rows = (
+        DailyRollup.objects.values_list("broker")
+        .annotate(highest=Max("highest_loan_amount"))
+        .order_by("broker")
+    )
+    return ["Broker", "Highest Loan Amount"], rows.iterator(settings.EXPORT_CHUNK_SIZE)
+
+
+def export_broker_report(params):
+    brokers = list_param(params, "brokers")
+    broker = list_param(params, "broker")
+    periods = list_param(params, "periods") or list(PERIODS)
+    if brokers is None or broker is None or not set(periods) <= set(PERIODS):
+        raise ValueError(
+            "broker and brokers must be names, periods one of: Daily, Weekly, Month"
+        )
+    brokers += broker
+
+    daily = DailyRollup.objects.all()
+    if brokers:
+        daily = daily.filter(broker__in=brokers)
+    daily = (
+        daily.values_list("broker", "settlement_date")
+        .annotate(total=Sum("total_loan_amount"))
+        .order_by("broker", "settlement_date")
+        .iterator(settings.EXPORT_CHUNK_SIZE)
+    )
+
+    def rows():
+        # Buckets are built one broker at a time, so only one broker's buckets are held.
+        for _, broker_daily in groupby(daily, key=itemgetter(0)):
+            for broker, period, label, start, end, total in bucket_totals(
+                broker_daily, periods
+            ):
+                yield broker, period, label, start, end, round(total, 4)
+
+    header = ["Broker", "Period", "Date", "Start Date", "End Date", "Total Loan Amount"]
+    return header, rows()
+
+
+# Export name -> function building the header and row iterator from the request parameters.
+EXPORTS = {
+    "invoices": export_invoices,
+    "total_loan_amount": export_total_loan_amount,
+    "number_of_loans": export_number_of_loans,
+    "highest_loan_amount": export_highest_loan_amount,
+    "broker_report": export_broker_report,
+}
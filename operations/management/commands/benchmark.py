@@ -0,0 +1,416 @@
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from io import StringIO
+from itertools import islice
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from etl.ingest import ingest_file
+from etl.metrics import current_rss
+from etl.models import InvoiceData
+from etl.snapshot import build_snapshot
+from etl.synthetic import invoice_rows, statement_pdf
+
+from ...cache import report_cache
+
+BATCH_SIZE = 10_000
+
+# (name, method, URL name and arguments, parameters) of every operations endpoint; the parameters are
+# the query string of a GET or the JSON body of a POST, and match the `invoice_rows` datasets.
+ENDPOINTS = [
+    ("index", "GET", ("index", None), {}),
+    ("broker_lookup", "GET", ("broker_lookup", None), {"q": "Broker 0"}),
+    ("report_total_load_amount", "GET", ("report_total_load_amount", None), {}),
+    ("report_number_of_loans", "GET", ("report_number_of_loans", None), {}),
+    (
+        "highest_loan_amount",
+        "GET",
+        ("highest_loan_amount", None),
+        {"broker": "Broker 001"},
+    ),
+    ("broker_report", "GET", ("broker_report", None), {}),
+    (
+        "total_loan_amount_by_time",
+        "GET",
+        ("total_loan_amount_by_time", None),
+        {"start_date": "2024-02-01", "end_date": "2024-11-30"},
+    ),
+    (
+        "total_loan_amount_by_ranges",
+        "POST",
+        ("total_loan_amount_by_ranges", None),
+        {
+            "ranges": [
+                {
+                    "start_date": f"2024-{month:02d}-01",
+                    "end_date": f"2024-{month:02d}-28",
+                    "broker": f"Broker {month:03d}",
+                }
+                for month in range(1, 13)
+            ]
+        },
+    ),
+    ("loan_statistics", "GET", ("loan_statistics", None), {}),
+    (
+        "aggregate",
+        "POST",
+        ("aggregate", None),
+        {
+            "queries": {
+                "monthly": {
+                    "group_by": ["Month", "Broker"],
+                    "metrics": ["count", "sum:Total Loan Amount"],
+                },
+                "sub_brokers": {
+                    "group_by": ["Sub Broker"],
+                    "metrics": ["avg:Upfront"],
+                    "start_date": "2024-06-01",
+                    "end_date": "2024-06-30",
+                },
+            }
+        },
+    ),
+    (
+        "export_total_loan_amount",
+        "GET",
+        ("export", {"name": "total_loan_amount"}),
+        {},
+    ),
+    ("export_number_of_loans", "GET", ("export", {"name": "number_of_loans"}), {}),
+    (
+        "export_highest_loan_amount",
+        "GET",
+        ("export", {"name": "highest_loan_amount"}),
+        {},
+    ),
+    ("export_broker_report", "GET", ("export", {"name": "broker_report"}), {}),
+    ("report_cache_stats", "GET", ("report_cache_stats", None), {}),
+]
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            timeout=10,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def summarize(latencies):
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(percentiles[49] * 1000, 3),
+        "p99_ms": round(percentiles[98] * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+    }
+
+
+def sender(client, method, url, params):
+    """
+    Returns a function sending the request of one endpoint with a `Client` or an `AsyncClient`.
+    """
+    if method == "GET":
+        return lambda: client.get(url, params)
+    return lambda: client.post(url, json.dumps(params), content_type="application/json")
+
+
+class PeakMemory:
+    """
+    Samples the resident memory of the process from a background thread while the block runs.
+    """
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self.done = threading.Event()
+
+    def sample(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark statement ingestion (throughput and peak memory on a synthetic PDF) and the p50/p99 "
+        "latency of every operations endpoint on synthetic datasets of the given sizes, in a scratch "
+        "database, and write the results as JSON for comparison across commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=20)
+        parser.add_argument("--rows-per-page", type=int, default=40)
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[10_000, 100_000],
+            help="InvoiceData rows of each dataset, e.g. 10000 100000 1000000 10000000.",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=30, help="Requests per endpoint and mode."
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default="benchmark-results.json")
+        parser.add_argument(
+            "--baseline", help="Results file of an earlier run to compare against."
+        )
+        parser.add_argument(
+            "--skip-ingest",
+            action="store_true",
+            help="Skip the PDF ingest benchmark, which needs Java for tabula.",
+        )
+
+    def handle(self, *args, **options):
+        if options["requests"] < 2:
+            raise CommandError("--requests must be at least 2")
+        baseline = None
+        if options["baseline"]:
+            try:
+                with open(options["baseline"]) as results_file:
+                    baseline = json.load(results_file)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read the baseline: {e}")
+
+        results = {
+            "commit": git_commit(),
+            "created_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "cpus": os.cpu_count(),
+            "options": {
+                key: options[key]
+                for key in ("pages", "rows_per_page", "sizes", "requests", "seed")
+            },
+            "analytics_snapshot": settings.ANALYTICS_SNAPSHOT,
+            "ingest": None,
+            "datasets": [],
+        }
+
+        with tempfile.TemporaryDirectory() as workdir:
+            # The benchmark writes millions of rows, so it runs in a throwaway test database, like
+            # the test runner, and a private report cache.
+            if connection.vendor == "sqlite":
+                connection.settings_dict["TEST"]["NAME"] = os.path.join(
+                    workdir, "benchmark.sqlite3"
+                )
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            try:
+                with override_settings(
+                    DEBUG=False,
+                    ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+                    CACHES={
+                        **settings.CACHES,
+                        "benchmark": {
+                            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                            "LOCATION": "benchmark",
+                        },
+                    },
+                    REPORT_CACHE="benchmark",
+                    ETL_CACHE_MAX_BYTES=0,
+                    ANALYTICS_SNAPSHOT_DIR=os.path.join(workdir, "snapshot"),
+                ):
+                    if not options["skip_ingest"]:
+                        results["ingest"] = self.bench_ingest(workdir, options)
+                    for size in sorted(set(options["sizes"])):
+                        results["datasets"].append(self.bench_dataset(size, options))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        with open(options["output"], "w") as results_file:
+            json.dump(results, results_file, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+        if baseline is not None:
+            self.compare(baseline, results)
+
+    def bench_ingest(self, workdir, options):
+        path = os.path.join(workdir, "statement.pdf")
+        rows = statement_pdf(
+            path, options["pages"], options["rows_per_page"], seed=options["seed"]
+        )
+        timings = {}
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            totals = ingest_file(path, timings)
+            elapsed = time.perf_counter() - start
+        InvoiceData.objects.all().delete()
+        result = {
+            "pages": options["pages"],
+            "rows": rows,
+            "inserted": totals["inserted"],
+            "seconds": round(elapsed, 4),
+            "rows_per_second": round(rows / elapsed, 1),
+            "pages_per_second": round(options["pages"] / elapsed, 2),
+            "peak_rss_bytes": memory.peak,
+            "timings": timings,
+        }
+        self.stdout.write(
+            f"ingest: {rows} rows on {options['pages']} pages in {elapsed:.2f}s, "
+            f"{result['rows_per_second']:,.0f} rows/s, peak RSS {memory.peak / 2**20:,.0f} MiB"
+        )
+        return result
+
+    def load(self, size, seed):
+        """
+        Grows `InvoiceData` to `size` rows of synthetic data and rebuilds the rollup and brokers, and
+        the analytics snapshot when it is enabled.
+
+        :return: The seconds spent inserting and rebuilding.
+        """
+        start = time.perf_counter()
+        stored = InvoiceData.objects.count()
+        rows = invoice_rows(size - stored, seed=seed + size, first_xref=stored + 1)
+        with transaction.atomic():
+            while batch := list(islice(rows, BATCH_SIZE)):
+                InvoiceData.objects.bulk_create(batch)
+        call_command("rebuild_rollup", stdout=StringIO())
+        if settings.ANALYTICS_SNAPSHOT:
+            build_snapshot()
+        return time.perf_counter() - start
+
+    def bench_dataset(self, size, options):
+        load_seconds = self.load(size, options["seed"])
+        self.stdout.write(f"{size:,} rows loaded in {load_seconds:.1f}s")
+        client, async_client = Client(), AsyncClient()
+        endpoints = {}
+        for name, method, (url_name, kwargs), params in ENDPOINTS:
+            url = reverse(url_name, kwargs=kwargs)
+            send = sender(client, method, url, params)
+            # Cold requests find an empty report cache and run their queries, warm ones hit it. Both
+            # go through the WSGI handler, where each async view is run with `async_to_sync`.
+            endpoints[name] = {
+                mode: summarize(
+                    [
+                        self.timed_request(send, clear=mode == "cold")
+                        for _ in range(options["requests"])
+                    ]
+                )
+                for mode in ("cold", "warm")
+            }
+            endpoints[name]["asgi_cold"] = summarize(
+                asyncio.run(
+                    self.atimed_requests(
+                        sender(async_client, method, url, params), options["requests"]
+                    )
+                )
+            )
+            self.stdout.write(
+                f"  {name}: cold p50 {endpoints[name]['cold']['p50_ms']:.1f}ms "
+                f"p99 {endpoints[name]['cold']['p99_ms']:.1f}ms, "
+                f"warm p50 {endpoints[name]['warm']['p50_ms']:.1f}ms, "
+                f"ASGI cold p50 {endpoints[name]['asgi_cold']['p50_ms']:.1f}ms"
+            )
+
+        # The full invoice export reads every row, so it is timed once, as throughput.
+        start = time.perf_counter()
+        response = client.get(reverse("export", kwargs={"name": "invoices"}))
+        exported = sum(len(chunk) for chunk in response.streaming_content)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"  export invoices: {exported / 2**20:,.1f} MiB in {elapsed:.2f}s"
+        )
+        return {
+            "rows": size,
+            "load_seconds": round(load_seconds, 3),
+            "endpoints": endpoints,
+            "export_invoices": {
+                "bytes": exported,
+                "seconds": round(elapsed, 4),
+                "rows_per_second": round(size / elapsed, 1),
+            },
+        }
+
+    def timed_request(self, send, clear):
+        if clear:
+            report_cache().clear()
+        start = time.perf_counter()
+        response = send()
+        if response.streaming:
+            b"".join(response.streaming_content)
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise CommandError(
+                f"{response.request['PATH_INFO']} returned {response.status_code}"
+            )
+        return elapsed
+
+    async def atimed_requests(self, send, count):
+        """
+        Times cold requests through the ASGI handler, for comparison with the WSGI timings.
+
+        :return: The latency of each request in seconds.
+        """
+        latencies = []
+        try:
+            for _ in range(count):
+                report_cache().clear()
+                start = time.perf_counter()
+                response = await send()
+                if response.streaming and response.is_async:
+                    [chunk async for chunk in response.streaming_content]
+                elif response.streaming:
+                    b"".join(response.streaming_content)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise CommandError(
+                        f"{response.request['path']} returned {response.status_code}"
+                    )
+        finally:
+            # The views ran their queries on asgiref's thread, on a connection of its own.
+            await sync_to_async(connections.close_all)()
+        return latencies
+
+    def compare(self, baseline, results):
+        before = {
+            (dataset["rows"], name): stats["cold"]
+            for dataset in baseline.get("datasets", [])
+            for name, stats in dataset["endpoints"].items()
+        }
+        self.stdout.write(f"Compared with {baseline.get('commit') or 'the baseline'}:")
+        for dataset in results["datasets"]:
+            for name, stats in dataset["endpoints"].items():
+                old = before.get((dataset["rows"], name))
+                if old is None:
+                    continue
+                self.stdout.write(
+                    f"  {dataset['rows']:>10,} {name}: cold p50 "
+                    f"{old['p50_ms']:.1f} -> {stats['cold']['p50_ms']:.1f}ms "
+                    f"({(stats['cold']['p50_ms'] / old['p50_ms'] - 1) * 100:+.0f}%), p99 "
+                    f"{old['p99_ms']:.1f} -> {stats['cold']['p99_ms']:.1f}ms"
+                )
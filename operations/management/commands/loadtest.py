@@ -0,0 +1,126 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def build_request(url, method, body):
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += f"?{parts.query}"
+    lines = [
+        f"{method} {path} HTTP/1.1",
+        f"Host: {parts.netloc}",
+        "Connection: close",
+    ]
+    if body is not None:
+        lines += ["Content-Type: application/json", f"Content-Length: {len(body)}"]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + (body or b"")
+
+
+async def fetch(host, port, request):
+    """
+    Sends one request on a fresh connection and reads the response to the end.
+
+    :return: The HTTP status code.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(request)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b" ", 2)[1])
+
+
+async def run(url, method, body, requests, concurrency, timeout):
+    """
+    Issues `requests` requests against `url` from `concurrency` concurrent clients.
+
+    :return: A tuple of the elapsed seconds, the latencies of successful requests and the error count.
+    """
+    parts = urlsplit(url)
+    request = build_request(url, method, body)
+    remaining = iter(range(requests))
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(
+                    fetch(parts.hostname, parts.port or 80, request), timeout
+                )
+            except (OSError, ValueError, IndexError, asyncio.TimeoutError):
+                status = None
+            if status is not None and status < 400:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, errors
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test report endpoints and print throughput and latency percentiles per URL. Point it "
+        "at the same endpoint served over WSGI and ASGI to compare the two, e.g. gunicorn "
+        "tax_invoice.wsgi on one port and uvicorn tax_invoice.asgi:application on another."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="+", help="http:// URLs to load.")
+        parser.add_argument("--requests", type=int, default=2_000)
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument(
+            "--data", help="JSON body; the requests are sent as POST when given."
+        )
+        parser.add_argument(
+            "--timeout", type=float, default=30, help="Seconds before a request fails."
+        )
+
+    def handle(self, *args, **options):
+        body = None
+        if options["data"] is not None:
+            try:
+                body = json.dumps(json.loads(options["data"])).encode()
+            except ValueError as e:
+                raise CommandError(f"--data is not valid JSON: {e}")
+        method = "GET" if body is None else "POST"
+
+        for url in options["urls"]:
+            if urlsplit(url).scheme != "http":
+                raise CommandError(f"Only http:// URLs are supported: {url}")
+            elapsed, latencies, errors = asyncio.run(
+                run(
+                    url,
+                    method,
+                    body,
+                    options["requests"],
+                    options["concurrency"],
+                    options["timeout"],
+                )
+            )
+            self.report(url, elapsed, latencies, errors)
+
+    def report(self, url, elapsed, latencies, errors):
+        self.stdout.write(url)
+        if len(latencies) < 2:
+            self.stdout.write(f"  {len(latencies)} ok, {errors} errors")
+            return
+        percentiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f"  {len(latencies)} ok, {errors} errors in {elapsed:.2f}s: "
+            f"{len(latencies) / elapsed:.1f} req/s, "
+            f"p50 {percentiles[49] * 1000:.1f}ms, p99 {percentiles[98] * 1000:.1f}ms, "
+            f"max {max(latencies) * 1000:.1f}ms"
+        )
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.3 on 2026-10-18 09:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="QueryProfile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("method", models.CharField(max_length=10)),
+                ("path", models.CharField(max_length=500)),
+                ("status_code", models.IntegerField(null=True)),
+                ("query_count", models.IntegerField(default=0)),
+                ("total_ms", models.FloatField(default=0)),
+                ("slowest_ms", models.FloatField(default=0)),
+                ("slowest_sql", models.TextField(blank=True, default="")),
+                ("slow_queries", models.JSONField(default=list)),
+                ("repeated_queries", models.JSONField(default=list)),
+                ("created_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
@@ -1,3 +1,27 @@
 from django.db import models
 
-# Create your models here.
+
+class QueryProfile(models.Model):
+    """
+    Database activity of a request that ran a slow query or repeated a statement, recorded by
+    `operations.profiling.QueryProfilingMiddleware`.
+    """
+
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.IntegerField(null=True)
+    query_count = models.IntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    slowest_ms = models.FloatField(default=0)
+    slowest_sql = models.TextField(blank=True, default="")
+    # [{"sql", "params", "ms", "plan"}] of the queries above `QUERY_PROFILING_SLOW_MS`.
+    slow_queries = models.JSONField(default=list)
+    # [{"sql", "count"}] of the statements run at least `QUERY_PROFILING_REPEAT_THRESHOLD` times.
+    repeated_queries = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.query_count} queries, {self.total_ms:.1f} ms)"
@@ -0,0 +1,49 @@
+import json
+
+
+def request_params(request):
+    """
+    The `request_params` function reads the parameters of a report request: the query string of a GET
+    request, where a repeated key becomes a list, or the JSON object in the body of a POST request.
+
+    :param request: The HttpRequest of the report.
+    :return: A dictionary of parameters, or None when a POST body is not a JSON object.
+    """
+    if request.method == "GET":
+        return {
+            key: values if len(values) > 1 else values[0]
+            for key, values in request.GET.lists()
+        }
+    try:
+        params = json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+    return params if isinstance(params, dict) else None
+
+
+def canonical_params(params):
+    """
+    The `canonical_params` function gives equivalent parameter sets the same text, whatever their key
+    order and formatting.
+
+    :param params: Dictionary returned by `request_params`.
+    :return: The parameters as compact JSON with sorted keys.
+    """
+    return json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def list_param(params, key):
+    """
+    The `list_param` function reads a parameter that takes one or several strings.
+
+    :param params: Dictionary returned by `request_params`.
+    :param key: Name of the parameter.
+    :return: A list of the non-empty values, empty when the parameter is missing, or None when a value
+    is not a string.
+    """
+    values = params.get(key) or []
+    if isinstance(values, str):
+        values = [values]
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        return None
+    return [value for value in values if value]
@@ -0,0 +1,111 @@
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.db.models import Sum
+
+from etl.models import DailyRollup
+
+# Upper bound on the ranges answered by one `total_loan_amount_by_ranges` request.
+MAX_RANGES = 10_000
+# Amounts are summed in integer units of 1/10_000, the 4 decimals the reports round to.
+SCALE = 10_000
+# Series kept per data version; the least recently used one is dropped beyond it, so brokers and tiers
+# taken from requests cannot grow the index without bound.
+MAX_SERIES = 1_000
+
+
+class PrefixSums:
+    """
+    Cumulative daily loan totals of one series, in integer units of `1 / SCALE` so that differences of
+    large sums stay exact. The total of any date range is the difference of two prefix sums found by
+    binary search.
+    """
+
+    def __init__(self, daily):
+        self.days = []
+        self.sums = [0]
+        for day, total in daily:
+            self.days.append(day)
+            self.sums.append(self.sums[-1] + round(total * SCALE))
+
+    def total(self, start, end):
+        """
+        The `total` method sums the daily totals between two dates, both included, in O(log n).
+
+        :param start: First settlement date of the range.
+        :param end: Last settlement date of the range.
+        :return: The total loan amount of the range.
+        """
+        if start > end:
+            return 0.0
+        low = bisect_left(self.days, start)
+        high = bisect_right(self.days, end)
+        return (self.sums[high] - self.sums[low]) / SCALE
+
+
+class PrefixSumIndex:
+    """
+    Process-wide cache of `PrefixSums` per `(broker, tier)` series, `None` standing for all brokers or
+    all tiers. Series are built from `DailyRollup` on first use and dropped when the data version
+    changes, so only the series that are queried after an ingest are rebuilt, each with one query over
+    the rollup; they are not patched with the keys the ingest touched. At most `MAX_SERIES`
+    series are kept, the least recently used being dropped first.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.series = OrderedDict()
+        self.lock = threading.Lock()
+
+    def cached(self, version, key):
+        with self.lock:
+            if version != self.version:
+                self.version = version
+                self.series = OrderedDict()
+            series = self.series.get(key)
+            if series is not None:
+                self.series.move_to_end(key)
+            return series
+
+    def store(self, version, key, series):
+        with self.lock:
+            if version == self.version:
+                self.series[key] = series
+                self.series.move_to_end(key)
+                while len(self.series) > MAX_SERIES:
+                    self.series.popitem(last=False)
+        return series
+
+    def build(self, broker, tier):
+        query_results = DailyRollup.objects.all()
+        if broker is not None:
+            query_results = query_results.filter(broker=broker)
+        if tier is not None:
+            query_results = query_results.filter(tier=tier)
+        return PrefixSums(
+            query_results.values_list("settlement_date")
+            .annotate(total=Sum("total_loan_amount"))
+            .order_by("settlement_date")
+        )
+
+    async def aget(self, version, broker=None, tier=None):
+        """
+        The `aget` method returns the prefix sums of a series at the given data version. Only building
+        a missing series leaves the event loop.
+
+        :param version: Current `DataVersion` counter.
+        :param broker: Broker name, or None for all brokers.
+        :param tier: Loan tier, or None for all tiers.
+        :return: The `PrefixSums` of the series.
+        """
+        series = self.cached(version, (broker, tier))
+        if series is None:
+            series = self.store(
+                version, (broker, tier), await sync_to_async(self.build)(broker, tier)
+            )
+        return series
+
+
+prefix_index = PrefixSumIndex()
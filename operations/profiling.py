@@ -0,0 +1,140 @@
+import json
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connection
+
+from .models import QueryProfile
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper recording the statement, parameters and duration of every query.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.queries.append((sql, None if many else params, elapsed))
+
+
+def explain(sql, params):
+    """
+    The `explain` function returns the database's plan for a SELECT statement, in the database's own
+    EXPLAIN syntax. The statement itself is not run.
+
+    :param sql: The statement with its parameter placeholders.
+    :param params: The parameters the statement ran with.
+    :return: The plan as text, one line per row of the EXPLAIN output.
+    """
+    prefix = connection.ops.explain_query_prefix()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"{prefix} {sql}", params)
+            return "\n".join(
+                " ".join(str(value) for value in row) for row in cursor.fetchall()
+            )
+    except DatabaseError as e:
+        return f"EXPLAIN failed: {e}"
+
+
+class QueryProfilingMiddleware:
+    """
+    Opt-in profiling of the database work of every request, enabled by `settings.QUERY_PROFILING`.
+    Each request logs its query count, total query time and slowest statement to
+    `operations.profiling`. Requests that ran a query slower than `QUERY_PROFILING_SLOW_MS` or one
+    statement at least `QUERY_PROFILING_REPEAT_THRESHOLD` times (an N+1 pattern) are stored as a
+    `QueryProfile`, with the EXPLAIN plan of each slow SELECT, and can be browsed in the admin.
+    Queries run while a streaming response is consumed happen after the middleware and are not seen.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        # Not connection.execute_wrapper(): it pops the last wrapper on exit, which is
+        # retry_busy_statement when the request opened the connection (etl.sqlite).
+        connection.execute_wrappers.append(recorder)
+        try:
+            response = self.get_response(request)
+        finally:
+            connection.execute_wrappers.remove(recorder)
+        if recorder.queries:
+            self.report(request, response, recorder.queries)
+        return response
+
+    def report(self, request, response, queries):
+        slowest_sql, _, slowest_ms = max(queries, key=lambda query: query[2])
+        total_ms = sum(ms for _, _, ms in queries)
+        repeats = Counter(sql for sql, _, _ in queries)
+        repeated = [
+            {"sql": sql, "count": count}
+            for sql, count in repeats.most_common()
+            if count >= settings.QUERY_PROFILING_REPEAT_THRESHOLD
+        ]
+        logger.info(
+            json.dumps(
+                {
+                    "event": "request_queries",
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "queries": len(queries),
+                    "total_ms": round(total_ms, 3),
+                    "slowest_ms": round(slowest_ms, 3),
+                    "slowest_sql": slowest_sql,
+                    "repeated": repeated,
+                }
+            )
+        )
+
+        slow = [
+            query for query in queries if query[2] >= settings.QUERY_PROFILING_SLOW_MS
+        ]
+        if not slow and not repeated:
+            return
+        try:
+            self.store(request, response, queries, slow, repeated)
+        except DatabaseError:
+            logger.exception("Could not store the query profile of %s", request.path)
+
+    def store(self, request, response, queries, slow, repeated):
+        slowest_sql, _, slowest_ms = max(queries, key=lambda query: query[2])
+        QueryProfile.objects.create(
+            method=request.method,
+            path=request.path[:500],
+            status_code=response.status_code,
+            query_count=len(queries),
+            total_ms=round(sum(ms for _, _, ms in queries), 3),
+            slowest_ms=round(slowest_ms, 3),
+            slowest_sql=slowest_sql,
+            slow_queries=[
+                {
+                    "sql": sql,
+                    "params": repr(params),
+                    "ms": round(ms, 3),
+                    "plan": (
+                        explain(sql, params)
+                        if params is not None
+                        and sql.lstrip().upper().startswith(("SELECT", "WITH"))
+                        else ""
+                    ),
+                }
+                for sql, params, ms in slow
+            ],
+            repeated_queries=repeated,
+        )
@@ -0,0 +1,99 @@
+from django.db.models import Avg, Count, F, Q, RowRange, Window
+from django.db.models.functions import RowNumber
+
+from etl.ingest import stored_keys
+from etl.models import InvoiceData
+
+DEFAULT_TOP = 5
+TOP_MAX = 100
+DEFAULT_PERCENTILES = [50, 90, 99]
+
+
+def nearest_rank(count, percentile):
+    """
+    Rank (from 1, in ascending order) of the smallest loan with at least `percentile`% of the loans at
+    or below it.
+    """
+    return -(-count * percentile // 100)
+
+
+def broker_statistics(brokers, top, percentiles):
+    """
+    The `broker_statistics` function computes the distribution of `Total Loan Amount` per broker in one
+    pass: window functions number each broker's loans in ascending order and count them, and only the
+    loans at a percentile rank or among the `top` last ranks (plus the first, carrying the count and
+    mean) leave the database. The pass reads the `invoice_broker_amount_idx` index in order, without
+    sorting; the settlement dates of the top loans are fetched afterwards by Xref.
+
+    :param brokers: Broker names to report; all brokers when empty.
+    :param top: Number of largest loans per broker.
+    :param percentiles: Percentiles between 1 and 100.
+    :return: A list with one dictionary per broker, in broker order, holding the number of loans, the
+    mean and nearest-rank percentiles of `Total Loan Amount` and the top loans, largest first.
+    """
+    query_results = InvoiceData.objects.all()
+    if brokers:
+        query_results = query_results.filter(Broker__in=brokers)
+    # One window definition for every function, so the loans are ordered once, by the index.
+    window = {
+        "partition_by": [F("Broker")],
+        "order_by": [F("Total Loan Amount").asc(), F("Xref").asc()],
+    }
+    whole_partition = RowRange(start=None, end=None)
+    ranked = query_results.annotate(
+        rank=Window(RowNumber(), **window),
+        loan_count=Window(Count("Xref"), frame=whole_partition, **window),
+        mean=Window(Avg("Total Loan Amount"), frame=whole_partition, **window),
+    )
+    wanted = Q(rank=1) | Q(rank__gt=F("loan_count") - top)
+    for percentile in percentiles:
+        # Integer division: the nearest rank is the ceiling of count * percentile / 100.
+        wanted |= Q(rank=(F("loan_count") * percentile + 99) / 100)
+    # Only the selected loans are sorted, in Python; the window pass itself follows the index order.
+    rows = sorted(
+        ranked.filter(wanted)
+        .values_list(
+            "Broker", "Xref", "Total Loan Amount", "rank", "loan_count", "mean"
+        )
+        .order_by(),
+        key=lambda row: (row[0], row[3]),
+    )
+
+    statistics = {}
+    for broker, xref, amount, rank, loan_count, mean in rows:
+        if broker not in statistics:
+            statistics[broker] = {
+                "Broker": broker,
+                "Number of Loans": loan_count,
+                "Mean Loan Amount": round(mean, 4),
+                "Percentiles": {},
+                "Top Loans": [],
+                "ranks": {},
+            }
+        statistics[broker]["ranks"][rank] = amount
+        if rank > loan_count - top:
+            statistics[broker]["Top Loans"].insert(
+                0, {"Xref": xref, "Total Loan Amount": amount}
+            )
+
+    top_xrefs = [
+        loan["Xref"] for row in statistics.values() for loan in row["Top Loans"]
+    ]
+    dates = stored_keys(top_xrefs)
+    result_list = []
+    for row in statistics.values():
+        ranks = row.pop("ranks")
+        row["Percentiles"] = {
+            f"p{percentile}": ranks[nearest_rank(row["Number of Loans"], percentile)]
+            for percentile in percentiles
+        }
+        row["Top Loans"] = [
+            {
+                "Xref": loan["Xref"],
+                "Settlement Date": dates[loan["Xref"]][0],
+                "Total Loan Amount": loan["Total Loan Amount"],
+            }
+            for loan in row["Top Loans"]
+        ]
+        result_list.append(row)
+    return result_list
@@ -1,3 +1,801 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import tempfile
+from datetime import date
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from etl.ingest import bump_data_version, data_version, refresh_rollup
+from etl.models import Broker, DailyRollup, InvoiceData
+from etl.snapshot import build_snapshot
+from etl.sqlite import retry_busy_statement
+
+from .models import QueryProfile
+from .prefix import prefix_index
+from .profiling import QueryProfilingMiddleware
+
+
+def query_plan(sql, params=None):
+    """
+    Return the detail lines of SQLite's `EXPLAIN QUERY PLAN` for a statement.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class ReportQueryPlanTests(TestCase):
+    """
+    Every report must be answered from an index, never by scanning the statement table.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        InvoiceData.objects.bulk_create(
+            InvoiceData(
+                **{
+                    "App ID": xref,
+                    "Xref": xref,
+                    "Settlement Date": date(2024, 1, 1 + xref % 5),
+                    "Broker": f"Broker {xref % 3}",
+                    "Sub Broker": "",
+                    "Borrower Name": "",
+                    "Description": "",
+                    "Total Loan Amount": 10_000.0 * xref,
+                    "Comission Rate": 0.5,
+                    "Upfront": 1.0,
+                    "Upfront Incl GST": 1.1,
+                    "Tier": "Tier 3",
+                }
+            )
+            for xref in range(1, 31)
+        )
+        refresh_rollup(InvoiceData.objects.values_list("Settlement Date", "Broker"))
+
+    def setUp(self):
+        caches["reports"].clear()
+
+    def assert_uses_index(self, url_name, body=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse(url_name),
+                data=json.dumps(body or {}),
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+        selects = [q["sql"] for q in queries if q["sql"].lstrip().startswith("SELECT")]
+        self.assertTrue(selects)
+        for sql in selects:
+            plan = query_plan(sql)
+            # Subqueries run as co-routines are read as they are produced, not from a table.
+            coroutines = {
+                f"SCAN {detail.removeprefix('CO-ROUTINE ')}"
+                for detail in plan
+                if detail.startswith("CO-ROUTINE")
+            }
+            for detail in plan:
+                if detail.startswith(("SCAN", "SEARCH")) and detail not in coroutines:
+                    self.assertRegex(detail, "INDEX|PRIMARY KEY", f"{url_name}: {sql}")
+
+    def test_report_total_load_amount(self):
+        self.assert_uses_index("report_total_load_amount")
+
+    def test_report_number_of_loans(self):
+        self.assert_uses_index("report_number_of_loans")
+
+    def test_highest_loan_amount(self):
+        self.assert_uses_index("highest_loan_amount", {"broker": "Broker 1"})
+
+    def test_broker_report(self):
+        self.assert_uses_index("broker_report", {"broker": "Broker 1"})
+
+    def test_total_loan_amount_by_time(self):
+        self.assert_uses_index(
+            "total_loan_amount_by_time",
+            {"start_date": "2024-01-02", "end_date": "2024-01-04"},
+        )
+
+    def test_loan_statistics(self):
+        self.assert_uses_index("loan_statistics", {"top": 3})
+
+
+class ReportCacheTests(TestCase):
+    def setUp(self):
+        caches["reports"].clear()
+
+    def post(self, url_name, body):
+        return self.client.post(
+            reverse(url_name), data=body, content_type="application/json"
+        )
+
+    def stats(self):
+        return self.client.get(reverse("report_cache_stats")).json()["details"]
+
+    def test_equivalent_bodies_share_an_entry(self):
+        first = self.post("highest_loan_amount", '{"broker": "A", "x": 1}')
+        second = self.post("highest_loan_amount", '{"x":1,"broker":"A"}')
+        self.post("highest_loan_amount", '{"broker": "B"}')
+
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(second["Content-Type"], "application/json")
+        self.assertEqual(self.stats()["hits"], 1)
+        self.assertEqual(self.stats()["misses"], 2)
+
+    def test_data_change_invalidates(self):
+        self.post("report_total_load_amount", "{}")
+        with self.assertNumQueries(1):
+            self.post("report_total_load_amount", "{}")
+
+        bump_data_version()
+        with self.assertNumQueries(2):
+            self.post("report_total_load_amount", "{}")
+        self.assertEqual(self.stats()["misses"], 2)
+
+    def test_errors_are_not_cached(self):
+        self.assertEqual(self.post("highest_loan_amount", "{}").status_code, 400)
+        self.assertEqual(self.post("highest_loan_amount", "{}").status_code, 400)
+        self.assertEqual(self.stats()["hits"], 0)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        caches["reports"].clear()
+
+    def test_get_matches_post(self):
+        url = reverse("highest_loan_amount")
+        response = self.client.get(url, {"broker": "A"})
+        posted = self.client.post(
+            url, data=json.dumps({"broker": "A"}), content_type="application/json"
+        )
+        self.assertEqual(response.json(), posted.json())
+        self.assertIn("no-cache", response["Cache-Control"])
+
+    def test_not_modified_until_next_ingest(self):
+        url = reverse("report_total_load_amount")
+        response = self.client.get(url)
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.client.get(url, headers={"if-none-match": etag}).status_code, 304
+            )
+        self.assertEqual(
+            self.client.get(
+                url, headers={"if-modified-since": last_modified}
+            ).status_code,
+            304,
+        )
+
+        bump_data_version()
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_etag_depends_on_parameters(self):
+        url = reverse("highest_loan_amount")
+        self.assertNotEqual(
+            self.client.get(url, {"broker": "A"})["ETag"],
+            self.client.get(url, {"broker": "B"})["ETag"],
+        )
+
+
+class BrokerReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        DailyRollup.objects.bulk_create(
+            DailyRollup(
+                settlement_date=day,
+                broker=broker,
+                tier="Tier 3",
+                total_loan_amount=amount,
+                loan_count=1,
+                highest_loan_amount=amount,
+            )
+            for broker, day, amount in [
+                ("A", date(2024, 1, 28), 1.0),  # Sunday, ISO week 4
+                ("A", date(2024, 1, 29), 2.0),  # Monday, ISO week 5
+                ("A", date(2024, 2, 2), 4.0),  # Friday, ISO week 5, next month
+                ("B", date(2024, 1, 29), 8.0),
+            ]
+        )
+
+    def setUp(self):
+        caches["reports"].clear()
+
+    def report(self, **params):
+        response = self.client.get(reverse("broker_report"), params)
+        self.assertEqual(response.status_code, 200)
+        return [
+            (row["Broker"], row["Period"], row["Date"], row["Total Loan Amount"])
+            for row in response.json()["details"]
+        ]
+
+    def test_calendar_buckets(self):
+        self.assertEqual(
+            self.report(broker="A", periods=["Weekly", "Month"]),
+            [
+                ("A", "Weekly", "2024-W04", 1.0),
+                ("A", "Weekly", "2024-W05", 6.0),
+                ("A", "Month", "2024-01", 3.0),
+                ("A", "Month", "2024-02", 4.0),
+            ],
+        )
+
+    def test_all_brokers(self):
+        rows = self.report(periods="Month")
+        self.assertEqual(
+            rows,
+            [
+                ("A", "Month", "2024-01", 3.0),
+                ("A", "Month", "2024-02", 4.0),
+                ("B", "Month", "2024-01", 8.0),
+            ],
+        )
+        self.assertEqual(self.report(brokers=["A", "B"], periods="Month"), rows)
+        self.assertEqual(
+            self.report(brokers="B"),
+            [
+                ("B", "Daily", "2024-01-29", 8.0),
+                ("B", "Weekly", "2024-W05", 8.0),
+                ("B", "Month", "2024-01", 8.0),
+            ],
+        )
+
+    def test_invalid_period(self):
+        response = self.client.get(reverse("broker_report"), {"periods": "Yearly"})
+        self.assertEqual(response.status_code, 400)
+
+
+class RangeTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        DailyRollup.objects.bulk_create(
+            DailyRollup(
+                settlement_date=date(2024, 1, day),
+                broker=broker,
+                tier=tier,
+                total_loan_amount=amount,
+                loan_count=1,
+                highest_loan_amount=amount,
+            )
+            for day, broker, tier, amount in [
+                (2, "A", "Tier 3", 10.2525),
+                (2, "B", "Tier 1", 100.5),
+                (5, "A", "Tier 2", 1_000.0),
+                (9, "B", "Tier 3", 10_000.7575),
+            ]
+        )
+
+    def setUp(self):
+        caches["reports"].clear()
+
+    def totals(self, *ranges):
+        response = self.client.post(
+            reverse("total_loan_amount_by_ranges"),
+            data=json.dumps({"ranges": list(ranges)}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        return [row["Total Loan Amount"] for row in response.json()["details"]]
+
+    def test_ranges_match_table_sums(self):
+        ranges = [
+            {"start_date": f"2024-01-{start:02d}", "end_date": f"2024-01-{end:02d}"}
+            for start in range(1, 11)
+            for end in range(start, 11)
+        ]
+        ranges += [dict(r, broker="A") for r in ranges] + [
+            dict(r, broker="B", tier="Tier 3") for r in ranges
+        ]
+        expected = []
+        for r in ranges:
+            rows = DailyRollup.objects.filter(
+                settlement_date__range=(r["start_date"], r["end_date"])
+            )
+            if "broker" in r:
+                rows = rows.filter(broker=r["broker"])
+            if "tier" in r:
+                rows = rows.filter(tier=r["tier"])
+            expected.append(
+                round(rows.aggregate(total=Sum("total_loan_amount"))["total"] or 0, 4)
+            )
+        self.assertEqual(self.totals(*ranges), expected)
+
+    def test_index_follows_data_version(self):
+        day = {"start_date": "2024-01-01", "end_date": "2024-01-31", "tier": "Tier 3"}
+        self.assertEqual(self.totals(day), [10_011.01])
+
+        DailyRollup.objects.filter(broker="A", tier="Tier 3").update(
+            total_loan_amount=20.0
+        )
+        bump_data_version()
+        self.assertEqual(self.totals(day), [10_020.7575])
+
+    def test_series_are_bounded(self):
+        version = data_version()
+        with mock.patch("operations.prefix.MAX_SERIES", 3):
+            ranges = [
+                {"start_date": "2024-01-01", "end_date": "2024-01-31", "broker": name}
+                for name in ["A", "unknown 1", "unknown 2", "A", "unknown 3", "B"]
+            ]
+            self.assertEqual(
+                self.totals(*ranges), [1_010.2525, 0, 0, 1_010.2525, 0, 10_101.2575]
+            )
+        self.assertEqual(prefix_index.version, version)
+        self.assertEqual(
+            list(prefix_index.series),
+            [("A", None), ("unknown 3", None), ("B", None)],
+        )
+
+    def test_invalid_ranges(self):
+        url = reverse("total_loan_amount_by_ranges")
+        for body in [{}, {"ranges": [{"start_date": "2024-01-01"}]}, {"ranges": [1]}]:
+            response = self.client.post(
+                url, data=json.dumps(body), content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 400)
+
+
+class BrokerLookupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Broker.objects.bulk_create(
+            Broker(name=name) for name in ["Acme", "acorn", "Bolt", "Ace", "Crux"]
+        )
+
+    def lookup(self, **params):
+        response = self.client.get(reverse("broker_lookup"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["details"]
+
+    def test_prefix_and_pages(self):
+        self.assertEqual(
+            self.lookup(q="ac", page_size=2),
+            {"brokers": ["Ace", "Acme"], "page": 1, "has_next": True},
+        )
+        self.assertEqual(
+            self.lookup(q="ac", page_size=2, page=2),
+            {"brokers": ["acorn"], "page": 2, "has_next": False},
+        )
+        self.assertEqual(len(self.lookup()["brokers"]), 5)
+
+    def test_index_lists_brokers(self):
+        response = self.client.get(reverse("index"))
+        self.assertEqual(
+            response.context["brokers"], ["", "Ace", "Acme", "Bolt", "Crux", "acorn"]
+        )
+
+    def test_invalid_page(self):
+        for params in [{"page": 0}, {"page_size": 1_000}, {"page": "x"}]:
+            response = self.client.get(reverse("broker_lookup"), params)
+            self.assertEqual(response.status_code, 400)
+
+
+class AggregateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        InvoiceData.objects.bulk_create(
+            InvoiceData(
+                **{
+                    "App ID": xref,
+                    "Xref": xref,
+                    "Settlement Date": day,
+                    "Broker": broker,
+                    "Sub Broker": sub_broker,
+                    "Borrower Name": "",
+                    "Description": "",
+                    "Total Loan Amount": amount,
+                    "Comission Rate": 0.5,
+                    "Upfront": amount / 100,
+                    "Upfront Incl GST": amount / 100 * 1.1,
+                    "Tier": tier,
+                }
+            )
+            for xref, (day, broker, sub_broker, tier, amount) in enumerate(
+                [
+                    (date(2024, 1, 2), "A", "A1", "Tier 1", 100.0),
+                    (date(2024, 1, 2), "A", "A2", "Tier 1", 300.0),
+                    (date(2024, 1, 31), "A", "A1", "Tier 2", 50.0),
+                    (date(2024, 2, 1), "B", "B1", "Tier 1", 1_000.0),
+                ],
+                start=1,
+            )
+        )
+        refresh_rollup(InvoiceData.objects.values_list("Settlement Date", "Broker"))
+
+    def setUp(self):
+        caches["reports"].clear()
+
+    def aggregate(self, **params):
+        response = self.client.post(
+            reverse("aggregate"),
+            data=json.dumps(params),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()["details"]
+
+    def test_rollup_answers_loan_amount_metrics(self):
+        metrics = [
+            "count",
+            "sum:Total Loan Amount",
+            "max:Total Loan Amount",
+            "avg:Total Loan Amount",
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.aggregate(group_by=["Month", "Broker"], metrics=metrics)
+        self.assertIn("etl_dailyrollup", queries.captured_queries[-1]["sql"])
+        columns = ["Month", "Broker", *metrics]
+        self.assertEqual(
+            rows,
+            [
+                dict(zip(columns, ["2024-01", "A", 3, 450.0, 300.0, 150.0])),
+                dict(zip(columns, ["2024-02", "B", 1, 1000.0, 1000.0, 1000.0])),
+            ],
+        )
+
+        response = self.client.get(
+            reverse("aggregate"),
+            {"metrics": "sum:Total Loan Amount", "end_date": "2024-01-31"},
+        )
+        self.assertEqual(response.json()["details"], [{"sum:Total Loan Amount": 450.0}])
+
+    def test_several_queries_in_one_request(self):
+        details = self.aggregate(
+            queries={
+                "sub_brokers": {
+                    "group_by": "Sub Broker",
+                    "metrics": ["sum:Upfront", "count"],
+                    "broker": "A",
+                },
+                "tiers": {
+                    "group_by": ["Settlement Date", "Tier"],
+                    "metrics": "count",
+                    "start_date": "2024-01-02",
+                    "end_date": "2024-01-02",
+                },
+                # Values are query parameters, never SQL.
+                "injected": {"metrics": "count", "broker": "A' OR '1'='1"},
+            }
+        )
+        self.assertEqual(
+            details,
+            {
+                "sub_brokers": [
+                    {"Sub Broker": "A1", "sum:Upfront": 1.5, "count": 2},
+                    {"Sub Broker": "A2", "sum:Upfront": 3.0, "count": 1},
+                ],
+                "tiers": [
+                    {"Settlement Date": "2024-01-02", "Tier": "Tier 1", "count": 2}
+                ],
+                "injected": [{"count": 0}],
+            },
+        )
+
+    def test_snapshot_matches_sql(self):
+        requests = [
+            {
+                "group_by": ["Month", "Broker"],
+                "metrics": ["count", "sum:Total Loan Amount", "avg:Total Loan Amount"],
+            },
+            {
+                "group_by": ["Settlement Date", "Sub Broker", "Tier"],
+                "metrics": ["max:Upfront", "avg:Comission Rate"],
+                "broker": ["A", "Z"],
+                "start_date": "2024-01-02",
+                "end_date": "2024-01-31",
+            },
+            {"metrics": ["count", "sum:Upfront Incl GST"], "tier": "Tier 1"},
+            {"metrics": ["count", "max:Upfront"], "broker": "Z"},
+            {"group_by": "Broker", "metrics": "count", "sub_broker": "Z1"},
+            {"group_by": "Sub Broker", "metrics": ["count", "avg:Upfront"]},
+        ]
+        expected = [self.aggregate(**params) for params in requests]
+
+        with tempfile.TemporaryDirectory() as workdir, override_settings(
+            ANALYTICS_SNAPSHOT=True, ANALYTICS_SNAPSHOT_DIR=workdir
+        ):
+            build_snapshot()
+            for params, rows in zip(requests, expected):
+                caches["reports"].clear()
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(self.aggregate(**params), rows)
+                self.assertFalse(
+                    [
+                        q
+                        for q in queries.captured_queries
+                        if "etl_invoicedata" in q["sql"]
+                    ]
+                )
+
+            # A snapshot of another data version is not used.
+            bump_data_version()
+            caches["reports"].clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.aggregate(**requests[1]), expected[1])
+            self.assertIn("etl_invoicedata", queries.captured_queries[-1]["sql"])
+
+    def test_invalid_aggregations(self):
+        for params in [
+            {"metrics": "count", "group_by": "Borrower Name"},
+            {"metrics": "sum:Borrower Name"},
+            {"group_by": "Broker"},
+            {"metrics": "count", "start_date": "2024-13-01"},
+            {"metrics": "count", "order_by": "Broker"},
+            {"queries": {}},
+            {"queries": {str(i): {"metrics": "count"} for i in range(21)}},
+        ]:
+            response = self.client.post(
+                reverse("aggregate"),
+                data=json.dumps(params),
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 400, params)
+
+
+class LoanStatisticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        InvoiceData.objects.bulk_create(
+            InvoiceData(
+                **{
+                    "App ID": xref,
+                    "Xref": xref,
+                    "Settlement Date": date(2024, 1, 1),
+                    "Broker": broker,
+                    "Sub Broker": "",
+                    "Borrower Name": "",
+                    "Description": "",
+                    "Total Loan Amount": amount,
+                    "Comission Rate": 0.5,
+                    "Upfront": 1.0,
+                    "Upfront Incl GST": 1.1,
+                    "Tier": "Tier 3",
+                }
+            )
+            for xref, broker, amount in [
+                *[(xref, "A", 100.0 * (xref % 20 + 1)) for xref in range(1, 21)],
+                (21, "B", 5.0),
+                (22, "A", 2_000.0),  # Ties with Xref 19; the larger Xref ranks first.
+            ]
+        )
+
+    def setUp(self):
+        caches["reports"].clear()
+
+    def statistics(self, **params):
+        response = self.client.get(reverse("loan_statistics"), params)
+        self.assertEqual(response.status_code, 200)
+        return {row["Broker"]: row for row in response.json()["details"]}
+
+    def test_percentiles_and_top_loans(self):
+        statistics = self.statistics(top=3)
+        self.assertEqual(list(statistics), ["A", "B"])
+        self.assertEqual(statistics["A"]["Number of Loans"], 21)
+        self.assertEqual(statistics["A"]["Mean Loan Amount"], round(23_000.0 / 21, 4))
+        # Nearest rank of 21 sorted amounts: p50 is the 11th, p90 the 19th, p99 the 21st.
+        self.assertEqual(
+            statistics["A"]["Percentiles"],
+            {"p50": 1_100.0, "p90": 1_900.0, "p99": 2_000.0},
+        )
+        self.assertEqual(
+            [loan["Xref"] for loan in statistics["A"]["Top Loans"]], [22, 19, 18]
+        )
+        self.assertEqual(
+            statistics["B"]["Percentiles"], {"p50": 5.0, "p90": 5.0, "p99": 5.0}
+        )
+
+        statistics = self.statistics(broker="A", percentiles=[100, 25], top=0)
+        self.assertEqual(list(statistics), ["A"])
+        self.assertEqual(
+            statistics["A"]["Percentiles"], {"p25": 600.0, "p100": 2_000.0}
+        )
+        self.assertEqual(statistics["A"]["Top Loans"], [])
+
+    def test_queries_do_not_grow_with_brokers(self):
+        InvoiceData.objects.bulk_create(
+            InvoiceData(
+                **{
+                    "App ID": xref,
+                    "Xref": xref,
+                    "Settlement Date": date(2024, 1, 2),
+                    "Broker": f"Broker {xref % 50}",
+                    "Total Loan Amount": float(xref),
+                    "Comission Rate": 0.5,
+                    "Upfront": 1.0,
+                    "Upfront Incl GST": 1.1,
+                    "Tier": "Tier 3",
+                }
+            )
+            for xref in range(100, 600)
+        )
+        # The data version, one window pass for the ranks and one lookup of the top loans' dates.
+        with self.assertNumQueries(3):
+            statistics = self.statistics(top=2)
+        self.assertEqual(len(statistics), 52)
+        self.assertEqual(statistics["Broker 7"]["Number of Loans"], 10)
+        self.assertEqual(statistics["Broker 7"]["Percentiles"]["p50"], 307.0)
+        self.assertEqual(
+            statistics["Broker 7"]["Top Loans"],
+            [
+                {
+                    "Xref": xref,
+                    "Settlement Date": "2024-01-02",
+                    "Total Loan Amount": xref,
+                }
+                for xref in [557.0, 507.0]
+            ],
+        )
+
+        caches["reports"].clear()
+        with self.assertNumQueries(2):
+            self.statistics(top=0)
+
+    def test_invalid_parameters(self):
+        for params in [{"top": "x"}, {"top": 101}, {"percentiles": 0}]:
+            response = self.client.get(reverse("loan_statistics"), params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+@override_settings(EXPORT_CHUNK_SIZE=4)
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        InvoiceData.objects.bulk_create(
+            InvoiceData(
+                **{
+                    "App ID": xref,
+                    "Xref": xref,
+                    "Settlement Date": date(2024, 1, 1 + xref % 3),
+                    "Broker": f"Broker {xref % 2}",
+                    "Sub Broker": "",
+                    "Borrower Name": 'Jo, "Jr"',
+                    "Description": "",
+                    "Total Loan Amount": 1_000.0 * xref,
+                    "Comission Rate": 0.5,
+                    "Upfront": 1.0,
+                    "Upfront Incl GST": 1.1,
+                    "Tier": "Tier 3",
+                }
+            )
+            for xref in range(1, 11)
+        )
+        refresh_rollup(InvoiceData.objects.values_list("Settlement Date", "Broker"))
+
+    def setUp(self):
+        caches["reports"].clear()
+
+    def export(self, name, **params):
+        response = self.client.get(reverse("export", args=[name]), params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_invoices_csv_in_keyset_chunks(self):
+        # Three chunks of at most 4 rows; the third is short and ends the export.
+        with self.assertNumQueries(4):
+            rows = list(csv.reader(io.StringIO(self.export("invoices"))))
+        self.assertEqual(rows[0][:3], ["App ID", "Xref", "Settlement Date"])
+        self.assertEqual([row[1] for row in rows[1:]], [str(x) for x in range(1, 11)])
+        self.assertEqual(rows[1][5], 'Jo, "Jr"')
+
+        rows = list(csv.reader(io.StringIO(self.export("invoices", after=8))))
+        self.assertEqual([row[1] for row in rows[1:]], ["9", "10"])
+
+    def test_report_ndjson_matches_json_report(self):
+        lines = self.export("total_loan_amount", format="ndjson").splitlines()
+        report = self.client.get(reverse("report_total_load_amount")).json()["details"]
+        self.assertEqual([json.loads(line) for line in lines], report)
+
+    def test_broker_report_export(self):
+        rows = list(
+            csv.reader(io.StringIO(self.export("broker_report", periods="Month")))
+        )
+        self.assertEqual(
+            rows[1:],
+            [
+                ["Broker 0", "Month", "2024-01", "2024-01-01", "2024-01-31", "30000.0"],
+                ["Broker 1", "Month", "2024-01", "2024-01-01", "2024-01-31", "25000.0"],
+            ],
+        )
+
+        # A single `broker` selects the same rows as in `broker_report`.
+        params = {"broker": "Broker 1", "periods": "Month"}
+        lines = self.export("broker_report", format="ndjson", **params).splitlines()
+        report = self.client.get(reverse("broker_report"), params).json()["details"]
+        self.assertEqual([json.loads(line)["Broker"] for line in lines], ["Broker 1"])
+        self.assertEqual(
+            [json.loads(line)["Total Loan Amount"] for line in lines],
+            [row["Total Loan Amount"] for row in report],
+        )
+
+    def test_unknown_export(self):
+        self.assertEqual(
+            self.client.get(reverse("export", args=["nope"])).status_code, 404
+        )
+        for params in [{"format": "xml"}, {"after": "x"}, {"after": ["1", "2"]}]:
+            response = self.client.get(reverse("export", args=["invoices"]), params)
+            self.assertEqual(response.status_code, 400)
+
+    async def test_async_client(self):
+        # Under ASGI the views run on the event loop and exports stream from an async iterator.
+        response = await self.async_client.get(reverse("report_total_load_amount"))
+        self.assertEqual(
+            [row["Total Loan Amount"] for row in response.json()["details"]],
+            [18_000.0, 22_000.0, 15_000.0],
+        )
+
+        response = await self.async_client.get(reverse("export", args=["invoices"]))
+        self.assertTrue(response.is_async)
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual([row[1] for row in rows[1:]], [str(x) for x in range(1, 11)])
+
+
+@override_settings(
+    QUERY_PROFILING=True, QUERY_PROFILING_SLOW_MS=0, QUERY_PROFILING_REPEAT_THRESHOLD=3
+)
+class QueryProfilingTests(TestCase):
+    def setUp(self):
+        caches["reports"].clear()
+
+    def test_repeated_statements_are_flagged(self):
+        def view(request):
+            for name in ["A", "B", "C"]:
+                Broker.objects.filter(name=name).exists()
+            return HttpResponse()
+
+        with self.assertLogs("operations.profiling", "INFO") as logs:
+            QueryProfilingMiddleware(view)(RequestFactory().get("/brokers/"))
+        self.assertEqual(json.loads(logs.records[0].getMessage())["queries"], 3)
+
+        profile = QueryProfile.objects.get()
+        self.assertEqual((profile.path, profile.query_count), ("/brokers/", 3))
+        self.assertEqual(len(profile.repeated_queries), 1)
+        self.assertEqual(profile.repeated_queries[0]["count"], 3)
+        self.assertIn("etl_broker", profile.slowest_sql)
+        # The plan of each slow SELECT is captured.
+        self.assertTrue(all("USING" in query["plan"] for query in profile.slow_queries))
+
+    def test_report_request_is_profiled(self):
+        with self.assertLogs("operations.profiling", "INFO"):
+            response = self.client.get(reverse("highest_loan_amount"), {"broker": "A"})
+        self.assertEqual(response.status_code, 200)
+        profile = QueryProfile.objects.get()
+        self.assertEqual(profile.path, reverse("highest_loan_amount"))
+        self.assertEqual(profile.repeated_queries, [])
+        self.assertTrue(any(query["plan"] for query in profile.slow_queries))
+
+    # Pragmas cannot change inside the test transaction; only the wrapper matters here.
+    @override_settings(SQLITE_CONCURRENCY=True, SQLITE_PRAGMAS={})
+    def test_recorder_removed_when_request_opens_connection(self):
+        wrappers = connection.execute_wrappers
+        self.addCleanup(setattr, connection, "execute_wrappers", wrappers[:])
+
+        def view(request):
+            # The in-memory test database cannot be reopened, so the request reports a fresh
+            # connection the way the backend does, installing the busy-retry wrapper.
+            connection_created.send(sender=type(connection), connection=connection)
+            Broker.objects.exists()
+            return HttpResponse()
+
+        middleware = QueryProfilingMiddleware(view)
+        with self.assertLogs("operations.profiling", "INFO"):
+            for _ in range(3):
+                middleware(RequestFactory().get("/brokers/"))
+        self.assertEqual(connection.execute_wrappers, [retry_busy_statement])
+
+    @override_settings(QUERY_PROFILING=False)
+    def test_disabled_by_default(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryProfilingMiddleware(HttpResponse)
@@ -5,6 +5,7 @@ from . import views
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path("brokers/", views.broker_lookup, name="broker_lookup"),
     path(
         "report_total_load_amount/",
         views.report_total_load_amount,
@@ -30,4 +31,17 @@ urlpatterns = [
         views.total_loan_amount_by_time,
         name="total_loan_amount_by_time",
     ),
+    path(
+        "total_loan_amount_by_ranges/",
+        views.total_loan_amount_by_ranges,
+        name="total_loan_amount_by_ranges",
+    ),
+    path("loan_statistics/", views.loan_statistics, name="loan_statistics"),
+    path("aggregate/", views.aggregate, name="aggregate"),
+    path("export/<str:name>/", views.export, name="export"),
+    path(
+        "report_cache_stats/",
+        views.report_cache_stats,
+        name="report_cache_stats",
+    ),
 ]
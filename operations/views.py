@@ -1,242 +1,263 @@
-import json
 from datetime import datetime
 
-from dateutil.relativedelta import relativedelta
-from django.http import HttpResponseBadRequest, JsonResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Max, Sum
+from django.http import (
+    Http404,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render
 
-from etl.models import InvoiceData
+from etl.models import Broker, DailyRollup
+
+from .aggregate import MAX_QUERIES, run_aggregation
+from .buckets import PERIODS, bucket_totals
+from .cache import adata_state, cache_stats, cached_report, conditional_report
+from .exports import EXPORTS, FORMATS, async_lines
+from .params import list_param, request_params
+from .prefix import MAX_RANGES, prefix_index
+from .stats import DEFAULT_PERCENTILES, DEFAULT_TOP, TOP_MAX, broker_statistics
+
+BROKER_PAGE_SIZE = 20
+BROKER_PAGE_SIZE_MAX = 200
 
 
 def index(request):
     """
-    The `index` function retrieves unique broker names from the `InvoiceData` model and renders them in
-    a template for display.
+    The `index` function retrieves the unique broker names from the `Broker` table, which ingestion
+    keeps in step with `InvoiceData`, and renders them in a template for display.
 
     :param request: The `request` parameter in the `index` function is an object that contains
     information about the current HTTP request. It includes details such as the request method (GET,
     POST, etc.), request headers, request data, and more. In this code snippet, the function checks if
     the request method is
-    :return: The `index` view function returns a list of unique broker names extracted from the
-    `InvoiceData` model in the database when the HTTP method is "GET". This list is then passed to the
+    :return: The `index` view function returns the sorted list of unique broker names stored in the
+    `Broker` table when the HTTP method is "GET". This list is then passed to the
     "reporting.html" template as a context variable named "brokers". If the request method is not "GET",
     it returns an HTTP 400 Bad Request response with the message "Method Not Allowed".
     """
     if request.method == "GET":
-        query_results = InvoiceData.objects.raw(
-            "SELECT Xref, Broker FROM etl_invoicedata"
-        )
         result_list = [""]
-        for item in query_results:
-            result_list.append(item.Broker)
-        return render(request, "reporting.html", {"brokers": list(set(result_list))})
+        result_list += Broker.objects.order_by("name").values_list("name", flat=True)
+        return render(request, "reporting.html", {"brokers": result_list})
     else:
         return HttpResponseBadRequest("Method Not Allowed")
 
 
-def report_total_load_amount(request):
+async def broker_lookup(request):
+    """
+    The `broker_lookup` function serves broker name autocomplete from the `Broker` table.
+
+    :param request: The HttpRequest; the optional `q` query parameter is a case-insensitive name
+    prefix, `page` (from 1) and `page_size` (at most `BROKER_PAGE_SIZE_MAX`) select the page.
+    :return: A JsonResponse with the status "Pass" and the page's broker names in alphabetical order,
+    the page number and whether a next page exists. Invalid paging parameters or non-GET requests get
+    an HttpResponseBadRequest.
+    """
+    if request.method == "GET":
+        try:
+            page = int(request.GET.get("page", 1))
+            page_size = int(request.GET.get("page_size", BROKER_PAGE_SIZE))
+        except ValueError:
+            return HttpResponseBadRequest("page and page_size must be integers")
+        if page < 1 or not 1 <= page_size <= BROKER_PAGE_SIZE_MAX:
+            return HttpResponseBadRequest(
+                f"page must be positive and page_size between 1 and {BROKER_PAGE_SIZE_MAX}"
+            )
+
+        query_results = Broker.objects.order_by("name")
+        prefix = request.GET.get("q", "")
+        if prefix:
+            query_results = query_results.filter(name__istartswith=prefix)
+        offset = (page - 1) * page_size
+        names = [
+            name
+            async for name in query_results.values_list("name", flat=True)[
+                offset : offset + page_size + 1
+            ]
+        ]
+
+        return JsonResponse(
+            {
+                "status": "Pass",
+                "details": {
+                    "brokers": names[:page_size],
+                    "page": page,
+                    "has_next": len(names) > page_size,
+                },
+            }
+        )
+    else:
+        return HttpResponseBadRequest("Method Not Allowed")
+
+
+@conditional_report
+@cached_report
+async def report_total_load_amount(request):
     """
     This Python function retrieves and sums up total loan amounts from a database table based on
     settlement dates and returns the results in a JSON response.
 
     :param request: The function `report_total_load_amount` takes a request object as a parameter. It
-    checks if the request method is "POST" and then executes a raw SQL query to retrieve data from the
-    `InvoiceData` model. The query calculates the total loan amount grouped by the "Settlement Date"
-    field
+    checks if the request method is GET or POST and then queries the `DailyRollup` table, which holds
+    the `InvoiceData` totals per day, broker and tier. The query calculates the total loan amount
+    grouped by the settlement date
     :return: The function `report_total_load_amount` returns a JSON response containing the status
     "Pass" and a list of dictionaries with the keys "Settlement Date" and "Total Loan Amount". The data
     in the list is retrieved from the database query results where the total loan amount is summed up
-    based on the Settlement Date. If the request method is not POST, it returns an HTTP 400 Bad Request
+    based on the Settlement Date. For any other request method, it returns an HTTP 400 Bad Request
     response
     """
-    if request.method == "POST":
-        query_results = InvoiceData.objects.raw(
-            "SELECT  `Settlement Date` AS Date, Xref, SUM(`Total Loan Amount`) AS `total_loan_amount` FROM etl_invoicedata GROUP BY `Settlement Date`;"
+    if request.method in ("GET", "POST"):
+        query_results = (
+            DailyRollup.objects.values("settlement_date")
+            .annotate(total=Sum("total_loan_amount"))
+            .order_by("settlement_date")
         )
 
         result_list = []
-        for item in query_results:
-            if item:
-                result_list.append(
-                    {
-                        "Settlement Date": item.Date,
-                        "Total Loan Amount": round(item.total_loan_amount, 4),
-                    }
-                )
+        async for item in query_results:
+            result_list.append(
+                {
+                    "Settlement Date": item["settlement_date"],
+                    "Total Loan Amount": round(item["total"], 4),
+                }
+            )
         return JsonResponse({"status": "Pass", "details": result_list})
     else:
         return HttpResponseBadRequest("Method Not Allowed")
 
 
-def report_number_of_loans(request):
+@conditional_report
+@cached_report
+async def report_number_of_loans(request):
     """
     This Python function retrieves the number of loans grouped by settlement date and tier from a
-    database table and returns the results in a JSON response for a POST request.
+    database table and returns the results in a JSON response for a GET or POST request.
 
     :param request: The `report_number_of_loans` function takes a request object as a parameter. It
-    checks if the request method is "POST", and if so, it executes a raw SQL query to retrieve data from
-    the `InvoiceData` model. The query calculates the number of loans grouped by `Settlement
+    checks if the request method is GET or POST, and if so, it queries the `DailyRollup` table for the
+    loan counts of the `InvoiceData` rows, grouped by settlement date and tier
     :return: A JSON response containing the status "Pass" and details of the settlement date, tier, and
     number of loans for each item in the query results is being returned.
     """
-    if request.method == "POST":
-        query_results = InvoiceData.objects.raw(
-            "SELECT Xref, `Settlement Date` AS Date, Tier, COUNT(*) AS num_loans FROM etl_invoicedata GROUP BY `Settlement Date`, Tier;"
+    if request.method in ("GET", "POST"):
+        query_results = (
+            DailyRollup.objects.values("settlement_date", "tier")
+            .annotate(num_loans=Sum("loan_count"))
+            .order_by("settlement_date", "tier")
         )
 
         result_list = []
-        for item in query_results:
-            if item:
-                result_list.append(
-                    {
-                        "Settlement Date": item.Date,
-                        "Tier": item.Tier,
-                        "Number of Loans": item.num_loans,
-                    }
-                )
+        async for item in query_results:
+            result_list.append(
+                {
+                    "Settlement Date": item["settlement_date"],
+                    "Tier": item["tier"],
+                    "Number of Loans": item["num_loans"],
+                }
+            )
         return JsonResponse({"status": "Pass", "details": result_list})
 
     else:
         return HttpResponseBadRequest("Method Not Allowed")
 
 
-def highest_loan_amount(request):
+@conditional_report
+@cached_report
+async def highest_loan_amount(request):
     """
     This Python function retrieves the highest loan amount associated with a specific broker from a
     database table and returns the result in a JSON response.
 
     :param request: The `highest_loan_amount` function you provided is designed to retrieve the highest
-    loan amount associated with a specific broker from the `InvoiceData` table. It takes a POST request
-    containing the broker's name as a parameter
+    loan amount associated with a specific broker from the `DailyRollup` table. It takes a GET request
+    with a `broker` query parameter, or a POST request containing the broker's name in its JSON body
     :return: The function `highest_loan_amount` returns a JSON response containing the status "Pass" and
     details of the highest loan amount associated with a specific broker. The details include the
     broker's name and the highest loan amount found in the database for that broker. If the request
-    method is not POST, it returns an HTTP response indicating that the method is not allowed.
+    method is not GET or POST, it returns an HTTP response indicating that the method is not allowed.
     """
-    if request.method == "POST":
-        broker_name = json.loads(request.body).get("broker")
+    if request.method in ("GET", "POST"):
+        params = request_params(request)
+        if params is None:
+            return HttpResponseBadRequest("Request body must be a JSON object")
+        broker_name = params.get("broker")
         if not broker_name:
             return HttpResponseBadRequest("Broker name is required")
 
-        query_results = InvoiceData.objects.raw(
-            f"SELECT Xref, MAX(`Total Loan Amount`) AS highest_loan_amount FROM etl_invoicedata WHERE Broker = '{broker_name}'"
+        query_results = await DailyRollup.objects.filter(broker=broker_name).aaggregate(
+            highest_loan_amount=Max("highest_loan_amount")
         )
 
-        result_list = []
-        for item in query_results:
-            if item:
-                result_list.append(
-                    {
-                        "Broker": broker_name,
-                        "Highest Loan Amount": item.highest_loan_amount,
-                    }
-                )
+        result_list = [
+            {
+                "Broker": broker_name,
+                "Highest Loan Amount": query_results["highest_loan_amount"],
+            }
+        ]
         return JsonResponse({"status": "Pass", "details": result_list})
     else:
         return HttpResponseBadRequest("Method Not Allowed")
 
 
-def diff_dates_month(date1, date2):
-    """
-    The function `diff_dates_month` calculates the difference in months between two dates using the
-    `relativedelta` function.
-
-    :param date1: It looks like you are trying to calculate the difference in months between two dates
-    using the `relativedelta` function. However, the code snippet you provided is incomplete. Could you
-    please provide the missing part of the code or let me know how I can assist you further with this
-    function?
-    :param date2: It seems like you were about to provide some information about the `date2` parameter,
-    but the message got cut off. Could you please provide more details or complete the sentence so that
-    I can assist you better?
-    :return: the difference in months between the two input dates, `date2` and `date1`, using the
-    `relativedelta` function.
-    """
-    return relativedelta(date2 - date1).months
-
-
-def broker_report(request):
+@conditional_report
+@cached_report
+async def broker_report(request):
     """
-    This Python function generates a broker report based on the total loan amounts for a specific broker
-    grouped by settlement date.
-
-    :param request: The `broker_report` function you provided seems to be handling a POST request to
-    generate a report based on broker data from an InvoiceData model. It retrieves the total loan amount
-    grouped by settlement date for a specific broker
-    :return: The `broker_report` function is returning a list of dictionaries containing information
-    about the total loan amount for a specific broker on different settlement dates. The information
-    includes the broker's name, the settlement date, the total loan amount, and the period (which is set
-    to "Daily" for each entry). The results are sorted based on the settlement date before being
-    returned.
+    This Python function generates a broker report with the total loan amounts per day, ISO week and
+    calendar month, for one broker, a list of brokers or all brokers in a single request.
+
+    :param request: The `broker_report` function handles a GET or POST request whose parameters may
+    name a `broker`, a list of `brokers` (a repeated query parameter for GET) or neither, in which case
+    every broker is reported. An optional `periods` list restricts the report to some of "Daily",
+    "Weekly" and "Month". The daily totals of all requested brokers are read from the DailyRollup model
+    in one query and bucketed by `bucket_totals`
+    :return: The `broker_report` function is returning a list of dictionaries containing the broker's
+    name, the bucket label (the date, an ISO week such as "2024-W05" or a month such as "2024-01"), the
+    first and last day of the bucket, the total loan amount and the period ("Daily", "Weekly" or
+    "Month"). Rows are ordered by broker, period and date. Invalid parameters get an
+    HttpResponseBadRequest.
     """
-    if request.method == "POST":
-        broker_name = json.loads(request.body).get("broker")
-        if not broker_name:
-            return HttpResponseBadRequest("Broker name is required")
-        query_results = InvoiceData.objects.raw(
-            f"SELECT Xref, SUM(`Total Loan Amount`) as total_loan_amount, `Settlement Date` AS Date FROM etl_invoicedata WHERE Broker = '{broker_name}' GROUP BY `Settlement Date`"
+    if request.method in ("GET", "POST"):
+        params = request_params(request)
+        if params is None:
+            return HttpResponseBadRequest("Request body must be a JSON object")
+        brokers = list_param(params, "brokers")
+        broker = list_param(params, "broker")
+        periods = list_param(params, "periods") or list(PERIODS)
+        if brokers is None or broker is None or not set(periods) <= set(PERIODS):
+            return HttpResponseBadRequest(
+                "broker and brokers must be names, periods one of: Daily, Weekly, Month"
+            )
+        brokers += broker
+
+        query_results = DailyRollup.objects.all()
+        if brokers:
+            query_results = query_results.filter(broker__in=brokers)
+        query_results = (
+            query_results.values_list("broker", "settlement_date")
+            .annotate(total=Sum("total_loan_amount"))
+            .order_by("broker", "settlement_date")
         )
-        result_list = []
-        for item in query_results:
-            if item:
-                result_list.append(
-                    {
-                        "Broker": broker_name,
-                        "Date": item.Date,
-                        "Total Loan Amount": item.total_loan_amount,
-                        "Period": "Daily",
-                    }
-                )
-        result_list = sorted(result_list, key=lambda x: x["Date"])
-
-        if len(result_list) > 0:
-            start_date_week = result_list[0]["Date"]
-            start_date_month = result_list[0]["Date"]
-            duration_week = {str(start_date_week): result_list[0]["Total Loan Amount"]}
-            duration_month = {
-                str(start_date_month): result_list[0]["Total Loan Amount"]
-            }
 
-            for result_ in result_list[1:]:
-                period = abs((start_date_week - result_["Date"]).days)
-                if period == 7:
-                    duration_week[f"{str(start_date_week)}-{str(result_['Date'])}"] = (
-                        duration_week[str(start_date_week)]
-                    )
-                elif period < 7:
-                    duration_week[str(start_date_week)] += result_["Total Loan Amount"]
-                else:
-                    duration_week[result_["Date"]] = result_["Total Loan Amount"]
-                    start_date_week = result_["Date"]
-
-                period = diff_dates_month(start_date_month, result_["Date"])
-                if period == 1:
-                    duration_month[
-                        f"{str(start_date_month)}-{str(result_['Date'])}"
-                    ] = duration_month[str(start_date_month)]
-                elif period < 1:
-                    duration_month[str(start_date_month)] += result_[
-                        "Total Loan Amount"
-                    ]
-                else:
-                    duration_month[result_["Date"]] = result_["Total Loan Amount"]
-                    start_date_month = result_["Date"]
-
-        for dur_key, dur_value in duration_week.items():
-            result_list.append(
-                {
-                    "Broker": broker_name,
-                    "Date": dur_key,
-                    "Total Loan Amount": dur_value,
-                    "Period": "Weekly",
-                }
-            )
-        for dur_key, dur_value in duration_month.items():
+        daily = [row async for row in query_results]
+        result_list = []
+        for broker_name, period, label, start, end, total in bucket_totals(
+            daily, periods
+        ):
             result_list.append(
                 {
                     "Broker": broker_name,
-                    "Date": dur_key,
-                    "Total Loan Amount": dur_value,
-                    "Period": "Month",
+                    "Date": label,
+                    "Start Date": start,
+                    "End Date": end,
+                    "Total Loan Amount": round(total, 4),
+                    "Period": period,
                 }
             )
 
@@ -245,22 +266,28 @@ def broker_report(request):
         return HttpResponseBadRequest("Method Not Allowed")
 
 
-def total_loan_amount_by_time(request):
+@conditional_report
+@cached_report
+async def total_loan_amount_by_time(request):
     """
     This Python function calculates the total loan amount within a specified time range based on invoice
     data.
 
     :param request: The function `total_loan_amount_by_time` is designed to calculate the total loan
-    amount within a specified time range. It takes a POST request with JSON data containing a start date
-    and an end date. The function then converts these dates to datetime objects, performs a SQL query to
-    retrieve the total loan amount
+    amount within a specified time range. It takes a GET request with query parameters, or a POST
+    request with JSON data, containing a start date and an end date. The function then converts these
+    dates to datetime objects and sums the daily totals of the `DailyRollup` table between them, both
+    dates included
     :return: The function `total_loan_amount_by_time` returns a JSON response containing the status
     "Pass" and a list of dictionaries with details including the start date, end date, and total loan
     amount for a given time period.
     """
-    if request.method == "POST":
-        start_date = json.loads(request.body).get("start_date")
-        end_date = json.loads(request.body).get("end_date")
+    if request.method in ("GET", "POST"):
+        params = request_params(request)
+        if params is None:
+            return HttpResponseBadRequest("Request body must be a JSON object")
+        start_date = params.get("start_date")
+        end_date = params.get("end_date")
 
         try:
             start_date = datetime.strptime(start_date, "%Y-%m-%d")
@@ -269,21 +296,215 @@ def total_loan_amount_by_time(request):
         except Exception as e:
             return HttpResponseBadRequest("Enter a valid start and end date")
 
-        query_results = InvoiceData.objects.raw(
-            f"SELECT Xref, SUM(`Total Loan Amount`) AS total_loan_amount FROM etl_invoicedata WHERE `Settlement Date` BETWEEN '{start_date}' AND '{end_date}'"
-        )
+        query_results = await DailyRollup.objects.filter(
+            settlement_date__range=(start_date.date(), end_date.date())
+        ).aaggregate(total_loan_amount=Sum("total_loan_amount"))
+
+        result_list = [
+            {
+                "Start Date": start_date,
+                "End Date": end_date,
+                "Total Loan Amount": round(query_results["total_loan_amount"] or 0, 4),
+            }
+        ]
+
+        return JsonResponse({"status": "Pass", "details": result_list})
+    else:
+        return HttpResponseBadRequest("Method Not Allowed")
+
+
+@cached_report
+async def total_loan_amount_by_ranges(request):
+    """
+    This Python function answers a batch of date-range total loan amount queries from the in-memory
+    prefix-sum index, each range in O(log n) instead of a `SUM` over the table.
+
+    :param request: The `total_loan_amount_by_ranges` function takes a POST request whose JSON body
+    holds a `ranges` list. Each range is an object with a `start_date` and an `end_date`
+    ("YYYY-MM-DD", both included) and an optional `broker` and `tier` restricting the total
+    :return: A JSON response with the status "Pass" and, in request order, one dictionary per range
+    with its start date, end date, broker, tier and total loan amount. Malformed ranges or more than
+    `MAX_RANGES` ranges get an HttpResponseBadRequest, as do other request methods.
+    """
+    if request.method == "POST":
+        params = request_params(request)
+        ranges = params.get("ranges") if params is not None else None
+        if not isinstance(ranges, list) or len(ranges) > MAX_RANGES:
+            return HttpResponseBadRequest(
+                f"ranges must be a list of at most {MAX_RANGES} ranges"
+            )
 
+        version = (await adata_state(request))[0]
         result_list = []
-        for item in query_results:
-            if item:
-                result_list.append(
-                    {
-                        "Start Date": start_date,
-                        "End Date": end_date,
-                        "Total Loan Amount": round(item.total_loan_amount, 4),
-                    }
+        for item in ranges:
+            try:
+                start_date = datetime.strptime(item["start_date"], "%Y-%m-%d").date()
+                end_date = datetime.strptime(item["end_date"], "%Y-%m-%d").date()
+                broker, tier = item.get("broker"), item.get("tier")
+                if not all(v is None or isinstance(v, str) for v in (broker, tier)):
+                    raise TypeError
+            except (KeyError, TypeError, ValueError, AttributeError):
+                return HttpResponseBadRequest(
+                    "Every range needs a valid start_date and end_date"
                 )
 
+            series = await prefix_index.aget(version, broker, tier)
+            result_list.append(
+                {
+                    "Start Date": start_date,
+                    "End Date": end_date,
+                    "Broker": broker,
+                    "Tier": tier,
+                    "Total Loan Amount": series.total(start_date, end_date),
+                }
+            )
+
         return JsonResponse({"status": "Pass", "details": result_list})
     else:
         return HttpResponseBadRequest("Method Not Allowed")
+
+
+@conditional_report
+@cached_report
+async def loan_statistics(request):
+    """
+    This Python function reports the distribution of `Total Loan Amount` per broker: the number of
+    loans, the mean, percentiles and the largest loans, for all or selected brokers in one request.
+
+    :param request: The `loan_statistics` function takes a GET or POST request whose parameters may name
+    a `broker` or a list of `brokers` (all brokers when neither is given), the number of largest loans
+    `top` (default `DEFAULT_TOP`, at most `TOP_MAX`) and a list of `percentiles` between 1 and 100
+    (default 50, 90 and 99). Percentiles and top loans are read in index order by
+    `broker_statistics`, so only the returned loans leave the database
+    :return: A JSON response with the status "Pass" and one dictionary per broker with its name, the
+    number of loans, the mean loan amount, the nearest-rank percentiles keyed "p50", "p90", ... and the
+    top loans (Xref, settlement date and amount, largest first). Invalid parameters get an
+    HttpResponseBadRequest, as do other request methods.
+    """
+    if request.method in ("GET", "POST"):
+        params = request_params(request)
+        if params is None:
+            return HttpResponseBadRequest("Request body must be a JSON object")
+        brokers = list_param(params, "brokers")
+        broker = list_param(params, "broker")
+        if brokers is None or broker is None:
+            return HttpResponseBadRequest("broker and brokers must be names")
+
+        percentiles = params.get("percentiles", DEFAULT_PERCENTILES)
+        if not isinstance(percentiles, list):
+            percentiles = [percentiles]
+        try:
+            top = int(params.get("top", DEFAULT_TOP))
+            percentiles = sorted({int(percentile) for percentile in percentiles})
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest("top and percentiles must be integers")
+        if not 0 <= top <= TOP_MAX or not all(1 <= p <= 100 for p in percentiles):
+            return HttpResponseBadRequest(
+                f"top must be between 0 and {TOP_MAX}, percentiles between 1 and 100"
+            )
+
+        result_list = await sync_to_async(broker_statistics)(
+            brokers + broker, top, percentiles
+        )
+        return JsonResponse({"status": "Pass", "details": result_list})
+    else:
+        return HttpResponseBadRequest("Method Not Allowed")
+
+
+@conditional_report
+@cached_report
+async def aggregate(request):
+    """
+    This Python function answers one or several aggregations of the loan data in a single request, so
+    a dashboard can fetch every figure it shows with one call.
+
+    :param request: The `aggregate` function takes a GET or POST request whose parameters are one
+    aggregation: `group_by` dimensions ("Settlement Date", "Month", "Broker", "Sub Broker", "Tier"),
+    `metrics` ("count" or "sum", "max" or "avg" of an amount column, e.g. "sum:Total Loan Amount")
+    and optional `broker`, `sub_broker`, `tier`, `start_date` and `end_date` filters. A POST body may
+    instead hold a `queries` object naming up to `MAX_QUERIES` such aggregations. Each aggregation is
+    compiled into one parameterized query by `compile_query`, or answered from the columnar snapshot
+    when `settings.ANALYTICS_SNAPSHOT` is enabled and the snapshot is up to date
+    :return: A JSON response with the status "Pass" and the rows of the aggregation (one dictionary per
+    group, keyed by dimension and metric names), or for `queries` an object mapping each name to its
+    rows. Invalid aggregations get an HttpResponseBadRequest, as do other request methods.
+    """
+    if request.method in ("GET", "POST"):
+        params = request_params(request)
+        if params is None:
+            return HttpResponseBadRequest("Request body must be a JSON object")
+
+        queries = params.get("queries")
+        version = (await adata_state(request))[0]
+        try:
+            if queries is None:
+                result = await run_aggregation(params, version)
+            elif isinstance(queries, dict) and 0 < len(queries) <= MAX_QUERIES:
+                result = {
+                    name: await run_aggregation(spec, version)
+                    for name, spec in queries.items()
+                }
+            else:
+                raise ValueError(
+                    f"queries must be an object of 1 to {MAX_QUERIES} aggregations"
+                )
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+
+        return JsonResponse({"status": "Pass", "details": result})
+    else:
+        return HttpResponseBadRequest("Method Not Allowed")
+
+
+@conditional_report
+def export(request, name):
+    """
+    The `export` function streams the raw `InvoiceData` rows or a whole report as CSV or NDJSON. Rows
+    are read from the database in chunks of `settings.EXPORT_CHUNK_SIZE` while the response is being
+    sent, so memory use does not grow with the size of the export, under WSGI and ASGI alike.
+
+    :param request: The HttpRequest; `format` selects "csv" (the default) or "ndjson". The "invoices"
+    export resumes after the Xref given in `after`, and the "broker_report" export takes the `broker`,
+    `brokers` and `periods` parameters of `broker_report`.
+    :param name: One of "invoices", "total_loan_amount", "number_of_loans", "highest_loan_amount" or
+    "broker_report".
+    :return: A StreamingHttpResponse with the export as an attachment, a 404 response for an unknown
+    export, or an HttpResponseBadRequest for invalid parameters and non-GET requests.
+    """
+    if request.method == "GET":
+        if name not in EXPORTS:
+            raise Http404(f"Unknown export {name}")
+        fmt = request.GET.get("format", "csv")
+        if fmt not in FORMATS:
+            return HttpResponseBadRequest("format must be one of: csv, ndjson")
+
+        try:
+            header, rows = EXPORTS[name](request_params(request))
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+
+        lines, content_type = FORMATS[fmt]
+        content = lines(header, rows)
+        if isinstance(request, ASGIRequest):
+            content = async_lines(content, settings.EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{name}.{fmt}"'
+        return response
+    else:
+        return HttpResponseBadRequest("Method Not Allowed")
+
+
+async def report_cache_stats(request):
+    """
+    The `report_cache_stats` function exposes the hit and miss counters of the report result cache.
+
+    :param request: The HttpRequest object; only GET is allowed.
+    :return: A JsonResponse with the status "Pass" and the cache hits, misses, hit rate and current
+    data version, or an HttpResponseBadRequest for other request methods.
+    """
+    if request.method == "GET":
+        return JsonResponse(
+            {"status": "Pass", "details": await sync_to_async(cache_stats)()}
+        )
+    else:
+        return HttpResponseBadRequest("Method Not Allowed")
@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "etl",
+    "operations",
 ]
 
 MIDDLEWARE = [
@@ -50,6 +51,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "operations.profiling.QueryProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "tax_invoice.urls"
@@ -76,10 +78,28 @@ WSGI_APPLICATION = "tax_invoice.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# High-concurrency SQLite mode: new connections apply `SQLITE_PRAGMAS`, switching the database to WAL
+# so report reads are not blocked while an ingest transaction writes, and are reused for
+# `CONN_MAX_AGE` seconds. Work that still finds the database locked once `busy_timeout` (ms) has run
+# out is retried `SQLITE_BUSY_RETRIES` times, waiting `SQLITE_BUSY_BACKOFF` seconds, then doubling.
+SQLITE_CONCURRENCY = os.environ.get("SQLITE_CONCURRENCY", "0") == "1"
+SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -64_000,  # in KiB
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "memory",
+    "busy_timeout": 5_000,
+}
+SQLITE_BUSY_RETRIES = 5
+SQLITE_BUSY_BACKOFF = 0.05
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "CONN_MAX_AGE": 600 if SQLITE_CONCURRENCY else 0,
+        "CONN_HEALTH_CHECKS": SQLITE_CONCURRENCY,
     }
 }
 
@@ -125,3 +145,74 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 UPLOAD_FILES = "pdf_file_uploads"
+
+# Number of background threads running ingestion jobs queued by `etl.views.upload_file`.
+ETL_WORKERS = int(os.environ.get("ETL_WORKERS", 4))
+
+# Worker processes used to extract a statement's page ranges in parallel (1 reads the whole document
+# in one tabula call). Documents are only split when every worker gets at least
+# `ETL_MIN_PAGES_PER_WORKER` pages, so small statements do not pay for extra JVM start-ups.
+ETL_EXTRACT_WORKERS = int(os.environ.get("ETL_EXTRACT_WORKERS", 1))
+ETL_MIN_PAGES_PER_WORKER = 25
+
+# Streaming ingestion reads `ETL_PAGES_PER_READ` pages per tabula call and commits rows in batches of
+# `ETL_BATCH_SIZE`, so worker memory is bounded by the batch rather than the statement size.
+ETL_STREAMING = os.environ.get("ETL_STREAMING", "0") == "1"
+ETL_BATCH_SIZE = 5_000
+ETL_PAGES_PER_READ = 50
+
+# Parsed statements are cached per PDF content hash, so resent statements skip tabula. Least recently
+# used entries are evicted beyond `ETL_CACHE_MAX_BYTES`; 0 disables the cache.
+ETL_CACHE_DIR = BASE_DIR / "statement_cache"
+ETL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Long-lived extraction worker processes, each keeping tabula's JVM warm through jpype (0 runs a fresh
+# Java process per tabula call). Workers are recycled after `ETL_WARM_EXTRACTOR_MAX_TASKS` requests.
+ETL_WARM_EXTRACTORS = int(os.environ.get("ETL_WARM_EXTRACTORS", 0))
+ETL_WARM_EXTRACTOR_MAX_TASKS = 500
+
+# Statement formats get a layout template (table area and column boundaries) learned from the first
+# `ETL_LAYOUT_SAMPLE_PAGES` pages, then extracted with fixed columns instead of table detection.
+ETL_LAYOUT_TEMPLATES = os.environ.get("ETL_LAYOUT_TEMPLATES", "0") == "1"
+ETL_LAYOUT_SAMPLE_PAGES = 3
+
+# Report results are cached in the `REPORT_CACHE` cache, keyed by the data version bumped on every
+# ingest, so entries never go stale; swap the backend (e.g. Redis) to share them between processes.
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "reports": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "reports",
+        "TIMEOUT": 24 * 60 * 60,
+        "OPTIONS": {"MAX_ENTRIES": 1_000},
+    },
+}
+REPORT_CACHE = "reports"
+
+# Rows fetched per database query by the streaming exports of `operations.views.export`.
+EXPORT_CHUNK_SIZE = 2_000
+
+# Every statement ingestion writes one JSON line with its stage timings, page and row counts and peak
+# memory to the `etl.metrics` logger; the histograms behind them are served at /etl/metrics/.
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "etl": {"handlers": ["console"], "level": "INFO"},
+        "operations": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
+# Opt-in query profiling by `operations.profiling.QueryProfilingMiddleware`: every request logs its
+# query count and time, and requests with a query slower than `QUERY_PROFILING_SLOW_MS` or a statement
+# repeated `QUERY_PROFILING_REPEAT_THRESHOLD` times (N+1) are stored with EXPLAIN plans in the admin.
+QUERY_PROFILING = os.environ.get("QUERY_PROFILING", "0") == "1"
+QUERY_PROFILING_SLOW_MS = 100
+QUERY_PROFILING_REPEAT_THRESHOLD = 10
+
+# Optional columnar snapshot of `InvoiceData` answering the `aggregate` endpoint with numpy group-bys:
+# one file per column under `ANALYTICS_SNAPSHOT_DIR`, memory-mapped (and so shared through the page
+# cache) by every worker process, appended by each ingest batch and rebuilt with `build_snapshot`.
+ANALYTICS_SNAPSHOT = os.environ.get("ANALYTICS_SNAPSHOT", "0") == "1"
+ANALYTICS_SNAPSHOT_DIR = BASE_DIR / "analytics_snapshot"